@@ -0,0 +1,323 @@
+"""
+离线基准测试：只用 bench/fixtures/ 中的页面样本和本地替身服务器，不访问网络。
+
+  python bench/bench_tieba.py                  # 运行全部项目，并与 bench/baseline.json 对比
+  python bench/bench_tieba.py --save-baseline  # 把本次结果保存为基线
+  python bench/bench_tieba.py --only parse     # 只运行名字包含 parse 的项目
+
+解析类项目测 is_valid_speech / has_next_page / 风控扫描 / 列表页、帖子页、楼中楼解析的吞吐；
+crawl_* 项目用替身服务器跑一遍完整采集（列表页 -> 50个帖子，含5个200楼长帖和楼中楼），报告 页/秒、楼层/秒；
+Cookie池需要Redis（主程序中的 REDIS_HOST），用独立的key前缀，结束后删除，连不上Redis时跳过这两项（结果表中标明）。
+仓库中的 bench/baseline.json 只含解析类项目（--min-time 2 --repeat 5 测得），基线与机器相关，换机器后先重新保存。
+任一项目比基线慢超过 --threshold 时以返回码1退出
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import importlib.util
+import redis
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+sys.path.insert(0, ROOT)
+
+import lxml.html
+from tieba_fetcher import unwrap_pagelets
+from tieba_parser import (
+    scan_risk, is_valid_speech, has_next_page, parse_thread_list, parse_thread_page, parse_lzl_page,
+    parse_total_comment,
+)
+
+LONG_PAGES = 7
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+class Fixtures:
+    def __init__(self):
+        self.list_raw = fixture("list_page.html")
+        self.list_page = unwrap_pagelets(self.list_raw)
+        self.short = fixture("thread_short.html")
+        self.long = [fixture(f"thread_long_p{pn}.html") for pn in range(1, LONG_PAGES + 1)]
+        self.lzl = [fixture("lzl_p1.html"), fixture("lzl_p2.html")]
+        self.total_comment = fixture("total_comment.json")
+        self.captcha = fixture("captcha.html")
+        self.login = fixture("login.html")
+        self.thread_pages = [self.short] + self.long
+        self.all_pages = [self.list_page] + self.thread_pages + self.lzl + [self.captcha, self.login]
+        self.texts = [p.text for page in self.thread_pages for p in parse_thread_page(page).posts]
+        self.texts += [c for page in self.lzl for c in parse_lzl_page(page).comments]
+
+
+# ---------- 解析类项目：fn() 返回 (页数, 楼层数) ----------
+
+def bench_is_valid_speech(fx):
+    texts = fx.texts
+
+    def run():
+        for t in texts:
+            is_valid_speech(t)
+        return len(texts), 0
+    return run, "texts"
+
+
+def bench_has_next_page(fx):
+    docs = [lxml.html.fromstring(p) for p in fx.thread_pages + fx.lzl]
+
+    def run():
+        for d in docs:
+            has_next_page(d)
+        return len(docs), 0
+    return run, "pages"
+
+
+def bench_scan_risk(fx):
+    pages = fx.all_pages
+
+    def run():
+        for p in pages:
+            scan_risk(p)
+        return len(pages), 0
+    return run, "pages"
+
+
+def bench_parse_thread_list(fx):
+    def run():
+        parse_thread_list(fx.list_page, "https://tieba.baidu.com")
+        return 1, 0
+    return run, "pages"
+
+
+def bench_parse_thread_page(fx):
+    def run():
+        floors = 0
+        for p in fx.thread_pages:
+            floors += len(parse_thread_page(p).posts)
+        return len(fx.thread_pages), floors
+    return run, "pages"
+
+
+def bench_parse_lzl(fx):
+    def run():
+        for p in fx.lzl:
+            parse_lzl_page(p)
+        parse_total_comment(fx.total_comment)
+        return len(fx.lzl) + 1, 0
+    return run, "pages"
+
+
+# ---------- 完整采集：本地替身服务器 ----------
+
+def make_handler(fx):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            u = urlparse(self.path)
+            q = parse_qs(u.query)
+            pn = int(q.get("pn", ["1"])[0])
+            if u.path == "/f":
+                body, ctype = fx.list_raw, "text/html"
+            elif u.path == "/p/totalComment":
+                body, ctype = fx.total_comment, "application/json"
+            elif u.path == "/p/comment":
+                body, ctype = fx.lzl[min(pn, 2) - 1], "text/html"
+            elif u.path.startswith("/p/"):
+                tid = int(u.path.rsplit("/", 1)[1])
+                # 列表页里tid末位为1的帖子是200楼长帖，其余为短帖
+                body = fx.long[min(pn, LONG_PAGES) - 1] if tid % 10 == 1 else fx.short
+                ctype = "text/html"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", f"{ctype}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+class CrawlBench:
+    """在临时目录里加载 tieba-spidering.py，指向替身服务器，速率限制放到最大，Cookie/代理池用独立的Redis key"""
+
+    def __init__(self, fx):
+        self.workdir = tempfile.mkdtemp(prefix="tieba-bench-")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(fx))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        cwd = os.getcwd()
+        os.chdir(self.workdir)
+        try:
+            with open("cookies.txt", "w", encoding="utf-8") as f:
+                f.write("\n".join(f"BDUSS=bench{i}; STOKEN=bench{i}" for i in range(4)))
+            spec = importlib.util.spec_from_file_location("tieba_spidering", os.path.join(ROOT, "tieba-spidering.py"))
+            self.spider = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(self.spider)
+        finally:
+            os.chdir(cwd)
+        sp = self.spider
+        logging.getLogger("tieba").setLevel(logging.WARNING)
+        sp.TIEBA_BASE_URL = f"http://127.0.0.1:{self.server.server_address[1]}"
+        sp.COOKIES_TXT = os.path.join(self.workdir, "cookies.txt")
+        sp.PROXIES_TXT = os.path.join(self.workdir, "proxies.txt")
+        sp.RATE_CONTROLLER = sp.RateController(os.path.join(self.workdir, "rate.json"), start_rate=1e9,
+                                               min_rate=1e9, max_rate=1e9, jitter=0)
+        self.redis = sp.get_redis_conn()
+        try:
+            self.redis.ping()
+        except redis.ConnectionError:
+            self.server.shutdown()
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            raise
+        self.redis_prefix = f"tieba_bench:{os.getpid()}"
+        sp.COOKIE_POOL = sp.CookiePool(self.redis, f"{self.redis_prefix}:cookies")
+        sp.PROXY_POOL = sp.ProxyPool(self.redis, f"{self.redis_prefix}:proxies")
+        self.round = 0
+
+    def _fresh_store(self):
+        self.round += 1
+        sp = self.spider
+        sp.CHECKPOINTS.close()
+        sp.CORPUS_STORE = sp.CorpusStore(os.path.join(self.workdir, f"corpus{self.round}"))
+        sp.CHECKPOINTS = sp.CheckpointJournal(os.path.join(self.workdir, f"ckpt{self.round}.db"))
+
+    def _counts(self):
+        m = self.spider.METRICS
+        return m.counter_total("tieba_pages_total"), m.counter_total("tieba_floors_total")
+
+    def runner(self, mode):
+        sp = self.spider
+
+        def run():
+            self._fresh_store()
+            pages0, floors0 = self._counts()
+            if mode == "async":
+                asyncio.run(sp.async_batch_crawl_tieba(["bench"], max_pages=1, max_floors_per_thread=200))
+            else:
+                sp.batch_crawl_tieba_selenium(["bench"], max_pages=1, max_floors_per_thread=200)
+            pages1, floors1 = self._counts()
+            return pages1 - pages0, floors1 - floors0
+        return run
+
+    def close(self):
+        self.server.shutdown()
+        keys = list(self.redis.scan_iter(f"{self.redis_prefix}:*"))
+        if keys:
+            self.redis.delete(*keys)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# ---------- 计时与基线对比 ----------
+
+def measure(run, min_time, repeat):
+    """重复调用直到累计 min_time 秒，取 repeat 轮中最快的一轮，返回 (单位/秒, 楼层/秒)"""
+    best = None
+    for _ in range(repeat):
+        units = floors = 0
+        start = time.perf_counter()
+        while True:
+            u, f = run()
+            units += u
+            floors += f
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        rate = (units / elapsed, floors / elapsed)
+        if best is None or rate[0] > best[0]:
+            best = rate
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="贴吧爬虫离线基准测试")
+    parser.add_argument("--only", default="", help="只运行名字包含该字符串的项目")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入 bench/baseline.json")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--threshold", type=float, default=0.15, help="比基线慢超过该比例视为退步")
+    parser.add_argument("--min-time", type=float, default=1.0, help="每轮最少运行秒数")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    fx = Fixtures()
+    benches = [
+        ("is_valid_speech", *bench_is_valid_speech(fx)),
+        ("has_next_page", *bench_has_next_page(fx)),
+        ("scan_risk", *bench_scan_risk(fx)),
+        ("parse_thread_list", *bench_parse_thread_list(fx)),
+        ("parse_thread_page", *bench_parse_thread_page(fx)),
+        ("parse_lzl", *bench_parse_lzl(fx)),
+    ]
+    crawl = None
+    if any(args.only in name for name in ("crawl_sync", "crawl_async")):
+        try:
+            crawl = CrawlBench(fx)
+            benches += [("crawl_sync", crawl.runner("sync"), "pages"), ("crawl_async", crawl.runner("async"), "pages")]
+        except redis.ConnectionError as e:
+            print(f"连不上Redis，跳过 crawl_* 项目：{e}")
+            benches += [("crawl_sync", None, "pages"), ("crawl_async", None, "pages")]
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    skipped = []
+    print(f"{'项目':<20}{'吞吐':>18}{'楼层/秒':>12}{'对比基线':>12}")
+    try:
+        for name, run, unit in benches:
+            if args.only not in name:
+                continue
+            if run is None:
+                skipped.append(name)
+                print(f"{name:<20}{'跳过（Redis不可用）':>18}")
+                continue
+            rate, floor_rate = measure(run, args.min_time, args.repeat)
+            results[name] = {"rate": rate, "unit": unit, "floors_per_sec": floor_rate}
+            compare = ""
+            if name in baseline:
+                change = rate / baseline[name]["rate"] - 1
+                compare = f"{change:+.1%}"
+                if change < -args.threshold:
+                    regressions.append(name)
+                    compare += " 退步"
+            floors = f"{floor_rate:.0f}" if floor_rate else "-"
+            print(f"{name:<20}{rate:>12.1f} {unit + '/s':<8}{floors:>10}{compare:>14}")
+    finally:
+        if crawl is not None:
+            crawl.close()
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+    elif not baseline:
+        print("没有基线文件，可用 --save-baseline 保存本次结果")
+    if skipped:
+        print(f"以下项目未运行，没有与基线对比：{', '.join(skipped)}")
+    if regressions:
+        print(f"以下项目比基线慢超过 {args.threshold:.0%}：{', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+生成基准测试用的贴吧页面样本（bench/fixtures/）。
+页面结构按贴吧PC版的标记整理：吧页帖子列表包在 <code><!-- --></code> pagelet 里，
+帖子楼层为 div.l_post + data-field JSON，楼中楼入口 a.j_lzl_s_p，/p/comment 与 /p/totalComment 同线上格式。
+随机数固定种子，重新生成的文件与仓库中的一致
+"""
+import os
+import json
+import random
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FORUM_ID = 2862817
+LONG_THREAD_FLOORS = 200
+FLOORS_PER_PAGE = 30
+LIST_THREADS = 50
+
+SENTENCES = [
+    "楼主说得很有道理，我之前也遇到过一模一样的情况",
+    "这个版本的平衡性确实有问题，希望官方早点修复",
+    "昨天去现场看了，氛围真的很好，下次还要再去",
+    "有没有大佬知道这个怎么解决，折腾了一晚上都没弄好",
+    "说实话我觉得没必要吵成这样，大家各退一步吧",
+    "收藏了，回头慢慢看，感谢楼主的整理",
+    "前排围观，顺便问一下后续还有更新吗",
+    "这波操作我是真没看懂，有人能解释一下吗",
+    "我朋友也是这么说的，看来不是个例",
+    "价格有点贵了，等打折再入手吧",
+]
+NOISE = ["顶", "[图片]", "[表情]", "签到", "吧务提醒：请文明发言", "本帖最后由 楼主 于 2024-05-01 编辑",
+         "来自Android客户端", "mark", "66666666", "广告位招租"]
+
+PAGE_HEAD = """<!DOCTYPE html><html><head><meta charset="UTF-8"><title>{title}_{bar}吧_百度贴吧</title>
+<link rel="stylesheet" href="//tb1.bdstatic.com/tb/_/common_{n}.css"/>
+<script>var PageData = {{"tbs":"4d1c3f0b6e8a2c7d1714032000","forum":{{"forum_id":{fid},"forum_name":"{bar}"}},"user":{{"is_login":1}}}};
+window.alogObjectConfig = {{product: '20', page: '20_1', monkey_page: 'pb-new'}};</script>
+<script>{filler}</script>
+<style>.l_post{{margin:0}} .d_post_content{{word-wrap:break-word}}</style>
+</head><body class="skin_normal"><div id="head"><div class="search_top">百度贴吧</div>
+<ul class="nav_list"><li><a href="/f?kw={bar}">看帖</a></li><li><a href="/f?kw={bar}&tab=good">精品</a></li></ul></div>
+"""
+PAGE_TAIL = """<div class="footer">&copy;2024 Baidu <a href="/tb/eula.html">贴吧协议</a></div>
+<script>{filler}</script></body></html>"""
+
+
+def filler_js(rng, size):
+    words = ["function", "var", "return", "window", "document", "PageData", "Bdbox", "alog", "tbs"]
+    return ";".join(f"{rng.choice(words)}_{i}=function(){{return {rng.randint(0, 99999)}}}" for i in range(size))
+
+
+def speech(rng):
+    if rng.random() < 0.25:
+        return rng.choice(NOISE)
+    return "，".join(rng.sample(SENTENCES, rng.randint(1, 3)))
+
+
+def post_html(rng, tid, floor, has_lzl):
+    pid = 140_000_000_000 + tid * 1000 + floor
+    field = {
+        "author": {"user_id": rng.randint(10 ** 8, 10 ** 9), "user_name": f"贴吧用户_{rng.randint(1000, 9999)}",
+                   "props": None},
+        "content": {"post_id": pid, "is_anonym": False, "forum_id": FORUM_ID, "thread_id": tid,
+                    "content": "", "post_no": floor, "type": "0", "comment_num": 12 if has_lzl else 0,
+                    "props": None, "post_index": floor - 1, "pb_tpoint": None},
+    }
+    lzl = ('<div class="core_reply_tail"><a class="lzl_link_unfold j_lzl_s_p" href="#">回复(12)</a></div>'
+           if has_lzl else '<div class="core_reply_tail"><a class="lzl_link_unfold" href="#">回复</a></div>')
+    return (
+        f"<div class=\"l_post l_post_bright j_l_post clearfix\" data-field='{json.dumps(field, ensure_ascii=False)}'>"
+        f'<div class="d_author"><ul class="p_author"><li class="icon"><img src="//gss0.bdstatic.com/6LZ1dD3d1sgCo2Kml5_Y_D3/sys/portrait/item/{pid}"/></li>'
+        f'<li class="d_name"><a class="p_author_name j_user_card">{field["author"]["user_name"]}</a></li>'
+        f'<li class="l_badge"><div class="d_badge_title">等级{rng.randint(1, 18)}</div></li></ul></div>'
+        f'<div class="d_post_content_main"><div class="p_content"><cc>'
+        f'<div id="post_content_{pid}" class="d_post_content j_d_post_content clearfix" style="display:;">{speech(rng)}</div>'
+        f'</cc></div>{lzl}<div class="post-tail-wrap"><span class="tail-info">{floor}楼</span>'
+        f'<span class="tail-info">2024-05-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}</span></div>'
+        f'</div></div>'
+    )
+
+
+def pager(pn, total_pages, base):
+    if total_pages <= 1:
+        return ""
+    links = "".join(f'<a href="{base}?pn={i}">{i}</a>' for i in range(1, total_pages + 1) if i != pn)
+    nxt = f'<a href="{base}?pn={pn + 1}">下一页</a><a href="{base}?pn={total_pages}">尾页</a>' if pn < total_pages else ""
+    return f'<li class="l_pager pager_theme_4 pb_list_pager">{links}{nxt}</li>'
+
+
+def thread_page(rng, tid, title, pn, floors, total_pages):
+    posts = "".join(post_html(rng, tid, f, rng.random() < 0.3) for f in floors)
+    return (PAGE_HEAD.format(title=title, bar="bench", n=pn, fid=FORUM_ID, filler=filler_js(rng, 400))
+            + f'<div id="j_p_postlist" class="p_postlist">{posts}</div>'
+            + f'<div class="pb_footer">{pager(pn, total_pages, f"/p/{tid}")}</div>'
+            + PAGE_TAIL.format(filler=filler_js(rng, 200)))
+
+
+def list_page(rng):
+    items = []
+    for i in range(LIST_THREADS):
+        tid = 9_000_000_000 + i
+        field = {"id": tid, "author_name": f"贴吧用户_{rng.randint(1000, 9999)}", "first_post_id": tid * 10,
+                 "reply_num": rng.randint(0, 500), "is_bakan": None, "vid": "", "is_good": None, "is_top": None}
+        items.append(
+            f"<li class=\" j_thread_list clearfix thread_item_box\" data-field='{json.dumps(field, ensure_ascii=False)}'>"
+            f'<div class="t_con cleafix"><div class="col2_left j_threadlist_li_left">'
+            f'<span class="threadlist_rep_num center_text" title="回复">{field["reply_num"]}</span></div>'
+            f'<div class="col2_right j_threadlist_li_right"><div class="threadlist_title pull_left j_th_tit">'
+            f'<a rel="noopener" href="/p/{tid}" title="{speech(rng)[:20]}" target="_blank" class="j_th_tit">{speech(rng)[:20]}</a>'
+            f'</div><div class="threadlist_abs threadlist_abs_onlyline">{speech(rng)}</div></div></div></li>'
+        )
+    pagelet = f'<ul id="thread_list" class="threadlist_bright j_threadlist_bright">{"".join(items)}</ul>'
+    return (PAGE_HEAD.format(title="bench", bar="bench", n=0, fid=FORUM_ID, filler=filler_js(rng, 600))
+            + f'<div class="content"><code class="pagelet_html" id="pagelet_html_frs-list/pagelet/thread_list" style="display:none;"><!--{pagelet}--></code></div>'
+            + '<div id="frs_list_pager" class="pagination-default"><a href="/f?kw=bench&pn=50" class="next pagination-item">下一页&gt;</a></div>'
+            + PAGE_TAIL.format(filler=filler_js(rng, 200)))
+
+
+def lzl_page(rng, pn, total_pages):
+    items = "".join(
+        f'<li class="lzl_single_post j_lzl_s_p"><a class="at j_user_card">贴吧用户_{rng.randint(1000, 9999)}</a>：'
+        f'<span class="lzl_content_main">{speech(rng)}</span>'
+        f'<div class="lzl_content_reply"><span class="lzl_time">2024-5-{rng.randint(1, 28)} 12:00</span></div></li>'
+        for _ in range(10)
+    )
+    pages = "".join(f'<a href="#{i}">{i}</a>' for i in range(1, total_pages + 1))
+    nxt = '<a href="#">下一页</a>' if pn < total_pages else ""
+    return f'<ul>{items}</ul><li class="lzl_li_pager j_lzl_l_p"><p class="j_pager l_pager pager_theme_2">{pages}{nxt}</p></li>'
+
+
+def total_comment(rng):
+    comment_list = {}
+    for floor in range(1, 31):
+        pid = 140_000_000_000 + 9_000_000_001 * 1000 + floor
+        if rng.random() < 0.3:
+            n = rng.choice([3, 10, 12])
+            comment_list[str(pid)] = {
+                "comment_num": n,
+                "comment_info": [{"comment_id": pid * 10 + k, "content": speech(rng),
+                                  "username": f"贴吧用户_{rng.randint(1000, 9999)}"} for k in range(min(n, 10))],
+            }
+    return json.dumps({"errno": 0, "errmsg": "success", "data": {"comment_list": comment_list, "user_list": {}}},
+                      ensure_ascii=False)
+
+
+CAPTCHA_PAGE = """<!DOCTYPE html><html><head><meta charset="UTF-8"><title>百度安全验证</title></head>
+<body><div class="timeout-title">百度安全验证</div><div class="timeout-desc">网络不给力，请稍后重试</div>
+<div class="vcode-body"><p>请输入验证码</p><p>系统检测到您的请求存在异常，请完成下方验证后继续访问</p>
+<div id="vcode-spin" class="vcode-spin"></div></div>
+<script src="https://wappass.baidu.com/static/machine/js/api/mkd.js"></script></body></html>"""
+
+LOGIN_PAGE = """<!DOCTYPE html><html><head><meta charset="UTF-8"><title>百度贴吧</title></head>
+<body><div class="tb-login"><h3>登录百度帐号</h3><div class="pass-login">请在手机上确认登录，或使用帐号密码登录</div>
+<form action="https://passport.baidu.com/v2/api/?login" method="post"><input name="userName"/><input name="password" type="password"/></form>
+</div></body></html>"""
+
+
+def write(name, content):
+    with open(os.path.join(FIXTURE_DIR, name), "w", encoding="utf-8", newline="\n") as f:
+        f.write(content)
+
+
+def main():
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    rng = random.Random(20240501)
+    write("list_page.html", list_page(rng))
+    write("thread_short.html", thread_page(rng, 9_000_000_000, "短帖", 1, range(1, 9), 1))
+    pages = (LONG_THREAD_FLOORS + FLOORS_PER_PAGE - 1) // FLOORS_PER_PAGE
+    for pn in range(1, pages + 1):
+        floors = range((pn - 1) * FLOORS_PER_PAGE + 1, min(pn * FLOORS_PER_PAGE, LONG_THREAD_FLOORS) + 1)
+        write(f"thread_long_p{pn}.html", thread_page(rng, 9_000_000_001, "长帖", pn, floors, pages))
+    write("lzl_p1.html", lzl_page(rng, 1, 2))
+    write("lzl_p2.html", lzl_page(rng, 2, 2))
+    write("total_comment.json", total_comment(rng))
+    write("captcha.html", CAPTCHA_PAGE)
+    write("login.html", LOGIN_PAGE)
+    print(f"样本已写入 {FIXTURE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
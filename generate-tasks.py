@@ -1,21 +1,81 @@
-import json
+import os
+import math
+import time
+from tieba_fetcher import HttpFetcher
+from tieba_parser import parse_forum_page, check_page
+from tieba_tasks import task_line
 
 # 1. 你的吧列表
 bar_list = ['原神内鬼', '有男不玩ml', '半壁江山雪之下', '二游笑话']
 
-# 2. 每个吧要爬的起止页数，可统一设置，也可单独设置
+# 2. 每个吧要爬的起止页数；探测到吧的实际页数更少时以实际页数为准
 page_start = 1
-page_end = 16   # 假如每个吧都爬前16页
+page_end = 16   # 假如每个吧最多爬前16页
 
-# 3. 分割任务的粒度（每个任务多少页，建议小批量，方便分布式）
-pages_per_task = 2
+# 3. 按预计耗时切分任务：先抓每个吧第1页，探测总页数和帖子回复数，估算每页列表页的采集耗时，
+#    每个任务凑够约 TARGET_TASK_MINUTES 分钟。探测失败的吧按 FALLBACK_PAGES_PER_TASK 切分
+PROBE = True
+TARGET_TASK_MINUTES = 20
+SECONDS_PER_REQUEST = 5.5      # 单个身份平均每次请求的耗时（含限速等待），与主程序 SLEEP_THREAD 区间相当
+FLOORS_PER_PAGE = 30           # 帖子每页楼层数
+MAX_FLOORS_PER_THREAD = 200    # 与主程序 max_floors_per_thread 一致
+USE_THREAD_FRONTIER = True     # 与主程序一致：列表页任务只把帖子推入共享队列，每页列表页只算一次请求
+MAX_PAGES_PER_TASK = 50
+FALLBACK_PAGES_PER_TASK = 2
+TIEBA_BASE_URL = "https://tieba.baidu.com"
+COOKIES_TXT = "cookies.txt"
+MY_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0"
+
+
+def estimate_page_seconds(threads):
+    """一页列表页的预计采集耗时：列表页本身 + 每个帖子的页数（每页还有一次楼中楼批量请求）"""
+    requests = 1
+    if not USE_THREAD_FRONTIER:
+        for t in threads:
+            floors = min((t.reply_num or 0) + 1, MAX_FLOORS_PER_THREAD)
+            requests += 2 * math.ceil(floors / FLOORS_PER_PAGE)
+    return requests * SECONDS_PER_REQUEST
+
+
+def probe_bar(fetcher, bar):
+    """返回 (实际页数或None, 每页预计秒数)，失败返回 (None, None)"""
+    url = f'{TIEBA_BASE_URL}/f?kw={bar}&pn=0'
+    try:
+        _, _, page_source = fetcher.fetch(url)
+        check_page(page_source, url)
+    except Exception as e:
+        print(f"[{bar}] 探测失败：{e}")
+        return None, None
+    page = parse_forum_page(page_source, TIEBA_BASE_URL)
+    if not page.threads:
+        print(f"[{bar}] 第1页没有解析到帖子，按默认粒度切分")
+        return page.page_count, None
+    return page.page_count, estimate_page_seconds(page.threads)
+
+
+# 4. 探测并生成任务
+cookie = None
+if PROBE and os.path.exists(COOKIES_TXT):
+    with open(COOKIES_TXT, "r", encoding="utf-8") as f:
+        cookie = next((line.strip() for line in f if line.strip()), None)
+fetcher = HttpFetcher(MY_UA, cookie_str=cookie) if PROBE else None
 
-# 4. 生成任务
 tasks = []
 for bar in bar_list:
+    pages_per_task = FALLBACK_PAGES_PER_TASK
+    bar_end = page_end
+    if fetcher is not None:
+        page_count, page_seconds = probe_bar(fetcher, bar)
+        if page_count is not None:
+            bar_end = min(page_end, page_count)
+        if page_seconds:
+            pages_per_task = max(1, min(MAX_PAGES_PER_TASK, int(TARGET_TASK_MINUTES * 60 // page_seconds)))
+        size = f"每页约{page_seconds / 60:.1f}分钟" if page_seconds else "耗时未知"
+        print(f"[{bar}] 共{page_count or '?'}页，{size}，采集第{page_start}~{bar_end}页，每个任务{pages_per_task}页")
+        time.sleep(2)
     cur = page_start
-    while cur <= page_end:
-        end = min(cur + pages_per_task - 1, page_end)
+    while cur <= bar_end:
+        end = min(cur + pages_per_task - 1, bar_end)
         task = {
             "bar": bar,
             "page_start": cur,
@@ -23,10 +83,12 @@ for bar in bar_list:
         }
         tasks.append(task)
         cur = end + 1
+if fetcher is not None:
+    fetcher.quit()
 
-# 5. 写入tasks.txt
+# 5. 写入tasks.txt（键排序固定，重复生成的同一任务行完全一致，redis-task.py 据此幂等导入）
 with open("tasks.txt", "w", encoding="utf-8") as f:
     for task in tasks:
-        f.write(json.dumps(task, ensure_ascii=False) + "\n")
+        f.write(task_line(task) + "\n")
 
-print(f"已生成 {len(tasks)} 个任务到 tasks.txt")
\ No newline at end of file
+print(f"已生成 {len(tasks)} 个任务到 tasks.txt")
@@ -0,0 +1,203 @@
+"""
+生成文案时的近义词/反义词替换：
+  - 每句只分词一次，同一遍里先换近义词、再换“不+反义词”（原先两个函数各分词一次）
+  - 查词顺序：meta 下手工维护的 synonyms.json / antonyms.json -> 离线预计算表 -> 现场查HowNet；
+    每个词的结果进LRU缓存，查不到也缓存，不再反复做近邻搜索
+  - 离线预计算表（SQLite，每词一行，近义词/反义词用制表符连接，查不到的词也登记为空行），
+    由 precompute() 对整个模型词表批量生成，可中断后继续。手工词典始终优先，修改后不需要重建
+"""
+import re
+import random
+import sqlite3
+from functools import lru_cache
+
+from markovify.chain import BEGIN, END
+
+from markov_mmap import MarkovMap, load_pickle
+
+_SKIP_RE = re.compile(r'^[\s\W_]+$')  # 纯标点/空白不查词典，与 nlp-analysis 的过滤一致
+_SEP = "\t"
+
+
+class LexiconStore:
+    """离线近反义词表：word -> (近义词, 反义词)，空元组表示查过但没有（负缓存）"""
+
+    def __init__(self, path, busy_timeout=30):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexicon ("
+            "word TEXT PRIMARY KEY, synonyms TEXT NOT NULL, antonyms TEXT NOT NULL) WITHOUT ROWID"
+        )
+
+    @staticmethod
+    def _split(value):
+        return tuple(value.split(_SEP)) if value else ()
+
+    def get(self, word):
+        row = self.conn.execute("SELECT synonyms, antonyms FROM lexicon WHERE word = ?", (word,)).fetchone()
+        if row is None:
+            return None
+        return self._split(row[0]), self._split(row[1])
+
+    def missing(self, words, chunk=500):
+        """words 中尚未登记的词，保持原顺序"""
+        words = list(words)
+        known = set()
+        for i in range(0, len(words), chunk):
+            part = words[i:i + chunk]
+            marks = ",".join("?" * len(part))
+            known.update(w for (w,) in self.conn.execute(f"SELECT word FROM lexicon WHERE word IN ({marks})", part))
+        return [w for w in words if w not in known]
+
+    def put_many(self, rows):
+        """rows: [(词, 近义词, 反义词)]，一个事务写入"""
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO lexicon (word, synonyms, antonyms) VALUES (?, ?, ?)",
+                [(w, _SEP.join(s), _SEP.join(a)) for w, s, a in rows],
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM lexicon").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class Lexicon:
+    """
+    近反义词查询与替换。hownet 是返回 HowNetDict 的函数，第一次现场查询时才加载；
+    live=False 时只用手工词典和离线表，不现场查HowNet
+    """
+
+    def __init__(self, synonyms=None, antonyms=None, hownet=None, store=None, live=True, cache_size=50000, topn=10,
+                 tokenize=None):
+        self.manual_synonyms = synonyms or {}
+        self.manual_antonyms = antonyms or {}
+        self._hownet_factory = hownet
+        self._hownet = None
+        self.store = store
+        self.live = live
+        self.topn = topn
+        self._tokenize = tokenize
+        self.synonyms = lru_cache(maxsize=cache_size)(self._synonyms)
+        self.antonyms = lru_cache(maxsize=cache_size)(self._antonyms)
+
+    @property
+    def hownet(self):
+        if self._hownet is None and self._hownet_factory is not None:
+            self._hownet = self._hownet_factory()
+        return self._hownet
+
+    def tokenize(self, sentence):
+        if self._tokenize is None:
+            import jieba
+            self._tokenize = jieba.lcut
+        return self._tokenize(sentence)
+
+    # ---------- HowNet ----------
+
+    def hownet_synonyms(self, word):
+        hownet = self.hownet
+        if hownet is None:
+            return ()
+        try:
+            return tuple(w for w, _ in hownet.get_nearest_words(word, topn=self.topn) if w != word)
+        except Exception:
+            return ()
+
+    def hownet_antonyms(self, word):
+        hownet = self.hownet
+        if not hasattr(hownet, "get_antonym"):
+            return ()
+        try:
+            return tuple(hownet.get_antonym(word) or ())
+        except Exception:
+            return ()
+
+    # ---------- 查询 ----------
+
+    def _lookup(self, word, manual, index, compute):
+        found = manual.get(word)
+        if found:
+            return tuple(found)
+        if _SKIP_RE.match(word):
+            return ()
+        if self.store is not None:
+            entry = self.store.get(word)
+            if entry is not None:
+                return entry[index]
+        return compute(word) if self.live else ()
+
+    def _synonyms(self, word):
+        return self._lookup(word, self.manual_synonyms, 0, self.hownet_synonyms)
+
+    def _antonyms(self, word):
+        return self._lookup(word, self.manual_antonyms, 1, self.hownet_antonyms)
+
+    def augment(self, sentence, synonym_prob=0.15, antonym_prob=0.10, do_synonym=True, do_antonym=True):
+        """分词一次，逐词先按 synonym_prob 换成近义词，再按 antonym_prob 换成“不+反义词”"""
+        words = []
+        for w in self.tokenize(sentence):
+            if do_synonym and random.random() < synonym_prob:
+                syns = self.synonyms(w)
+                if syns:
+                    w = random.choice(syns)
+            if do_antonym and random.random() < antonym_prob:
+                ants = self.antonyms(w)
+                if ants:
+                    w = "不" + random.choice(ants)
+            words.append(w)
+        return "".join(words)
+
+    # ---------- 离线预计算 ----------
+
+    def precompute(self, words, batch_size=500, report_every=5000):
+        """
+        为 words 中离线表里还没有的词查HowNet近义词和反义词，查不到的也登记为空。
+        每 batch_size 个词提交一次，中断后重新运行只补剩下的词；返回本次登记的词数
+        """
+        if self.store is None:
+            raise ValueError("没有离线词表，无法预计算")
+        todo = self.store.missing(w for w in dict.fromkeys(words) if w and not _SKIP_RE.match(w))
+        done = 0
+        for i in range(0, len(todo), batch_size):
+            batch = todo[i:i + batch_size]
+            self.store.put_many([(w, self.hownet_synonyms(w), self.hownet_antonyms(w)) for w in batch])
+            done += len(batch)
+            if done % report_every < batch_size or done == len(todo):
+                print(f"近反义词预计算：{done}/{len(todo)}")
+        self.synonyms.cache_clear()
+        self.antonyms.cache_clear()
+        return done
+
+
+def model_vocabulary(model_path, tokenize=None):
+    """
+    模型词表里的词再分词一遍，得到生成时可能查到的词：按空白切分的模型每个词是整句，
+    按字的模型每个词是单字，jieba 模型分词后不变
+    """
+    if tokenize is None:
+        import jieba
+        tokenize = jieba.lcut
+    if model_path.endswith(".bin"):
+        with MarkovMap(model_path) as model:
+            tokens = [model.token(i) for i in range(2, model.n_tokens)]
+    else:
+        counts = load_pickle(model_path)[0]
+        tokens = {w for nxt in counts.values() for w in nxt} - {BEGIN, END}
+    words = {}
+    for token in tokens:
+        for w in tokenize(token):
+            w = w.strip()
+            if w and not _SKIP_RE.match(w):
+                words[w] = None
+    return list(words)
@@ -0,0 +1,295 @@
+"""
+可合并的Markov计数模型，替代“整份语料读成一个字符串、单核训练一个 markovify.NewlineText”：
+  - 计数结构与 markovify.Chain.model 相同：{状态元组: {下一个词: 次数}}，两个模型合并就是计数相加，
+    可以把几个吧合成一个模型，也可以按权重混合，不需要原始语料
+  - 语料按分片并行计数：数据文件按 shard_bytes 切成按行对齐的分片；语料库（tieba_store）每个段文件是一个分片，
+    段内按吧分别计数，得到各吧的模型
+  - 每个分片的计数缓存在 cache_dir，文件名里带分片的内容摘要（段文件带大小）。语料只追加时前面的分片不变，
+    下次训练只重算新增和变化的分片
+  - 分词方式：space 按空白切分（与原先 NewlineText 相同，中文整句是一个词）、char 按字、jieba 分词；
+    state_size 可大于1
+生成时用 to_text() 包装成 markovify.Text，markov_generate.py 的生成流程不变
+"""
+import os
+import re
+import glob
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import markovify
+from markovify.chain import BEGIN, END
+from unidecode import unidecode
+
+from tieba_store import CorpusStore, SEGMENT_EXT
+from text_clean import clean_text
+
+COUNT_FORMAT = "markov-counts"
+TOKENIZERS = ("space", "char", "jieba")
+SHARD_BYTES = 8 * 1024 * 1024
+
+_SPACE_RE = re.compile(r"\s+")
+_REJECT_RE = re.compile(r"(^')|('$)|\s'|'\s|[\"(\(\)\[\])]")  # markovify.Text 默认的 reject_pat
+
+
+def tokenize(line, tokenizer):
+    if tokenizer == "space":
+        return _SPACE_RE.split(line)
+    if tokenizer == "char":
+        return list(line)
+    if tokenizer == "jieba":
+        import jieba
+        return jieba.lcut(line)
+    raise ValueError(f"未知的分词方式：{tokenizer}，可选 {TOKENIZERS}")
+
+
+def accepts(line):
+    """与 markovify.Text.test_sentence_input 相同：空句、含引号或括号的句子不参与训练"""
+    return bool(line) and not _REJECT_RE.search(unidecode(line))
+
+
+def count_runs(counts, runs, state_size):
+    """与 markovify.Chain.build 相同的计数，累加到 counts"""
+    begin = [BEGIN] * state_size
+    for run in runs:
+        items = begin + run + [END]
+        for i in range(len(run) + 1):
+            state = tuple(items[i:i + state_size])
+            follow = items[i + state_size]
+            nxt = counts.get(state)
+            if nxt is None:
+                counts[state] = {follow: 1}
+            else:
+                nxt[follow] = nxt.get(follow, 0) + 1
+    return counts
+
+
+class CountText(markovify.Text):
+    """由计数模型生成句子；char/jieba 分词时词与词之间不加空格"""
+
+    def __init__(self, chain, joiner=" "):
+        super().__init__(None, state_size=chain.state_size, chain=chain, retain_original=False)
+        self.joiner = joiner
+
+    def word_join(self, words):
+        return self.joiner.join(words)
+
+
+class CountModel:
+    """
+    一个Markov计数模型。lines 是参与训练的句子数，sources 记录计数来自哪些分片或模型。
+    分词方式和 state_size 相同的模型才能合并
+    """
+
+    def __init__(self, state_size=1, tokenizer="space", counts=None, lines=0, sources=None):
+        if tokenizer not in TOKENIZERS:
+            raise ValueError(f"未知的分词方式：{tokenizer}，可选 {TOKENIZERS}")
+        self.state_size = state_size
+        self.tokenizer = tokenizer
+        self.counts = counts if counts is not None else {}
+        self.lines = lines
+        self.sources = list(sources or [])
+
+    def add_lines(self, lines):
+        runs = []
+        for line in lines:
+            line = line.strip()
+            if accepts(line):
+                runs.append(tokenize(line, self.tokenizer))
+        count_runs(self.counts, runs, self.state_size)
+        self.lines += len(runs)
+        return len(runs)
+
+    def update(self, other, weight=1):
+        """把 other 的计数乘以 weight 加到本模型"""
+        if (other.state_size, other.tokenizer) != (self.state_size, self.tokenizer):
+            raise ValueError(f"模型不兼容：state_size={other.state_size}/{self.state_size}，"
+                             f"分词={other.tokenizer}/{self.tokenizer}")
+        counts = self.counts
+        for state, nxt in other.counts.items():
+            mine = counts.get(state)
+            if mine is None:
+                counts[state] = dict(nxt) if weight == 1 else {w: c * weight for w, c in nxt.items()}
+            else:
+                for w, c in nxt.items():
+                    mine[w] = mine.get(w, 0) + c * weight
+        self.lines += other.lines
+        self.sources.extend(other.sources)
+        return self
+
+    @classmethod
+    def merge(cls, models, weights=None):
+        """按权重合并多个模型，weights 缺省时直接相加"""
+        models = list(models)
+        if not models:
+            raise ValueError("没有可合并的模型")
+        weights = weights or [1] * len(models)
+        merged = cls(models[0].state_size, models[0].tokenizer)
+        for model, weight in zip(models, weights):
+            merged.update(model, weight)
+        return merged
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def joiner(self):
+        return " " if self.tokenizer == "space" else ""
+
+    def to_dict(self):
+        return {"format": COUNT_FORMAT, "state_size": self.state_size, "tokenizer": self.tokenizer,
+                "lines": self.lines, "sources": self.sources, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("format") != COUNT_FORMAT:
+            raise ValueError("不是计数模型文件")
+        return cls(data["state_size"], data["tokenizer"], data["counts"], data.get("lines", 0), data.get("sources"))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self.to_dict(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_dict(pickle.load(f))
+
+    def to_text(self):
+        if not self.counts:
+            raise ValueError("模型为空，语料里没有可用的句子")
+        chain = markovify.Chain(None, self.state_size, model=self.counts).compile()
+        return CountText(chain, joiner=self.joiner)
+
+
+def is_count_model(obj):
+    return isinstance(obj, dict) and obj.get("format") == COUNT_FORMAT
+
+
+# ---------- 分片计数 ----------
+
+def _config(state_size, tokenizer):
+    return f"s{state_size}-{tokenizer}"
+
+
+def file_shards(path, shard_bytes=SHARD_BYTES):
+    """
+    按行对齐切分数据文件，返回 [(起点, 终点)]：第k个分片从 k*shard_bytes 之后的第一个行首开始。
+    边界只取决于它之前的内容，文件只追加时前面分片的边界和内容都不变
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        pos = shard_bytes
+        while pos < size:
+            f.seek(pos - 1)
+            start = pos - 1 + len(f.readline())
+            if bounds[-1] < start < size:
+                bounds.append(start)
+            pos += shard_bytes
+    return list(zip(bounds, bounds[1:] + [size]))
+
+
+def _count_file_shard(args):
+    path, start, end, state_size, tokenizer, cache_path = args
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    model = CountModel(state_size, tokenizer, sources=[f"{os.path.basename(path)}:{start}-{end}"])
+    model.add_lines(data.decode("utf-8", errors="ignore").splitlines())
+    model.save(cache_path)
+    return cache_path
+
+
+def _count_segment(args):
+    """一个语料库段文件按吧计数，缓存内容是 {吧名: 计数模型}"""
+    root, segment, state_size, tokenizer, cache_path = args
+    lines = {}
+    for _, records in CorpusStore(root).iter_members(segment):
+        for r in records:
+            line = clean_text((r.get("text") or "").strip())
+            if line:
+                lines.setdefault(r.get("bar", ""), []).append(line)
+    bars = {}
+    for bar, bar_lines in lines.items():
+        model = CountModel(state_size, tokenizer, sources=[f"{segment}:{bar}"])
+        model.add_lines(bar_lines)
+        bars[bar] = model.to_dict()
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp = cache_path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(bars, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache_path)
+    return cache_path
+
+
+def _run_jobs(func, jobs, workers):
+    """计数未缓存的分片；workers<=1 时在本进程内进行"""
+    if not jobs:
+        return
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        for job in jobs:
+            func(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(func, jobs):
+            pass
+
+
+def _drop_stale(pattern, keep):
+    for path in glob.glob(pattern):
+        if path not in keep:
+            os.remove(path)
+
+
+def train_file(path, state_size=1, tokenizer="space", cache_dir="shards", workers=None, shard_bytes=SHARD_BYTES):
+    """按分片并行训练一个数据文件，返回 (合并后的模型, 重算的分片数, 分片总数)"""
+    base = os.path.splitext(os.path.basename(path))[0]
+    config = _config(state_size, tokenizer)
+    caches, jobs = [], []
+    with open(path, "rb") as f:
+        for start, end in file_shards(path, shard_bytes):
+            f.seek(start)
+            digest = hashlib.blake2b(f.read(end - start), digest_size=8).hexdigest()
+            cache_path = os.path.join(cache_dir, f"{base}-{start:012d}-{digest}-{config}.pkl")
+            caches.append(cache_path)
+            if not os.path.exists(cache_path):
+                jobs.append((path, start, end, state_size, tokenizer, cache_path))
+    _run_jobs(_count_file_shard, jobs, workers)
+    _drop_stale(os.path.join(glob.escape(cache_dir), f"{glob.escape(base)}-{'[0-9]' * 12}-*-{config}.pkl"), set(caches))
+    model = CountModel(state_size, tokenizer)
+    for cache_path in caches:
+        model.update(CountModel.load(cache_path))
+    return model, len(jobs), len(caches)
+
+
+def train_store(root, state_size=1, tokenizer="space", cache_dir="shards", workers=None, bars=None):
+    """按段文件并行训练语料库，返回 ({吧名: 模型}, 重算的段数, 段总数)；bars 给定时只返回这些吧"""
+    store = CorpusStore(root)
+    config = _config(state_size, tokenizer)
+    caches, jobs = [], []
+    for segment in store.segments():
+        size = os.path.getsize(os.path.join(root, segment + SEGMENT_EXT))
+        cache_path = os.path.join(cache_dir, f"{segment}-{size}-{config}.pkl")
+        caches.append(cache_path)
+        if not os.path.exists(cache_path):
+            jobs.append((root, segment, state_size, tokenizer, cache_path))
+    _run_jobs(_count_segment, jobs, workers)
+    _drop_stale(os.path.join(glob.escape(cache_dir), f"seg-*-{config}.pkl"), set(caches))
+    models = {}
+    for cache_path in caches:
+        with open(cache_path, "rb") as f:
+            shard = pickle.load(f)
+        for bar, data in shard.items():
+            if bars is not None and bar not in bars:
+                continue
+            model = CountModel.from_dict(data)
+            if bar in models:
+                models[bar].update(model)
+            else:
+                models[bar] = model
+    return models, len(jobs), len(caches)
@@ -1,24 +1,45 @@
-import markovify
 import os
 import pickle
-import re
 import jieba
-import random
 import json
 import OpenHowNet
-from collections import Counter, defaultdict
-from tqdm import tqdm
+from collections import Counter
+from tieba_store import CorpusStore
+from tieba_stream import CorpusStream, CorpusIngestor
+from text_dedup import dedup_files, DedupIndex
+from text_clean import clean_text, CleanPool
+from markov_counts import CountModel, TOKENIZERS, is_count_model, train_file, train_store
+from markov_mmap import MarkovMap, export_model, convert
+from lexicon import Lexicon, LexiconStore, model_vocabulary
 
 # === 目录配置 ===
 DATA_DIR = "data"
 MODEL_DIR = "models"
 META_DIR = "meta"
+CORPUS_DIR = "corpus"  # 爬虫写入的分段语料库
+DEDUP_INDEX_DB = os.path.join(DATA_DIR, "all_posts.index.db")  # 增量合并的去重索引，删除后下次合并全量重建
+MERGE_BATCH_LINES = 5000  # 增量合并每批处理的句子数，决定内存占用
+CLEAN_WORKERS = 4  # 增量合并时的清洗进程数，1 则在本进程内清洗
+SHARD_CACHE_DIR = os.path.join(MODEL_DIR, "shards")  # 各分片的转移计数缓存，语料不变的分片不再重算
+TRAIN_WORKERS = 4  # 并行计数的进程数
+MARKOV_STATE_SIZE = 1  # 默认状态长度
+MARKOV_TOKENIZER = "space"  # 默认分词方式：space 按空白切分（原先的做法）/ char 按字 / jieba 分词
+EXPORT_BINARY = True  # 保存计数模型时同时写出内存映射格式 .bin，生成时加载快、多进程共享内存
+LEXICON_DB = os.path.join(META_DIR, "lexicon.db")  # 离线预计算的近反义词表（功能9生成）
+LEXICON_CACHE_SIZE = 50000  # 近反义词查询的LRU缓存词数
+
+# === 流式清洗配置（与 tieba-spidering.py 一致） ===
+REDIS_HOST = "localhost"
+REDIS_PORT = 6379
+REDIS_DB = 0
+CORPUS_STREAM_KEY = "tieba_corpus_stream"
+STREAM_GROUP = "clean"   # 同一组内的多个消费进程分担消息，每条消息只处理一次
+STREAM_OUTPUT = os.path.join(DATA_DIR, "stream_posts.txt")
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(MODEL_DIR, exist_ok=True)
 os.makedirs(META_DIR, exist_ok=True)
 
-# === 加载OpenHowNet和近反义词典 ===
-hownet_dict = OpenHowNet.HowNetDict()
+# === 加载近反义词典（OpenHowNet 在第一次需要现场查询时才加载） ===
 try:
     with open(os.path.join(META_DIR, "synonyms.json"), encoding="utf-8") as f:
         SYNONYMS = json.load(f)
@@ -29,177 +50,163 @@ try:
         ANTONYMS = json.load(f)
 except:
     ANTONYMS = {}
+LEXICON = Lexicon(SYNONYMS, ANTONYMS, hownet=OpenHowNet.HowNetDict, store=LexiconStore(LEXICON_DB),
+                  cache_size=LEXICON_CACHE_SIZE)
+
+
+def iter_new_crawled_chunks(index, output_dir="output", corpus_dir=CORPUS_DIR):
+    """
+    只读出上次合并之后新增的发言，逐块返回 (来源, 处理到的位置, 发言列表)：
+    语料库按段文件内的gzip成员续读，旧格式txt文件按字节偏移续读（文件变短视为重写，从头读）
+    """
+    store = CorpusStore(corpus_dir)
+    for segment in store.segments():
+        name = f"corpus:{segment}"
+        for end, records in store.iter_members(segment, start=index.source_pos(name)):
+            yield name, end, [r["text"] for r in records]
+    if os.path.isdir(output_dir):
+        files = sorted(f for f in os.listdir(output_dir) if f.endswith(".txt"))
+        for fname in files:
+            fpath = os.path.join(output_dir, fname)
+            name = f"txt:{fname}"
+            size = os.path.getsize(fpath)
+            pos = index.source_pos(name)
+            if size == pos:
+                continue
+            if size < pos:
+                pos = 0
+            with open(fpath, "rb") as fin:
+                fin.seek(pos)
+                data = fin.read(size - pos)
+            yield name, size, data.decode("utf-8", errors="ignore").splitlines()
+
+def merge_txt_files_to_corpus(output_dir="output", corpus_dir=CORPUS_DIR, rebuild=False):
+    """
+    增量合并：只处理上次之后新增的发言，清洗、精确去重和近似去重后追加到 all_posts.txt，
+    已有内容不动。指纹、签名和各来源进度保存在 DEDUP_INDEX_DB；rebuild=True 时清空后全量重建
+    """
+    corpus_file = os.path.join(DATA_DIR, "all_posts.txt")
+    index = DedupIndex(DEDUP_INDEX_DB, corpus_file, threshold=0.88)
+    if rebuild:
+        index.reset()
+    totals = Counter()
+    raw, progress = [], {}
+    pool = CleanPool(CLEAN_WORKERS)
 
-def clean_text(text):
-    text = text.replace('\r', '').replace('\n', ' ')
-    for tag in ['[图片]', '[表情]', '[广告]']:
-        text = text.replace(tag, '')
-    text = re.sub(r'(.)\1{4,}', r'\1', text)
-    text = re.sub(r'([^\w\s])\1{2,}', r'\1', text)
-    meaningless_patterns = [
-        r'(支持|顶|沙发|路过|关注|前排|占座|加油|up|mark|围观|感谢|谢谢|收藏|学习|帮顶|dddd|dddddd|6+|666+|233+){2,}',
-        r'(作者已被贴吧屏蔽|点击展开|查看完整图片| ۣۣۖۖิ| ۖิ|本吧发帖|贴吧用户_[0-9a-zA-Z]+|来自:.*客户端|发自.*客户端|已阅|已读|已收藏|已关注)',
-    ]
-    for pat in meaningless_patterns:
-        text = re.sub(pat, '', text, flags=re.IGNORECASE)
-    text = re.sub(r'(.{4,20})\1{2,}', r'\1', text)
-    text = re.sub(r'\s{2,}', ' ', text)
-    return text.strip()
+    def flush():
+        # 整批交给清洗进程池，输出顺序与输入一致
+        batch = [line for line in pool.map(raw) if line]
+        added, dup, near_dup = index.add(batch, progress)
+        totals.update(added=added, dup=dup, near_dup=near_dup)
+        raw.clear()
+        progress.clear()
 
-def get_synonyms(word):
-    syns = SYNONYMS.get(word, None)
-    if syns is not None and len(syns) > 0:
-        return syns
     try:
-        syns = [w for w, _ in hownet_dict.get_nearest_words(word, topn=10) if w != word]
-    except Exception:
-        syns = []
-    return syns
+        for source, pos, lines in iter_new_crawled_chunks(index, output_dir, corpus_dir):
+            raw.extend(line.strip() for line in lines)
+            progress[source] = pos
+            if len(raw) >= MERGE_BATCH_LINES:
+                flush()
+        flush()
+        stats = index.stats()
+    finally:
+        pool.close()
+        index.close()
+    print(f"已增量合并到 {corpus_file}：新增 {totals['added']} 行，精确重复 {totals['dup']} 行，"
+          f"近似重复 {totals['near_dup']} 行，语料共 {stats['lines']} 行")
 
-def get_antonyms(word):
-    ants = ANTONYMS.get(word, None)
-    if ants is not None and len(ants) > 0:
-        return ants
-    if hasattr(hownet_dict, "get_antonym"):
-        try:
-            ants = hownet_dict.get_antonym(word)
-        except Exception:
-            ants = []
-        if ants:
-            return ants
-    return []
+def consume_corpus_stream(consumer=None, idle_exit=None, report_every=20):
+    """
+    持续消费爬虫发布的帖子：清洗、去重后追加到 STREAM_OUTPUT，各吧统计实时写入Redis。
+    idle_exit 给定时连续这么多秒没有新帖子就退出，否则一直运行到 Ctrl+C
+    """
+    import redis
+    import socket
+    conn = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+    stream = CorpusStream(conn, CORPUS_STREAM_KEY)
+    ingestor = CorpusIngestor(conn, CORPUS_STREAM_KEY, STREAM_OUTPUT, clean=clean_text, tokenize=jieba.lcut,
+                              sim_threshold=0.88, bucket_size=10)
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    batches = 0
 
-def synonym_replace(sentence, prob=0.15):
-    words = list(jieba.cut(sentence))
-    new_words = []
-    for w in words:
-        if random.random() < prob:
-            syns = get_synonyms(w)
-            if syns:
-                new_words.append(random.choice(syns))
-                continue
-        new_words.append(w)
-    return "".join(new_words)
+    def handle(messages):
+        nonlocal batches
+        ingestor(messages)
+        batches += 1
+        if batches % report_every == 0:
+            print(f"[{consumer}] {ingestor.summary()}，积压 {stream.backlog()} 个帖子")
 
-def antonym_negate_replace(sentence, prob=0.10):
-    words = list(jieba.cut(sentence))
-    new_words = []
-    for w in words:
-        if random.random() < prob:
-            ants = get_antonyms(w)
-            if ants:
-                new_words.append("不" + random.choice(ants))
-                continue
-        new_words.append(w)
-    return "".join(new_words)
+    def on_error(e, messages):
+        print(f"[{consumer}] 处理 {len(messages)} 个帖子失败：{e!r}，这批消息未确认，稍后重新投递")
 
-def merge_txt_files_to_corpus(output_dir="output"):
-    all_lines = set()
-    corpus_file = os.path.join(DATA_DIR, "all_posts.txt")
-    with open(corpus_file, "w", encoding="utf-8") as fout:
-        files = [f for f in os.listdir(output_dir) if f.endswith(".txt")]
-        for fname in files:
-            fpath = os.path.join(output_dir, fname)
-            with open(fpath, encoding="utf-8") as fin:
-                for line in fin:
-                    line = clean_text(line.strip())
-                    if line and line not in all_lines:
-                        fout.write(line + "\n")
-                        all_lines.add(line)
-    print(f"已合并清洗所有文件到 {corpus_file}")
+    print(f"消费者 {consumer} 开始消费 {CORPUS_STREAM_KEY}，清洗结果追加到 {STREAM_OUTPUT}")
+    try:
+        stream.consume(STREAM_GROUP, consumer, handle, idle_exit=idle_exit, on_error=on_error)
+    except KeyboardInterrupt:
+        pass
+    print(f"[{consumer}] {ingestor.summary()}")
+    for bar in ingestor.bars():
+        stats = ingestor.bar_stats(bar, top_words=10)
+        words = "、".join(w for w, _ in stats.pop("top_words"))
+        print(f"吧：{bar} 累计 {stats}，高频词：{words}")
 
-def deduplicate_by_length_bucket_parallel(
-    input_file_or_files, 
-    output_file, 
-    sim_threshold=0.95, 
-    bucket_size=10, 
-    max_bucket_size=1000, 
-    sub_bucket_count=10, 
-    num_workers=8
-):
-    lines = []
-    files = input_file_or_files if isinstance(input_file_or_files, (list, tuple)) else [input_file_or_files]
-    seen = set()
-    for file in files:
-        if not os.path.exists(file):
-            continue
-        with open(file, encoding="utf-8") as fin:
-            for line in fin:
-                line = line.strip()
-                if line and line not in seen:
-                    lines.append(line)
-                    seen.add(line)
-    print(f"读取总语料数：{len(lines)}")
-    buckets = defaultdict(list)
-    for idx, line in enumerate(lines):
-        l = len(line)
-        buckets[l // bucket_size].append((idx, line))
-    print(f"初步分为 {len(buckets)} 个长度桶，每桶宽度 {bucket_size}")
-    def further_bucket_by_hash(group, sub_bucket_count=10):
-        sub_buckets = defaultdict(list)
-        for idx, line in group:
-            h = hash(line) % sub_bucket_count
-            sub_buckets[h].append((idx, line))
-        return list(sub_buckets.values())
-    all_groups = []
-    for group in buckets.values():
-        if len(group) > max_bucket_size:
-            sub_groups = further_bucket_by_hash(group, sub_bucket_count=sub_bucket_count)
-            all_groups.extend([g for g in sub_groups if g])
-        else:
-            all_groups.append(group)
-    print(f"最终并发分组数（桶+子桶）：{len(all_groups)}")
-    def jaccard_sim(s1, s2):
-        set1, set2 = set(s1), set(s2)
-        if not set1 or not set2:
-            return 0.0
-        return len(set1 & set2) / len(set1 | set2)
-    def bucket_worker(group, sim_threshold):
-        removed = set()
-        n = len(group)
-        for i in range(n):
-            idx_i, line_i = group[i]
-            if idx_i in removed:
-                continue
-            for j in range(i+1, n):
-                idx_j, line_j = group[j]
-                if idx_j in removed:
-                    continue
-                sim = jaccard_sim(line_i, line_j)
-                if sim >= sim_threshold:
-                    if len(line_i) <= len(line_j):
-                        removed.add(idx_i)
-                    else:
-                        removed.add(idx_j)
-        return removed
-    all_removed = set()
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        futures = {executor.submit(bucket_worker, group, sim_threshold): group for group in all_groups}
-        for i, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="桶去重进度")):
-            removed = future.result()
-            all_removed.update(removed)
-    with open(output_file, "w", encoding="utf-8") as fout:
-        for idx, line in enumerate(lines):
-            if idx not in all_removed:
-                fout.write(line + "\n")
-    print(f"分桶多线程相似度去重完成，剩余句子数：{len(lines)-len(all_removed)}，结果保存至{output_file}")
+def deduplicate_near_duplicates(input_file_or_files, output_file, sim_threshold=0.88, num_perm=64, num_workers=8):
+    """MinHash-LSH近似去重（见 text_dedup.py），相似句只保留最长的一句"""
+    return dedup_files(input_file_or_files, output_file, threshold=sim_threshold, num_perm=num_perm,
+                       num_workers=num_workers)
 
-def train_markov_model(corpus_file, model_file):
-    with open(corpus_file, encoding="utf-8") as f:
-        text = f.read()
-    model = markovify.NewlineText(text, retain_original=False, state_size=1)
-    with open(model_file, "wb") as f:
-        pickle.dump(model, f)
-    print(f"模型已保存到 {model_file}")
+def save_model(model, model_file):
+    """保存可合并的计数模型 .pkl，EXPORT_BINARY 时同时写出同名 .bin 供生成使用"""
+    model.save(model_file)
+    if EXPORT_BINARY:
+        export_model(model, os.path.splitext(model_file)[0] + ".bin")
+
+def train_markov_model(corpus_file, model_file, state_size=MARKOV_STATE_SIZE, tokenizer=MARKOV_TOKENIZER):
+    """按分片并行计数训练（见 markov_counts.py），保存可合并的计数模型"""
+    model, redo, total = train_file(corpus_file, state_size=state_size, tokenizer=tokenizer,
+                                    cache_dir=SHARD_CACHE_DIR, workers=TRAIN_WORKERS)
+    save_model(model, model_file)
+    print(f"模型已保存到 {model_file}（{model.lines} 句，{len(model)} 个状态，重算 {redo}/{total} 个分片）")
+    return model.to_text()
+
+def train_bar_models(state_size=MARKOV_STATE_SIZE, tokenizer=MARKOV_TOKENIZER, corpus_dir=CORPUS_DIR):
+    """按语料库段文件并行计数，每个吧保存一个模型 bar_<吧名>_<配置>.pkl"""
+    models, redo, total = train_store(corpus_dir, state_size=state_size, tokenizer=tokenizer,
+                                      cache_dir=SHARD_CACHE_DIR, workers=TRAIN_WORKERS)
+    print(f"语料库共 {total} 个段文件，重算 {redo} 个")
+    for bar, model in sorted(models.items()):
+        model_file = os.path.join(MODEL_DIR, f"bar_{bar}_s{state_size}_{tokenizer}.pkl")
+        save_model(model, model_file)
+        print(f"吧：{bar} {model.lines} 句，{len(model)} 个状态，已保存到 {model_file}")
+    return models
+
+def mix_models(model_files, weights, model_file):
+    """按权重合并多个计数模型（计数乘以权重后相加），分词方式和状态长度必须相同"""
+    model = CountModel.merge([CountModel.load(f) for f in model_files], weights)
+    save_model(model, model_file)
+    print(f"已合并 {len(model_files)} 个模型到 {model_file}（{len(model)} 个状态）")
     return model
 
 def load_model(model_file):
+    if model_file.endswith(".bin"):
+        model = MarkovMap(model_file)
+        print(f"模型已从 {model_file} 加载（内存映射，{model.n_states} 个状态）")
+        return model
     with open(model_file, "rb") as f:
         model = pickle.load(f)
+    if is_count_model(model):
+        model = CountModel.from_dict(model).to_text()
     print(f"模型已从 {model_file} 加载")
     return model
 
+def ask_train_config():
+    num = input(f"状态长度（默认{MARKOV_STATE_SIZE}）：").strip()
+    state_size = int(num) if num.isdigit() and int(num) > 0 else MARKOV_STATE_SIZE
+    tokenizer = input(f"分词方式 {'/'.join(TOKENIZERS)}（默认{MARKOV_TOKENIZER}）：").strip()
+    if tokenizer not in TOKENIZERS:
+        tokenizer = MARKOV_TOKENIZER
+    return state_size, tokenizer
+
 def select_data_file():
     files = [f for f in os.listdir(DATA_DIR) if f.endswith('.txt')]
     if not files:
@@ -214,11 +221,11 @@ def select_data_file():
     return os.path.join(DATA_DIR, files[0])
 
 def select_model_file():
-    models = [f for f in os.listdir(MODEL_DIR) if f.endswith('.pkl')]
+    models = sorted(f for f in os.listdir(MODEL_DIR) if f.endswith(('.bin', '.pkl')))
     if not models:
         print("未找到任何模型文件，请先训练模型。")
         return None
-    print("可用模型文件：")
+    print("可用模型文件（.bin 为内存映射格式，加载更快）：")
     for idx, m in enumerate(models):
         print(f"{idx+1}. {m}")
     num = input(f"选择模型编号 (1-{len(models)}, 默认1)：").strip()
@@ -233,16 +240,20 @@ def generate_sentences(
     count = 0
     generated = 0
     results = []
+    # 内存映射模型（.bin）按关键词索引从关键词处双向生成，每次尝试都含关键词；其他模型只能整句生成后筛选
+    indexed = keyword and hasattr(model, "make_sentence_with_keyword")
+    if indexed and not model.keyword_tokens(keyword)[0]:
+        print(f"== 模型里没有含“{keyword}”的词，换个关键词或模型试试 ==")
+        return results
     while generated < n and count < n * keyword_tries * 2:
-        sentence = model.make_sentence()
+        sentence = model.make_sentence_with_keyword(keyword) if indexed else model.make_sentence()
         if sentence is None or (keyword and keyword not in sentence):
             count += 1
             continue
         new_sentence = sentence
-        if do_synonym:
-            new_sentence = synonym_replace(new_sentence, prob=synonym_prob)
-        if do_antonym:
-            new_sentence = antonym_negate_replace(new_sentence, prob=antonym_prob)
+        if do_synonym or do_antonym:
+            new_sentence = LEXICON.augment(new_sentence, synonym_prob=synonym_prob, antonym_prob=antonym_prob,
+                                           do_synonym=do_synonym, do_antonym=do_antonym)
         clean_sentence = clean_text(new_sentence)
         if len(clean_sentence) > max_len:
             count += 1
@@ -259,27 +270,30 @@ def generate_sentences(
 
 def main():
     print("请选择功能：")
-    print("1. 合并并清洗output目录下文本为大语料")
+    print("1. 增量合并并清洗语料库/output目录下新增文本到大语料")
     print("2. 合并去重所有语料为唯一大语料")
     print("3. 训练模型（可自定义训练集和模型名）")
     print("4. 用指定模型生成文案")
-    choice = input("输入功能编号 (1~4)：").strip()
+    print("5. 流式消费爬虫数据（实时清洗去重并更新各吧统计）")
+    print("6. 按吧训练模型（语料库）")
+    print("7. 按权重合并多个模型")
+    print("8. 把所有 .pkl 模型转换为内存映射格式 .bin")
+    print("9. 为模型词表预计算近反义词表")
+    choice = input("输入功能编号 (1~9)：").strip()
 
     if choice == "1":
-        merge_txt_files_to_corpus(output_dir="output")
+        rebuild = input("是否清空后全量重建？(y/N)：").strip().lower() == "y"
+        merge_txt_files_to_corpus(output_dir="output", rebuild=rebuild)
     elif choice == "2":
         files = [
             os.path.join(DATA_DIR, "all_posts.txt"),
             os.path.join(DATA_DIR, "all_posts_augmented.txt"),
             os.path.join(DATA_DIR, "all_posts_bayes.txt"),
         ]
-        deduplicate_by_length_bucket_parallel(
+        deduplicate_near_duplicates(
             input_file_or_files=files,
             output_file=os.path.join(DATA_DIR, "all_posts_merged_dedup.txt"),
             sim_threshold=0.88,
-            bucket_size=10,
-            max_bucket_size=1000,
-            sub_bucket_count=10,
             num_workers=8
         )
         print("建议后续训练直接用 all_posts_merged_dedup.txt")
@@ -291,7 +305,8 @@ def main():
         if not model_name.endswith(".pkl"):
             model_name += ".pkl"
         model_file = os.path.join(MODEL_DIR, model_name)
-        train_markov_model(corpus_file=data_file, model_file=model_file)
+        state_size, tokenizer = ask_train_config()
+        train_markov_model(corpus_file=data_file, model_file=model_file, state_size=state_size, tokenizer=tokenizer)
         print(f"已用 {data_file} 训练并保存模型为 {model_file}")
     elif choice == "4":
         model_file = select_model_file()
@@ -314,6 +329,45 @@ def main():
             generate_sentences(model, n=num, keyword=keyword)
         else:
             print("无效选项。")
+    elif choice == "5":
+        consume_corpus_stream()
+    elif choice == "6":
+        state_size, tokenizer = ask_train_config()
+        train_bar_models(state_size=state_size, tokenizer=tokenizer)
+    elif choice == "7":
+        models = sorted(f for f in os.listdir(MODEL_DIR) if f.endswith('.pkl'))
+        if not models:
+            print("未找到任何模型文件，请先训练模型。")
+            return
+        for idx, m in enumerate(models):
+            print(f"{idx+1}. {m}")
+        picked = input("输入要合并的模型编号和权重，如 1:0.7 3:0.3（权重默认1）：").split()
+        files, weights = [], []
+        for item in picked:
+            num, _, weight = item.partition(":")
+            if num.isdigit() and 1 <= int(num) <= len(models):
+                files.append(os.path.join(MODEL_DIR, models[int(num)-1]))
+                weights.append(float(weight) if weight else 1)
+        if not files:
+            print("没有选择任何模型。")
+            return
+        model_name = input("请输入合并后的模型文件名（如 mix.pkl）：").strip()
+        if not model_name.endswith(".pkl"):
+            model_name += ".pkl"
+        mix_models(files, weights, os.path.join(MODEL_DIR, model_name))
+    elif choice == "8":
+        for f in sorted(os.listdir(MODEL_DIR)):
+            if f.endswith(".pkl"):
+                out = convert(os.path.join(MODEL_DIR, f))
+                print(f"已转换 {f} -> {out}")
+    elif choice == "9":
+        model_file = select_model_file()
+        if not model_file:
+            return
+        words = model_vocabulary(model_file)
+        print(f"模型词表分词后共 {len(words)} 个词")
+        added = LEXICON.precompute(words)
+        print(f"新登记 {added} 个词，{LEXICON_DB} 共 {len(LEXICON.store)} 个词")
     else:
         print("无效选项，请重试。")
 
@@ -0,0 +1,427 @@
+"""
+Markov模型的紧凑二进制格式（.bin），内存映射加载，替代生成时整份反序列化 .pkl：
+  词表       0号是 markovify 的 BEGIN，1号是 END，其余按UTF-8字节序排序；offsets(Q) + UTF-8字节串
+  状态       每行 state_size 个词id(I)，按字典序排序，行号就是状态id；只有指定起始状态时才二分查找
+  转移(CSR)  row_ptr(Q, 状态数+1)；每条转移：词id(I)、走这一步之后的状态id(I，到句尾为 NO_STATE)、
+             行内累计权重(d)。抽样在行内二分，O(log k)；生成时沿“下一状态id”直接跳转，不查字典
+  关键词索引 按词分组的转移：tok_ptr(Q, 词数+1)、转移id(I)、组内累计权重(d)，找出输出某个词的所有转移
+  反向转移   按目标状态分组：rev_ptr(Q, 状态数+1)、来源状态id(I)、组内累计权重(d)，从某个状态往回走到句首
+指定关键词时，按权重抽一条输出含关键词的词的转移作为锚点，从它的来源状态按反向转移走回句首，
+再从目标状态正向走到句尾，每次尝试得到的句子都含关键词，不再靠整句随机生成后筛选
+各段都是 mmap 上的 memoryview，加载只解析头部；多个生成进程通过系统页缓存共享同一份数据。
+数组按本机字节序写入，只支持小端机器（x86/ARM）
+"""
+import os
+import sys
+import mmap
+import time
+import bisect
+import pickle
+import random
+import struct
+import argparse
+from array import array
+from itertools import accumulate
+
+from markovify.chain import BEGIN, END
+
+from markov_counts import CountModel, is_count_model
+
+MAGIC = b"TBMK"
+VERSION = 2
+BEGIN_ID = 0
+END_ID = 1
+NO_STATE = 0xFFFFFFFF
+DEFAULT_TRIES = 10  # 与 markovify 的 make_sentence 一致
+MAX_BACK_WORDS = 200  # 反向走回句首的最大词数，超过视为这次尝试失败
+
+# 魔数、版本、state_size、拼接符、词数、状态数、转移数、13个段的偏移
+_HEADER = struct.Struct("<4sII16sQQQ13Q")
+
+
+def _check_byteorder():
+    if sys.byteorder != "little":
+        raise RuntimeError("内存映射模型只支持小端机器")
+
+
+def _chain_counts(chain):
+    """markovify.Chain 的计数；已 compile 的链从累计权重还原"""
+    if not getattr(chain, "compiled", False):
+        return chain.model
+    counts = {}
+    for state, (choices, cumdist) in chain.model.items():
+        prev = 0
+        nxt = {}
+        for word, cum in zip(choices, cumdist):
+            nxt[word] = cum - prev
+            prev = cum
+        counts[state] = nxt
+    return counts
+
+
+def load_pickle(path):
+    """读出 .pkl 模型的 (计数, state_size, 拼接符)：计数模型，或 pickle 的 markovify.Text / Chain"""
+    with open(path, "rb") as f:
+        obj = pickle.load(f)
+    if is_count_model(obj):
+        model = CountModel.from_dict(obj)
+        return model.counts, model.state_size, model.joiner
+    chain = getattr(obj, "chain", obj)
+    return _chain_counts(chain), chain.state_size, getattr(obj, "joiner", " ")
+
+
+def _group(keys, n_groups, weights):
+    """
+    按 keys 把下标分组（计数排序，跳过 NO_STATE），返回 (组指针, 组内下标, 组内累计权重)，
+    组内保持原顺序
+    """
+    ptr = array("Q", bytes(8 * (n_groups + 1)))
+    for k in keys:
+        if k != NO_STATE:
+            ptr[k + 1] += 1
+    for g in range(n_groups):
+        ptr[g + 1] += ptr[g]
+    pos = array("Q", ptr)
+    members = array("I", bytes(4 * ptr[n_groups]))
+    for i, k in enumerate(keys):
+        if k != NO_STATE:
+            members[pos[k]] = i
+            pos[k] += 1
+    cum = array("d", bytes(8 * ptr[n_groups]))
+    for g in range(n_groups):
+        total = 0
+        for j in range(ptr[g], ptr[g + 1]):
+            total += weights[members[j]]
+            cum[j] = total
+    return ptr, members, cum
+
+
+def _pad(f):
+    f.write(b"\0" * (-f.tell() % 8))
+    return f.tell()
+
+
+def write_model(counts, state_size, path, joiner=" "):
+    """把 {状态元组: {下一个词: 权重}} 写成二进制模型，返回 (词数, 状态数, 转移数)"""
+    _check_byteorder()
+    joiner_bytes = joiner.encode("utf-8")
+    if len(joiner_bytes) > 16:
+        raise ValueError("拼接符过长")
+    tokens = set()
+    for state, nxt in counts.items():
+        tokens.update(state)
+        tokens.update(nxt)
+    tokens.discard(BEGIN)
+    tokens.discard(END)
+    vocab = [BEGIN, END] + sorted(tokens, key=lambda t: t.encode("utf-8"))
+    token_ids = {t: i for i, t in enumerate(vocab)}
+    keys = sorted((tuple(token_ids[t] for t in state), state) for state in counts)
+    state_ids = {ids: i for i, (ids, _) in enumerate(keys)}
+
+    encoded = [t.encode("utf-8") for t in vocab]
+    vocab_off = array("Q", [0])
+    for b in encoded:
+        vocab_off.append(vocab_off[-1] + len(b))
+    states = array("I")
+    row_ptr = array("Q", [0])
+    edge_token = array("I")
+    edge_next = array("I")
+    edge_cum = array("d")
+    edge_src = array("I")
+    edge_weight = array("d")
+    for sid, (ids, state) in enumerate(keys):
+        states.extend(ids)
+        tail = ids[1:]
+        total = 0
+        for word, weight in counts[state].items():
+            t = token_ids[word]
+            total += weight
+            edge_token.append(t)
+            edge_cum.append(total)
+            edge_next.append(NO_STATE if t == END_ID else state_ids.get(tail + (t,), NO_STATE))
+            edge_src.append(sid)
+            edge_weight.append(weight)
+        row_ptr.append(len(edge_token))
+    tok_ptr, tok_edge, tok_cum = _group(edge_token, len(vocab), edge_weight)
+    rev_ptr, rev_edge, rev_cum = _group(edge_next, len(keys), edge_weight)
+    rev_src = array("I", (edge_src[e] for e in rev_edge))
+    del edge_src, edge_weight, rev_edge
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        offsets = []
+        for section in (vocab_off, b"".join(encoded), states, row_ptr, edge_token, edge_next, edge_cum,
+                        tok_ptr, tok_edge, tok_cum, rev_ptr, rev_src, rev_cum):
+            offsets.append(_pad(f))
+            f.write(section if isinstance(section, bytes) else section.tobytes())
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, state_size, joiner_bytes, len(vocab), len(keys), len(edge_token),
+                             *offsets))
+    os.replace(tmp, path)
+    return len(vocab), len(keys), len(edge_token)
+
+
+def export_model(model, path):
+    """把计数模型（CountModel）写成二进制模型"""
+    return write_model(model.counts, model.state_size, path, model.joiner)
+
+
+def convert(pkl_path, out_path=None):
+    """把 .pkl 模型（计数模型或 markovify 模型）转换为同名 .bin，返回输出路径"""
+    out_path = out_path or os.path.splitext(pkl_path)[0] + ".bin"
+    counts, state_size, joiner = load_pickle(pkl_path)
+    write_model(counts, state_size, out_path, joiner)
+    return out_path
+
+
+class MarkovMap:
+    """内存映射的Markov模型，make_sentence / make_short_sentence 与 markovify.Text 用法相同"""
+
+    def __init__(self, path):
+        _check_byteorder()
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mm)
+        magic, version, state_size, joiner, n_tokens, n_states, n_edges, *offsets = _HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            buf.release()
+            self._mm.close()
+            raise ValueError(f"{path} 不是内存映射模型文件或版本不符，请用 .pkl 重新转换")
+        self.state_size = state_size
+        self.joiner = joiner.rstrip(b"\0").decode("utf-8")
+        self.n_tokens, self.n_states, self.n_edges = n_tokens, n_states, n_edges
+        o_voff, o_vocab, o_states, o_rows, o_tok, o_next, o_cum, o_tptr, o_tedge, o_tcum, o_rptr, o_rsrc, o_rcum = offsets
+        self._vocab_off = buf[o_voff:o_voff + 8 * (n_tokens + 1)].cast("Q")
+        self._vocab = buf[o_vocab:o_vocab + self._vocab_off[n_tokens]]
+        self._vocab_base = o_vocab
+        self._states = buf[o_states:o_states + 4 * n_states * state_size].cast("I")
+        self._row_ptr = buf[o_rows:o_rows + 8 * (n_states + 1)].cast("Q")
+        self._token = buf[o_tok:o_tok + 4 * n_edges].cast("I")
+        self._next = buf[o_next:o_next + 4 * n_edges].cast("I")
+        self._cum = buf[o_cum:o_cum + 8 * n_edges].cast("d")
+        self._tok_ptr = buf[o_tptr:o_tptr + 8 * (n_tokens + 1)].cast("Q")
+        self._tok_edge = buf[o_tedge:o_tedge + 4 * n_edges].cast("I")
+        self._tok_cum = buf[o_tcum:o_tcum + 8 * n_edges].cast("d")
+        self._rev_ptr = buf[o_rptr:o_rptr + 8 * (n_states + 1)].cast("Q")
+        n_rev = self._rev_ptr[n_states]
+        self._rev_src = buf[o_rsrc:o_rsrc + 4 * n_rev].cast("I")
+        self._rev_cum = buf[o_rcum:o_rcum + 8 * n_rev].cast("d")
+        self._views = [self._vocab_off, self._vocab, self._states, self._row_ptr, self._token, self._next,
+                       self._cum, self._tok_ptr, self._tok_edge, self._tok_cum, self._rev_ptr, self._rev_src,
+                       self._rev_cum, buf]
+        self.begin_state = self.find_state((BEGIN_ID,) * state_size)
+        self._anchors = {}
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # ---------- 词表与状态 ----------
+
+    def _token_bytes(self, token_id):
+        off = self._vocab_off
+        return bytes(self._vocab[off[token_id]:off[token_id + 1]])
+
+    def token(self, token_id):
+        return self._token_bytes(token_id).decode("utf-8")
+
+    def token_id(self, word):
+        """词 -> id，词表里没有时返回 None（BEGIN/END 之后按UTF-8字节序二分）"""
+        if word == BEGIN:
+            return BEGIN_ID
+        if word == END:
+            return END_ID
+        key = word.encode("utf-8")
+        lo, hi = END_ID + 1, self.n_tokens
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._token_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_tokens and self._token_bytes(lo) == key else None
+
+    def find_state(self, ids):
+        """词id元组 -> 状态id，不存在时返回 None"""
+        ids = tuple(ids)
+        size = self.state_size
+        rows = self._states
+        lo, hi = 0, self.n_states
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tuple(rows[mid * size:(mid + 1) * size]) < ids:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_states and tuple(rows[lo * size:(lo + 1) * size]) == ids else None
+
+    # ---------- 生成 ----------
+
+    def _move(self, state):
+        lo, hi = self._row_ptr[state], self._row_ptr[state + 1]
+        r = random.random() * self._cum[hi - 1]
+        return min(bisect.bisect(self._cum, r, lo, hi), hi - 1)
+
+    def walk(self, state):
+        """从状态id出发走到句尾，返回词id列表"""
+        words = []
+        token, nxt = self._token, self._next
+        while state != NO_STATE:
+            edge = self._move(state)
+            t = token[edge]
+            if t == END_ID:
+                break
+            words.append(t)
+            state = nxt[edge]
+        return words
+
+    def make_sentence(self, init_state=None, **kwargs):
+        tries = kwargs.get("tries", DEFAULT_TRIES)
+        max_words = kwargs.get("max_words", None)
+        min_words = kwargs.get("min_words", None)
+        if init_state is None:
+            prefix, state = [], self.begin_state
+        else:
+            ids = [self.token_id(w) for w in init_state]
+            state = None if None in ids else self.find_state(ids)
+            if state is None:
+                raise KeyError(tuple(init_state))
+            prefix = list(init_state)
+            while prefix and prefix[0] == BEGIN:
+                prefix = prefix[1:]
+        for _ in range(tries):
+            words = prefix + [self.token(t) for t in self.walk(state)]
+            if (max_words is not None and len(words) > max_words) or (
+                    min_words is not None and len(words) < min_words):
+                continue
+            return self.joiner.join(words)
+        return None
+
+    # ---------- 关键词 ----------
+
+    def _tokens_containing(self, key, suffix=False):
+        """在词表字节串里直接查找含 key 的词（UTF-8 下字节子串与字符子串一致）；suffix=True 时只要以 key 结尾的词"""
+        off = self._vocab_off
+        base = self._vocab_base
+        pos, end = base + off[END_ID + 1], base + off[self.n_tokens]
+        found = []
+        while True:
+            i = self._mm.find(key, pos, end)
+            if i < 0:
+                return found
+            t = bisect.bisect_right(off, i - base) - 1
+            stop = i - base + len(key)
+            if stop > off[t + 1]:
+                pos = i + 1  # 匹配跨过了词的边界
+                continue
+            if not suffix or stop == off[t + 1]:
+                found.append(t)
+            pos = base + off[t + 1]
+
+    def keyword_tokens(self, keyword):
+        """
+        返回 (含关键词的词id列表, 是否完整包含)。没有任何词包含完整的关键词时（如按字分词，关键词跨了几个词），
+        退而取以关键词最长前缀结尾的词，生成后再核对整句
+        """
+        found = self._tokens_containing(keyword.encode("utf-8"))
+        if found:
+            return found, True
+        for k in range(len(keyword) - 1, 0, -1):
+            found = self._tokens_containing(keyword[:k].encode("utf-8"), suffix=True)
+            if found:
+                return found, False
+        return [], False
+
+    def _keyword_anchors(self, keyword):
+        anchors = self._anchors.get(keyword)
+        if anchors is None:
+            tokens, complete = self.keyword_tokens(keyword)
+            ptr, cum = self._tok_ptr, self._tok_cum
+            weights = [cum[ptr[t + 1] - 1] if ptr[t + 1] > ptr[t] else 0 for t in tokens]
+            anchors = (tokens, complete, list(accumulate(weights)), set(tokens))
+            if len(self._anchors) >= 256:
+                self._anchors.clear()
+            self._anchors[keyword] = anchors
+        return anchors
+
+    def walk_back(self, state, limit=MAX_BACK_WORDS):
+        """从状态id按反向转移走回句首，返回从句首到该状态的词id列表（不含BEGIN）；超过 limit 个词返回 None"""
+        size = self.state_size
+        rows = self._states
+        words = list(rows[state * size:(state + 1) * size])[::-1]
+        while state != self.begin_state:
+            lo, hi = self._rev_ptr[state], self._rev_ptr[state + 1]
+            if lo == hi or len(words) > limit:
+                return None
+            r = random.random() * self._rev_cum[hi - 1]
+            state = self._rev_src[min(bisect.bisect(self._rev_cum, r, lo, hi), hi - 1)]
+            words.append(rows[state * size])
+        return [w for w in reversed(words) if w != BEGIN_ID]
+
+    def make_sentence_with_keyword(self, keyword, **kwargs):
+        """
+        生成含关键词的句子：按权重抽一条输出含关键词的词的转移作为锚点，
+        从它的来源状态反向走回句首，再从目标状态正向走到句尾。模型里没有含关键词的词时返回 None。
+        含k个锚点词的句子会被抽中k倍，以 1/k 的概率接受，与“整句生成后筛出含关键词的句子”同分布
+        """
+        tries = kwargs.get("tries", DEFAULT_TRIES)
+        max_words = kwargs.get("max_words", None)
+        min_words = kwargs.get("min_words", None)
+        tokens, complete, totals, anchor_set = self._keyword_anchors(keyword)
+        if not tokens or totals[-1] <= 0:
+            return None
+        for _ in range(tries):
+            t = tokens[min(bisect.bisect(totals, random.random() * totals[-1]), len(tokens) - 1)]
+            lo, hi = self._tok_ptr[t], self._tok_ptr[t + 1]
+            r = random.random() * self._tok_cum[hi - 1]
+            edge = self._tok_edge[min(bisect.bisect(self._tok_cum, r, lo, hi), hi - 1)]
+            back = self.walk_back(bisect.bisect_right(self._row_ptr, edge) - 1)
+            if back is None:
+                continue
+            ids = back + [t] + self.walk(self._next[edge])
+            k = sum(1 for i in ids if i in anchor_set)
+            if k > 1 and random.random() * k >= 1:
+                continue
+            if (max_words is not None and len(ids) > max_words) or (
+                    min_words is not None and len(ids) < min_words):
+                continue
+            sentence = self.joiner.join(self.token(i) for i in ids)
+            if complete or keyword in sentence:
+                return sentence
+        return None
+
+    def make_short_sentence(self, max_chars, min_chars=0, **kwargs):
+        tries = kwargs.get("tries", DEFAULT_TRIES)
+        for _ in range(tries):
+            sentence = self.make_sentence(**kwargs)
+            if sentence and min_chars <= len(sentence) <= max_chars:
+                return sentence
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把 .pkl 模型转换为内存映射格式 .bin")
+    parser.add_argument("models", nargs="+", help=".pkl 模型文件")
+    args = parser.parse_args()
+    for path in args.models:
+        start = time.time()
+        out = convert(path)
+        with MarkovMap(out) as model:
+            print(f"{path} -> {out}：{model.n_tokens} 个词，{model.n_states} 个状态，{model.n_edges} 条转移，"
+                  f"{os.path.getsize(path) / 1e6:.1f}MB -> {os.path.getsize(out) / 1e6:.1f}MB，"
+                  f"耗时{time.time() - start:.1f}秒")
+
+
+if __name__ == "__main__":
+    main()
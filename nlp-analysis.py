@@ -1,11 +1,13 @@
 import os
 import jieba
 import jieba.analyse
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
 from wordcloud import WordCloud
 import matplotlib.pyplot as plt
 from snownlp import SnowNLP
 import re
+from tieba_store import CorpusStore
+from text_clean import clean_text, CleanPool
 
 def load_stopwords(*files):
     stopwords = set()
@@ -21,22 +23,7 @@ def load_stopwords(*files):
     return stopwords
 
 STOPWORDS = load_stopwords("scu_stopwords.txt", "cn_stopwords.txt")
-
-def clean_text(text):
-    text = text.replace('\r', '').replace('\n', ' ')
-    for tag in ['[图片]', '[表情]', '[广告]']:
-        text = text.replace(tag, '')
-    text = re.sub(r'(.)\1{4,}', r'\1', text)
-    text = re.sub(r'([^\w\s])\1{2,}', r'\1', text)
-    meaningless_patterns = [
-        r'(支持|顶|沙发|路过|关注|前排|占座|加油|up|mark|围观|感谢|谢谢|收藏|学习|帮顶|dddd|dddddd|6+|666+|233+){2,}',
-        r'(作者已被贴吧屏蔽|点击展开|查看完整图片|本吧发帖|贴吧用户_[0-9a-zA-Z]+|来自:.*客户端|发自.*客户端|已阅|已读|已收藏|已关注)',
-    ]
-    for pat in meaningless_patterns:
-        text = re.sub(pat, '', text, flags=re.IGNORECASE)
-    text = re.sub(r'(.{4,20})\1{2,}', r'\1', text)
-    text = re.sub(r'\s{2,}', ' ', text)
-    return text.strip()
+CLEAN_WORKERS = 4  # 清洗进程数，1 则在本进程内清洗
 
 def filter_words(words, stopwords=STOPWORDS):
     return [
@@ -47,7 +34,11 @@ def filter_words(words, stopwords=STOPWORDS):
 def analyze_file(filepath):
     with open(filepath, encoding="utf-8") as f:
         raw = f.read()
-    text = clean_text(raw)
+    return analyze_text(raw)
+
+def analyze_text(raw, cleaned=False):
+    # 本脚本一直不去除两种装饰字符，与 markov_generate 的清洗略有不同
+    text = raw if cleaned else clean_text(raw, decorations=False)
     words = jieba.lcut(text)
     words = filter_words(words)
     keywords = jieba.analyse.extract_tags(' '.join(words), topK=10)
@@ -73,21 +64,52 @@ def ensure_dir(d):
     if not os.path.exists(d):
         os.makedirs(d)
 
-def main(output_dir="output", result_dir="nlp-result", wordcloud_font="msyh.ttc"):
+def iter_threads(output_dir="output", corpus_dir="corpus"):
+    """依次返回 (吧名, 帖子名, 全文)：先读分段语料库，再读旧格式的 output/吧名/*.txt；读不出的帖子打印错误后跳过"""
+    def on_error(tid, e):
+        print(f"读取语料库帖子 {tid} 出错: {e}")
+
+    for tid, records in CorpusStore(corpus_dir).iter_threads(on_error=on_error):
+        bar = records[0]["bar"]
+        name = f"{records[0].get('title', '')}({tid})"
+        yield bar, name, '\n'.join(r["text"] for r in records)
+    if not os.path.isdir(output_dir):
+        return
+    for bar in os.listdir(output_dir):
+        bar_path = os.path.join(output_dir, bar)
+        if not os.path.isdir(bar_path): continue
+        for fname in os.listdir(bar_path):
+            try:
+                with open(os.path.join(bar_path, fname), encoding="utf-8") as f:
+                    raw = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"处理文件 {bar}/{fname} 出错: {e}")
+                continue
+            yield bar, fname, raw
+
+def main(output_dir="output", result_dir="nlp-result", wordcloud_font="msyh.ttc", corpus_dir="corpus"):
     ensure_dir(result_dir)
     all_words = []
     file_results = []
     bar_words = defaultdict(list)
     bar_file_results = defaultdict(list)
-    print("批量分析 output 目录下所有帖子...")
+    print("批量分析语料库和 output 目录下所有帖子...")
 
-    for bar in os.listdir(output_dir):
-        bar_path = os.path.join(output_dir, bar)
-        if not os.path.isdir(bar_path): continue
-        for fname in os.listdir(bar_path):
-            fpath = os.path.join(bar_path, fname)
+    # 清洗在进程池中提前进行，结果按读入顺序返回，与帖子名一一对应
+    pending = deque()
+
+    def raw_texts():
+        for bar, fname, raw in iter_threads(output_dir, corpus_dir):
+            pending.append((bar, fname))
+            yield raw
+
+    # 进程池用with管理，读入或清洗中途出错也会关掉清洗进程；单个帖子分析失败只打印错误，继续下一个
+    with CleanPool(CLEAN_WORKERS, decorations=False, chunk_size=20) as pool:
+        for text in pool.map(raw_texts()):
+            bar, fname = pending.popleft()
+            fpath = f"{bar}/{fname}"
             try:
-                result = analyze_file(fpath)
+                result = analyze_text(text, cleaned=True)
                 all_words += result["words"]
                 file_results.append({
                     "bar": bar,
@@ -1,17 +1,25 @@
+import sys
 import redis
+from tieba_tasks import TaskQueue
 
 REDIS_HOST = "localhost"
 REDIS_PORT = 6379
 REDIS_DB = 0
 TASKS_REDIS_KEY = "tieba_tasks"
+TASKS_TXT = "tasks.txt"
+BATCH_SIZE = 500          # 每次脚本调用导入的任务数，所有批次走同一个pipeline
+
+# 追加导入：不清空队列，worker运行中也可以导入；已导入过的任务自动跳过，重复执行本脚本没有副作用。
+# 加参数 --requeue-done 时，已完成的任务重新入队（用于定期重爬），处理中的任务不受影响
+requeue_done = "--requeue-done" in sys.argv[1:]
 
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
-r.delete(TASKS_REDIS_KEY)
+queue = TaskQueue(r, TASKS_REDIS_KEY)
 
-with open("tasks.txt", "r", encoding="utf-8") as f:
-    for line in f:
-        line = line.strip()
-        if line:
-            r.rpush(TASKS_REDIS_KEY, line)
+with open(TASKS_TXT, "r", encoding="utf-8") as f:
+    lines = [line.strip() for line in f if line.strip()]
 
-print("已导入全部任务到Redis队列")
\ No newline at end of file
+queued, requeued = queue.load(lines, requeue_done=requeue_done, batch_size=BATCH_SIZE)
+skipped = len(lines) - queued - requeued
+print(f"共 {len(lines)} 个任务：新入队 {queued} 个，重新入队 {requeued} 个，已存在跳过 {skipped} 个")
+print(f"任务队列状态：{queue.stats()}")
@@ -0,0 +1,195 @@
+"""
+贴吧文本清洗，markov_generate.py、nlp-analysis.py 和流式清洗共用。
+
+输出与原先两个脚本里各自的 clean_text 逐字一致（nlp-analysis.py 的版本不去除两种装饰字符，用 decorations=False），
+但不再有回溯很重的正则：
+  - 所有正则预编译；连续重复字符（5个以上任意字符、3个以上标点）合并为一遍扫描
+  - “来自:…客户端 / 发自…客户端” 只在最后一个“客户端”之前的部分匹配，之后的部分不再从每个“来自:”扫到行尾
+  - 4~20字的片段连续重复3次以上时只保留一份：原先用 (.{4,20})\\1{2,}，每个位置都要回溯17种长度；
+    现在先统计4字片段，出现不足3次的片段不可能构成重复，只在其余位置用切片比较核实，耗时与长度成线性
+批量清洗用 CleanPool / clean_lines，多进程并保持输入顺序
+"""
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+NOISE_TAGS = ('[图片]', '[表情]', '[广告]')
+REPEAT_MIN_LEN = 4
+REPEAT_MAX_LEN = 20
+REPEAT_MIN_COPIES = 3
+
+_RUN_RE = re.compile(r'(.)\1{2,}')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_FILLER_RE = re.compile(
+    r'(?:支持|顶|沙发|路过|关注|前排|占座|加油|up|mark|围观|感谢|谢谢|收藏|学习|帮顶|dddd|dddddd|6+|666+|233+){2,}',
+    re.IGNORECASE,
+)
+_NOISE_HEAD = r'作者已被贴吧屏蔽|点击展开|查看完整图片'
+_NOISE_DECORATIONS = r'| ۣۣۖۖิ| ۖิ'
+_NOISE_TAIL = r'|本吧发帖|贴吧用户_[0-9a-zA-Z]+'
+_NOISE_CLIENT = r'|来自:.*客户端|发自.*客户端'
+_NOISE_END = r'|已阅|已读|已收藏|已关注'
+_CLIENT = '客户端'
+_SPACES_RE = re.compile(r'\s{2,}')
+
+
+def _collapse_run(m):
+    """5个以上任意字符、或3个以上同一标点，合并为一个（原先两遍 re.sub 的结果）"""
+    run = m.group(0)
+    if len(run) >= 5 or _PUNCT_RE.match(run):
+        return run[0]
+    return run
+
+
+def collapse_repeats(text, min_len=REPEAT_MIN_LEN, max_len=REPEAT_MAX_LEN, min_copies=REPEAT_MIN_COPIES):
+    """
+    与 re.sub(r'(.{4,20})\\1{2,}', r'\\1', text) 结果相同：从左到右，在每个位置取能连续重复
+    min_copies 次的最长片段，整段重复替换为一份，从重复段之后继续。
+    片段在 i、i+L、i+2L 处各出现一次，所以它的前 min_len 个字在全文至少出现 min_copies 次；
+    只有这样的位置才需要核实，每次核实是几次切片比较
+    """
+    n = len(text)
+    if n < min_len * min_copies:
+        return text
+    grams = [text[k:k + min_len] for k in range(n - min_len + 1)]
+    if len(set(grams)) > len(grams) - (min_copies - 1):
+        return text  # 没有任何4字片段出现3次
+    # nxt[k]：与位置k相同的4字片段下一次出现的位置；候选的重复长度只能是沿这条链走到的距离
+    nxt = [0] * len(grams)
+    seen = {}
+    for k in range(len(grams) - 1, -1, -1):
+        g = grams[k]
+        nxt[k] = seen.get(g, -1)
+        seen[g] = k
+    last_gram = len(grams) - 1
+    out = []
+    last = 0
+    for i, g in enumerate(grams):
+        if i < last:
+            continue
+        p = nxt[i]
+        if p < 0 or p - i > max_len or nxt[p] < 0:
+            continue
+        lengths = []
+        while 0 <= p - i <= max_len:
+            if p - i >= min_len:
+                lengths.append(p - i)
+            p = nxt[p]
+            if p < 0:
+                break
+        for length in reversed(lengths):
+            # 第三份开头的4字片段也要相同，再用切片核实整份
+            if i + (min_copies - 1) * length > last_gram or grams[i + (min_copies - 1) * length] != g:
+                continue
+            unit = text[i:i + length]
+            if '\n' in unit or any(text[i + c * length:i + (c + 1) * length] != unit for c in range(1, min_copies)):
+                continue
+            end = i + min_copies * length
+            while text[end:end + length] == unit:
+                end += length
+            out.append(text[last:i])
+            out.append(unit)
+            last = end
+            break
+    if not out:
+        return text
+    out.append(text[last:])
+    return ''.join(out)
+
+
+class TextCleaner:
+    """一组预编译好的清洗规则；decorations=False 时与 nlp-analysis.py 原先的版本一致，不去除两种装饰字符"""
+
+    def __init__(self, decorations=True):
+        self.decorations = decorations
+        local = _NOISE_HEAD + (_NOISE_DECORATIONS if decorations else '') + _NOISE_TAIL
+        self._noise_re = re.compile(f'(?:{local}{_NOISE_CLIENT}{_NOISE_END})', re.IGNORECASE)
+        self._noise_local_re = re.compile(f'(?:{local}{_NOISE_END})', re.IGNORECASE)
+
+    def _strip_noise(self, text):
+        # “来自:.*客户端”贪婪匹配到最后一个“客户端”，之后的部分不可能再匹配这两种写法；
+        # 其余写法都不含“客户端”，匹配不会跨过分界，分两段替换与整段替换结果相同
+        k = text.rfind(_CLIENT)
+        if k < 0:
+            return self._noise_local_re.sub('', text)
+        k += len(_CLIENT)
+        return self._noise_re.sub('', text[:k]) + self._noise_local_re.sub('', text[k:])
+
+    def clean(self, text):
+        text = text.replace('\r', '').replace('\n', ' ')
+        for tag in NOISE_TAGS:
+            text = text.replace(tag, '')
+        text = _RUN_RE.sub(_collapse_run, text)
+        text = _FILLER_RE.sub('', text)
+        text = self._strip_noise(text)
+        text = collapse_repeats(text)
+        text = _SPACES_RE.sub(' ', text)
+        return text.strip()
+
+
+_CLEANERS = {True: TextCleaner(decorations=True), False: TextCleaner(decorations=False)}
+
+
+def clean_text(text, decorations=True):
+    return _CLEANERS[decorations].clean(text)
+
+
+def _clean_chunk(args):
+    decorations, lines = args
+    clean = _CLEANERS[decorations].clean
+    return [clean(line) for line in lines]
+
+
+class CleanPool:
+    """
+    多进程批量清洗，输出顺序与输入一致。map() 接受列表或任意可迭代的行流，
+    同时在途的块不超过 workers*2 个，读大文件时内存有上限。workers<=1 时在本进程内清洗
+    """
+
+    def __init__(self, workers=None, decorations=True, chunk_size=1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.decorations = decorations
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    def _chunks(self, lines):
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def map(self, lines):
+        if self.executor is None:
+            clean = _CLEANERS[self.decorations].clean
+            for line in lines:
+                yield clean(line)
+            return
+        pending = deque()
+        for chunk in self._chunks(lines):
+            pending.append(self.executor.submit(_clean_chunk, (self.decorations, chunk)))
+            if len(pending) >= self.workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def clean_lines(lines, workers=None, decorations=True, chunk_size=1000):
+    """一次性批量清洗，返回与输入等长的列表"""
+    with CleanPool(workers, decorations, chunk_size) as pool:
+        return list(pool.map(lines))
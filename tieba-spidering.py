@@ -2,31 +2,101 @@ import os
 import re
 import time
 import random
-import json
 import threading
-from datetime import datetime
+import asyncio
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.edge.options import Options
 from selenium.webdriver.edge.service import Service
-from bs4 import BeautifulSoup
 import redis
+from tieba_fetcher import HttpFetcher, HybridFetcher, DriverPool
+from tieba_tasks import (
+    TaskQueue, ThreadFrontier, RedisSeenSet, RedisBloomSeenSet, ThreadStateStore, make_worker_id, task_line,
+)
+from tieba_store import CorpusStore
+from tieba_checkpoint import CheckpointJournal
+from tieba_log import setup_logging, ArtifactStore
+from tieba_metrics import Metrics, SummaryReporter, start_http_server
+from tieba_proxies import ProxyPool, OUTCOME_ERROR
+from tieba_identity import CookiePool
+from tieba_stream import CorpusStream
+from tieba_ratelimit import (
+    RateController, proxy_key, cookie_key, OUTCOME_OK, OUTCOME_EMPTY, OUTCOME_CAPTCHA, OUTCOME_EXPIRED,
+)
+from tieba_parser import (
+    RISK_CAPTCHA, RISK_LOGIN, scan_risk, check_page, needs_browser, is_valid_speech,
+    ThreadLink, parse_thread_list, parse_thread_page, parse_lzl_page, parse_total_comment, tid_from_url,
+)
 
 MY_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0"
-LOG_FILE = "tieba_crawler.log"
+LOG_FILE = "tieba_crawler.log"  # JSON-lines日志，每行一条事件
+LOG_LEVEL = logging.INFO
+LOG_MAX_MB = 50            # 日志文件超过该大小后轮转
+LOG_BACKUPS = 5            # 保留的轮转日志个数
+ARTIFACT_DIR = "artifacts" # 异常页面源码的采样存档目录
+ARTIFACT_SAMPLE_RATE = 0.2 # 异常页面存档抽样比例
+ARTIFACT_MAX_PER_MIN = 6   # 每分钟最多存档的页面数
+METRICS_PORT = 9108        # 本地指标端口（Prometheus文本格式 /metrics），被占用时依次尝试后面9个端口，0为不开启
+METRICS_SUMMARY_INTERVAL = 60  # 每隔多少秒在日志中输出一行采集统计
 EDGE_DRIVER_PATH = r"C:\Users\30522\Desktop\Coding\vscode\msedgedriver.exe"
-RECOVER_FILE = "resume_info.json"
-COOKIES_TXT = "cookies.txt"
+CHECKPOINT_DB = "checkpoints.db"  # 断点日志（SQLite WAL），按任务记录续爬位置
+COOKIES_TXT = "cookies.txt"   # 新增的Cookie在文件修改后自动登记到共享Cookie池
+COOKIES_REDIS_KEY = "tieba_cookies"
+COOKIE_COOLDOWN_TIME = 1800  # 遇到验证码未能人工解决的Cookie冷却时间（秒），期间不再出租给任何worker
 PROXIES_TXT = "proxies.txt"
 TASKS_REDIS_KEY = "tieba_tasks"
-TASKS_INPROGRESS = "tasks_inprogress.txt"
-TASKS_DONE = "tasks_done.txt"
+TASK_LEASE_TTL = 600       # 任务租约时长（秒），worker每1/3租约时长心跳续约一次，崩溃后过期自动回收
+TASK_MAX_ATTEMPTS = 3      # 同一任务最多领取次数，超过后移入失败列表
+TASK_TARGET_SECONDS = 1200 # 列表页任务的目标耗时，按已完成页的速度估计超出时把后半段页码拆成新任务放回队列
+USE_THREAD_FRONTIER = True # 列表页任务只把新帖子推入共享帖子队列，帖子由任意worker领取采集
+THREADS_REDIS_KEY = "tieba_threads"
+SEEN_REDIS_KEY = "tieba_seen_tids"
+SEEN_BACKEND = "set"       # "set": Redis集合精确去重；"bloom": Redis位图Bloom过滤器，千万级tid省内存
+BLOOM_CAPACITY = 10_000_000
+BLOOM_ERROR_RATE = 0.001
+THREAD_STATE_REDIS_KEY = "tieba_thread_state"  # 每个帖子的回复数/最后楼层/最后页码/采集时间
+RECRAWL_MODE = False       # 增量重爬：列表页回复数没变的老帖子直接跳过，有新回复的从上次最后一页续采并追加写入
+TIEBA_BASE_URL = "https://tieba.baidu.com"  # 可改为本地替身服务器地址进行测试
+FETCH_ENGINE = "http"  # "http": requests长连接抓取，遇验证码/JS墙才回退Selenium；"selenium": 全程浏览器
+STORAGE_BACKEND = "store"  # "store": 追加写入分段压缩语料库 CORPUS_DIR；"txt": 旧格式，每帖一个 output/吧名/标题.txt
+CORPUS_DIR = "corpus"
+CORPUS_SEGMENT_MB = 64     # 单个语料段文件的大小上限，超过后换新段
+CORPUS_STREAM = False      # True: 每个保存的帖子同时发布到Redis Stream，由 markov_generate.py 功能5 持续清洗去重
+CORPUS_STREAM_KEY = "tieba_corpus_stream"
+STREAM_MAX_BACKLOG = 5000  # 流中未处理的帖子达到该数量时暂停采集等待消费者追上
+STREAM_MAX_WAIT = 60       # 背压最多等待秒数，超时后照常发布，积压降下来之前不再等待（消费者没启动时不会卡死采集）
 
-SLEEP_PAGE = (5, 10)
+SLEEP_PAGE = (5, 10)       # 无速率身份（如人工验证浏览器）时使用的固定间隔
 SLEEP_THREAD = (3, 8)
 SLEEP_RETRY = 30
+SLEEP_LZL = 1.5
+RATE_STATE_FILE = "rate_state.json"  # 各代理/Cookie学到的请求速率，重启后沿用
+RATE_MIN_PER_MIN = 2       # 每个代理/Cookie的请求速率下限（次/分钟）
+RATE_MAX_PER_MIN = 60      # 速率上限
+RATE_INCREASE = 0.5        # 每个正常页面速率增加量
+LZL_CONCURRENCY = 3        # 楼中楼旁路并发抓取数
+LZL_PAGE_SIZE = 10         # /p/comment 每页楼中楼条数
 CAPTCHA_TIMEOUT = 300      # 5分钟卡人工验证自动切换cookie
 ALL_COOKIE_TIMEOUT = 1200  # 20分钟所有cookie失效后自动停下
-PROXY_COOLDOWN_TIME = 600  # 10分钟，被风控后该IP冷却时间（秒）
+PROXY_COOLDOWN_TIME = 600  # 10分钟，被风控后该IP冷却时间（秒），记在Redis代理池里，所有worker共享
+PROXY_POOL_REDIS_KEY = "tieba_proxies"
+PROXY_MAX_LEASES = 2       # 同一代理最多同时被几个同步worker领用
+PROXY_LATENCY_REF = 2.0    # 健康分中的参考延迟（秒），延迟为该值时健康分减半
+PROXY_STATS_REFRESH = 10   # 并发模式下按代理健康度挑选身份，健康度缓存秒数
+DRIVER_MAX_PAGES = 300            # 单个浏览器加载多少页后回收重建
+DRIVER_MAX_MEMORY_GROWTH_MB = 512 # JS堆比启动时增长超过该值则回收重建
+DRIVER_IDLE_TTL = 1800            # 空闲浏览器保留时间（秒）
+DRIVER_MAX_IDLE = 4               # 最多保留的空闲浏览器数
+
+# ========== 并发采集配置 ==========
+CRAWL_MODE = "sync"        # "sync": 单浏览器顺序采集（支持人工验证）；"async": asyncio多身份并发采集
+ASYNC_CONCURRENCY = 16     # 单进程同时在途的请求数
+ASYNC_PER_PROXY = 2        # 每个代理IP同时在途的请求数上限
+ASYNC_PER_COOKIE = 1       # 每个Cookie同时在途的请求数上限
+ASYNC_RETRY = 3            # 遇风控/Cookie失效时换身份重试的次数
+ASYNC_MAX_COOKIES = 8      # 并发模式下每个进程最多同时领用的Cookie数，其余留给其他worker
 
 # ========== Redis配置 ==========
 REDIS_HOST = "localhost"  # 修改为你的Redis主机
@@ -34,24 +104,77 @@ REDIS_PORT = 6379
 REDIS_DB = 0
 # ==============================
 
-def log(msg):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"[{ts}] {msg}")
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {msg}\n")
+WORKER_ID = make_worker_id()
+# 日志先进内存队列，由后台线程写文件和控制台
+LOGGER = setup_logging(LOG_FILE, level=LOG_LEVEL, max_bytes=LOG_MAX_MB * 1024 * 1024,
+                       backup_count=LOG_BACKUPS, static_fields={"worker": WORKER_ID})
+ARTIFACTS = ArtifactStore(ARTIFACT_DIR, sample_rate=ARTIFACT_SAMPLE_RATE, max_per_minute=ARTIFACT_MAX_PER_MIN)
+
+def log(msg, level=logging.INFO, **fields):
+    LOGGER.log(level, msg, extra={"fields": fields} if fields else None)
+
+def log_bad_page(msg, url, page_source):
+    """异常页面：日志只记一行，源码按采样写入 ARTIFACT_DIR"""
+    path = ARTIFACTS.save(url, page_source)
+    log(msg + (f"，页面源码已存档：{path}" if path else ""), level=logging.WARNING, url=url, artifact=path)
 
 def safe_filename(name):
     return re.sub(r'[\\/:*?"<>|]', '_', name)
 
-def save_resume_info(resume_info):
-    with open(RECOVER_FILE, "w", encoding="utf-8") as f:
-        json.dump(resume_info, f, ensure_ascii=False, indent=2)
+def thread_filepath(save_dir, bar, title):
+    return os.path.join(save_dir, safe_filename(bar), safe_filename(title) + '.txt')
 
-def load_resume_info():
-    if os.path.exists(RECOVER_FILE):
-        with open(RECOVER_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return None
+def save_thread_file(filepath, content, append=False):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    if append:
+        if not content:
+            return
+        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+            content = '\n' + content
+    with open(filepath, 'a' if append else 'w', encoding='utf-8') as f:
+        f.write(content)
+
+# 分段语料库，按tid索引，帖子标题重名也不会互相覆盖
+CORPUS_STORE = CorpusStore(CORPUS_DIR, segment_max_bytes=CORPUS_SEGMENT_MB * 1024 * 1024)
+
+def thread_saved(save_dir, bar, thread):
+    if STORAGE_BACKEND == "store":
+        return CORPUS_STORE.contains(thread.tid)
+    return os.path.exists(thread_filepath(save_dir, bar, thread.title))
+
+def save_thread_records(save_dir, bar, thread, records, append=False):
+    """按 STORAGE_BACKEND 保存一个帖子的记录，返回保存位置（用于日志）"""
+    if STORAGE_BACKEND == "store":
+        now = time.time()
+        CORPUS_STORE.append_thread(thread.tid, [
+            {"bar": bar, "tid": thread.tid, "title": thread.title, **r, "crawled_at": now} for r in records
+        ])
+        return f"{CORPUS_DIR}(tid={thread.tid})"
+    filepath = thread_filepath(save_dir, bar, thread.title)
+    save_thread_file(filepath, '\n'.join(r["text"] for r in records), append=append)
+    return filepath
+
+# 每个任务一行断点，同一目录下的多个worker互不覆盖
+CHECKPOINTS = CheckpointJournal(CHECKPOINT_DB, worker=WORKER_ID)
+
+def resume_task_key(bar_list, start_page, max_pages, preset_threads=None):
+    """
+    断点按任务区分：同一组吧+起始页（或同一批帖子）的任务续用同一个断点。
+    不含结束页：任务被拆分缩小范围后，再次领到它的worker仍接着原来的断点
+    """
+    key = {"bars": list(bar_list), "page_start": start_page}
+    if preset_threads is not None:
+        key["tids"] = [t.tid for t in preset_threads]
+    return task_line(key)
+
+def save_resume_info(task_key, resume_info):
+    CHECKPOINTS.save(task_key, resume_info)
+
+def load_resume_info(task_key):
+    return CHECKPOINTS.load(task_key)
+
+def clear_resume_info(task_key):
+    CHECKPOINTS.clear(task_key)
 
 def load_cookie_list():
     if os.path.exists(COOKIES_TXT):
@@ -79,7 +202,7 @@ def setup_driver(headless=True, proxy=None):
     return driver
 
 def add_cookies(driver, cookie_str):
-    driver.get("https://tieba.baidu.com/")
+    driver.get(TIEBA_BASE_URL + "/")
     time.sleep(3)
     for pair in cookie_str.split(";"):
         if '=' in pair:
@@ -88,33 +211,166 @@ def add_cookies(driver, cookie_str):
             try:
                 driver.add_cookie(cookie_dict)
             except Exception as e:
-                log(f"添加Cookie失败: {cookie_dict} 错误: {e}")
+                log(f"添加Cookie失败: {cookie_dict} 错误: {e}", level=logging.WARNING)
+
+# 按代理和Cookie自适应调整请求间隔，替代固定的SLEEP_*随机等待
+RATE_CONTROLLER = RateController(
+    RATE_STATE_FILE,
+    start_rate=60 / (sum(SLEEP_THREAD) / 2),
+    min_rate=RATE_MIN_PER_MIN,
+    max_rate=RATE_MAX_PER_MIN,
+    increase_per_page=RATE_INCREASE,
+)
+
+def identity_rate_keys(proxy, cookie_str):
+    return (proxy_key(proxy), cookie_key(cookie_str))
+
+# 各阶段耗时和页面/楼层计数，按代理、Cookie、吧区分
+METRICS = Metrics()
+
+def metric_labels(limited, bar=""):
+    keys = getattr(limited, 'rate_keys', None)
+    if not keys:
+        return {"proxy": "-", "cookie": "-", "bar": bar}
+    return {"proxy": keys[0].split(":", 1)[1], "cookie": keys[1].split(":", 1)[1], "bar": bar}
+
+NETWORK_STAGES = ("fetch", "lzl")
+
+def limited_proxy(limited):
+    """请求所用的代理，直连或无速率身份时为None"""
+    keys = getattr(limited, 'rate_keys', None)
+    if not keys or keys[0] == proxy_key(None):
+        return None
+    return keys[0].split(":", 1)[1]
+
+@contextmanager
+def timed(stage, limited=None, bar=""):
+    """
+    统计一个阶段的耗时：fetch/page_source/parse/lzl/sleep/captcha_wait/write/publish（含背压等待）。
+    抓取阶段的耗时记到limited上，随下一次report()反馈给代理池；抓取出错直接记一次代理失败
+    """
+    start = time.perf_counter()
+    try:
+        with METRICS.timer("tieba_stage_seconds", stage=stage, **metric_labels(limited, bar)):
+            yield
+    except Exception:
+        if stage in NETWORK_STAGES:
+            report_proxy(limited, OUTCOME_ERROR, time.perf_counter() - start)
+        raise
+    if stage in NETWORK_STAGES and limited is not None:
+        limited.last_latency = time.perf_counter() - start
+
+def start_metrics_server():
+    for port in range(METRICS_PORT, METRICS_PORT + 10):
+        try:
+            start_http_server(METRICS, port)
+        except OSError:
+            continue
+        log(f"采集指标：http://127.0.0.1:{port}/metrics", metrics_port=port)
+        return port
+    log(f"端口 {METRICS_PORT}~{METRICS_PORT + 9} 均被占用，不开启指标端口", level=logging.WARNING)
+    return None
+
+def check_proxy_cooling(proxy):
+    """代理被任一worker标记冷却后，其他worker在下一次请求前就换掉它"""
+    if proxy and PROXY_POOL.is_cooling(proxy):
+        raise Exception(f"ProxyCooling::{proxy}")
+
+def throttle(limited, fallback_range):
+    """请求前按速率控制器等待；没有rate_keys的driver按固定区间等待"""
+    check_proxy_cooling(limited_proxy(limited))
+    keys = getattr(limited, 'rate_keys', None)
+    with timed("sleep", limited):
+        if keys:
+            RATE_CONTROLLER.wait(keys)
+        else:
+            time.sleep(random.uniform(*fallback_range))
+
+def report(limited, outcome):
+    labels = metric_labels(limited)
+    METRICS.inc("tieba_pages_total", outcome=outcome, proxy=labels["proxy"], cookie=labels["cookie"])
+    keys = getattr(limited, 'rate_keys', None)
+    if keys:
+        RATE_CONTROLLER.feedback(keys, outcome)
+    latency = getattr(limited, 'last_latency', None)
+    if latency is not None:
+        limited.last_latency = None
+    report_proxy(limited, outcome, latency)
+    if outcome == OUTCOME_CAPTCHA and keys:
+        try:
+            COOKIE_POOL.note_captcha(keys[1].split(":", 1)[1])
+        except redis.RedisError as e:
+            log(f"Cookie池记录验证码失败：{e}", level=logging.WARNING)
+
+def report_proxy(limited, outcome, latency=None):
+    proxy = limited_proxy(limited)
+    if proxy is None:
+        return
+    try:
+        PROXY_POOL.report(proxy, outcome, latency)
+    except redis.RedisError as e:
+        log(f"代理池反馈失败：{e}", level=logging.WARNING)
+
+def check_page_reported(limited, page_source, url):
+    try:
+        return check_page(page_source, url)
+    except Exception as e:
+        report(limited, OUTCOME_CAPTCHA if str(e).startswith("NeedCaptcha::") else OUTCOME_EXPIRED)
+        raise
+
+def create_logged_in_driver(proxy=None, cookie_str=None, headless=True):
+    driver = setup_driver(headless=headless, proxy=proxy)
+    if cookie_str:
+        add_cookies(driver, cookie_str)
+        time.sleep(2)
+    return driver
+
+# 已登录浏览器池，跨任务复用，避免每轮都冷启动Edge并重新登录
+DRIVER_POOL = DriverPool(
+    create_logged_in_driver,
+    max_pages=DRIVER_MAX_PAGES,
+    max_memory_growth_mb=DRIVER_MAX_MEMORY_GROWTH_MB,
+    idle_ttl=DRIVER_IDLE_TTL,
+    max_idle=DRIVER_MAX_IDLE,
+)
 
 def is_need_captcha(driver):
-    text = driver.page_source
-    keywords = [
-        "安全验证", "人机验证", "请输入验证码", "系统检测到您的请求存在异常"
-    ]
-    for word in keywords:
-        if word in text:
-            return True
-    return False
+    return RISK_CAPTCHA in scan_risk(driver.page_source)
 
 def is_cookie_expired(driver):
-    text = driver.page_source
-    keywords = [
-        "登录百度帐号", "请在手机上确认登录"
-    ]
-    for word in keywords:
-        if word in text:
-            return True
-    return False
+    return RISK_LOGIN in scan_risk(driver.page_source)
+
+def setup_fetcher(proxy=None, cookie_str=None):
+    """
+    按 FETCH_ENGINE 创建抓取器，返回对象与WebDriver接口一致（get/page_source/quit）
+    """
+    if FETCH_ENGINE == "selenium":
+        driver = DRIVER_POOL.acquire(proxy, cookie_str)
+        driver.rate_keys = identity_rate_keys(proxy, cookie_str)
+        return driver
+
+    def driver_factory():
+        return DRIVER_POOL.acquire(proxy, cookie_str)
+
+    def on_fallback(url):
+        log(f"HTTP抓取遇到验证码/JS墙，回退Selenium加载：{url}", level=logging.WARNING)
+
+    http = HttpFetcher(MY_UA, cookie_str=cookie_str, proxy=proxy)
+    fetcher = HybridFetcher(http, driver_factory, needs_browser, on_fallback=on_fallback)
+    fetcher.rate_keys = identity_rate_keys(proxy, cookie_str)
+    return fetcher
 
-def wait_for_manual_captcha_with_timeout(driver, url, stage_desc="", timeout=CAPTCHA_TIMEOUT):
-    log(f"检测到安全验证（{stage_desc}），已弹出浏览器，请在页面中手动完成验证，然后按回车继续（限时{timeout//60}分钟）")
-    driver.quit()
-    driver = setup_driver(headless=False)
-    driver.get(url)
+def wait_for_manual_captcha_with_timeout(driver, url, stage_desc="", timeout=CAPTCHA_TIMEOUT, proxy=None, cookie_str=None):
+    log(f"检测到安全验证（{stage_desc}），已弹出浏览器，请在页面中手动完成验证，然后按回车继续（限时{timeout//60}分钟）", level=logging.WARNING)
+    if isinstance(driver, HybridFetcher):
+        # HTTP抓取器保留会话，只弹出浏览器做人工验证，完成后同步Cookie回去
+        fetcher = driver
+    else:
+        fetcher = None
+        driver.quit()
+    browser = DRIVER_POOL.acquire(proxy, cookie_str, headless=False)
+    browser.rate_keys = identity_rate_keys(proxy, cookie_str)
+    browser.get(url)
     user_input = {"done": False}
 
     def wait_input():
@@ -124,130 +380,208 @@ def wait_for_manual_captcha_with_timeout(driver, url, stage_desc="", timeout=CAP
     t = threading.Thread(target=wait_input)
     t.daemon = True
     t.start()
-    t.join(timeout)
+    with timed("captcha_wait", browser):
+        t.join(timeout)
     if t.is_alive():
-        log(f"超时{timeout//60}分钟无人操作，自动切换到下一个Cookie！")
-        return driver, False
-    else:
-        log("人工验证已完成，继续任务。")
-        return driver, True
-
-def has_next_page(soup):
-    for a in soup.find_all('a'):
-        if a.text.strip() in ['下一页', '下一页 >', '下一页›']:
-            return True
-    return False
-
-def is_valid_speech(text):
-    if len(text) < 8:
-        return False
-    if not any('\u4e00' <= ch <= '\u9fff' for ch in text):
-        return False
-    keywords = [
-        '吧务提醒', '签到', '本帖最后由', '回复：', '引用', '客户端', '推广', '广告', '[图片]', '[表情]', 'img', '楼主'
-    ]
-    for k in keywords:
-        if k in text:
-            return False
-    if re.search(r'\[.+?\]', text):
-        return False
-    return True
+        log(f"超时{timeout//60}分钟无人操作，自动切换到下一个Cookie！", level=logging.WARNING)
+        browser.discard()  # 未通过验证的浏览器不再复用
+        return fetcher or browser, False
+    log("人工验证已完成，继续任务。")
+    if fetcher is not None:
+        fetcher.adopt_browser(browser)
+        return fetcher, True
+    return browser, True
 
 def get_lzl_comments_if_exist(driver, tid, pid, post):
-    lzl_entry = post.find('a', attrs={'class': 'j_lzl_s_p'})
-    if not lzl_entry:
+    if not post.has_lzl:
         return []
     lzl_comments = []
     lzl_pn = 1
     while True:
-        comment_url = f"https://tieba.baidu.com/p/comment?tid={tid}&pid={pid}&pn={lzl_pn}"
-        driver.get(comment_url)
-        time.sleep(1.5)
-        comment_soup = BeautifulSoup(driver.page_source, 'html.parser')
-        comment_texts = comment_soup.find_all('span', attrs={'class': 'lzl_content_main'})
-        if not comment_texts:
+        throttle(driver, (SLEEP_LZL, SLEEP_LZL))
+        with timed("lzl", driver):
+            driver.get(lzl_comment_url(tid, pid, lzl_pn))
+            page_source = driver.page_source
+        with timed("parse", driver):
+            lzl_page = parse_lzl_page(page_source)
+        report(driver, OUTCOME_OK)
+        if not lzl_page.comments:
             break
-        for c in comment_texts:
-            cmt = c.get_text(strip=True)
+        for cmt in lzl_page.comments:
             if is_valid_speech(cmt):
                 lzl_comments.append(cmt)
-        next_lzl = False
-        for a in comment_soup.find_all('a'):
-            if a.text.strip() in ['下一页', '下一页 >', '下一页›']:
-                next_lzl = True
-                break
-        if next_lzl:
+        if lzl_page.has_next:
             lzl_pn += 1
         else:
             break
     return lzl_comments
 
-def get_thread_content_selenium(thread_url, driver, max_floors=100, bar_name="", thread_title=""):
-    content = []
-    pn = 1
+def lzl_comment_url(tid, pid, lzl_pn):
+    return f"{TIEBA_BASE_URL}/p/comment?tid={tid}&pid={pid}&pn={lzl_pn}"
+
+def total_comment_url(tid, fid, pn):
+    return f"{TIEBA_BASE_URL}/p/totalComment?t={int(time.time() * 1000)}&tid={tid}&fid={fid}&pn={pn}&see_lz=0"
+
+def lzl_side_channel(driver):
+    """返回可并发调用fetch()的HTTP会话；纯Selenium模式没有旁路，返回None"""
+    if isinstance(driver, HybridFetcher):
+        return driver.http
+    if isinstance(driver, HttpFetcher):
+        return driver
+    return None
+
+def fetch_lzl_pages(limited, http, tid, pid, start_pn=1):
+    comments = []
+    lzl_pn = start_pn
+    while True:
+        url = lzl_comment_url(tid, pid, lzl_pn)
+        throttle(limited, (SLEEP_LZL, SLEEP_LZL))
+        with timed("lzl", limited):
+            _, _, page_source = http.fetch(url)
+        check_page_reported(limited, page_source, url)
+        with timed("parse", limited):
+            lzl_page = parse_lzl_page(page_source)
+        report(limited, OUTCOME_OK)
+        if not lzl_page.comments:
+            break
+        comments.extend(lzl_page.comments)
+        if not lzl_page.has_next:
+            break
+        lzl_pn += 1
+    return comments
+
+def plan_lzl_fetch(total, pids):
+    """
+    根据totalComment结果决定每个pid还需从 /p/comment 第几页开始补抓
+    返回 (已拿到的楼中楼 {pid: [...]}, 待补抓 {pid: 起始页})
+    """
+    got = {}
+    pending = {}
+    for pid in pids:
+        if total is None:
+            pending[pid] = 1
+            continue
+        if pid not in total:
+            continue  # totalComment里没有该楼层，说明没有楼中楼
+        comments, comment_num = total[pid]
+        if len(comments) >= comment_num:
+            got[pid] = comments
+        elif len(comments) >= LZL_PAGE_SIZE:
+            got[pid] = comments
+            pending[pid] = len(comments) // LZL_PAGE_SIZE + 1
+        else:
+            pending[pid] = 1
+    return got, pending
+
+def get_lzl_comments_batch(limited, http, tid, fid, pn, pids):
+    """
+    一次取回帖子一页所有楼层的楼中楼：先用 /p/totalComment 批量拿，
+    超出一页或接口不可用的楼层再用旁路会话并发翻 /p/comment。返回 {pid: [有效发言]}
+    """
+    if not pids:
+        return {}
+    total = None
+    if fid:
+        url = total_comment_url(tid, fid, pn)
+        throttle(limited, (SLEEP_LZL, SLEEP_LZL))
+        with timed("lzl", limited):
+            _, _, page_source = http.fetch(url)
+        check_page_reported(limited, page_source, url)
+        report(limited, OUTCOME_OK)
+        try:
+            with timed("parse", limited):
+                total = parse_total_comment(page_source)
+        except ValueError as e:
+            log(f"totalComment解析失败，改为逐楼抓取楼中楼：{e}", level=logging.WARNING)
+    got, pending = plan_lzl_fetch(total, pids)
+    if pending:
+        with ThreadPoolExecutor(max_workers=LZL_CONCURRENCY) as executor:
+            futures = {pid: executor.submit(fetch_lzl_pages, limited, http, tid, pid, start_pn) for pid, start_pn in pending.items()}
+            for pid, future in futures.items():
+                got[pid] = got.get(pid, []) + future.result()
+    return {pid: [c for c in comments if is_valid_speech(c)] for pid, comments in got.items()}
+
+def new_posts(posts, after_floor):
+    """增量续采时去掉上次已采过的楼层"""
+    if not after_floor:
+        return posts
+    return [p for p in posts if p.floor is None or int(p.floor) > after_floor]
+
+def post_records(post, lzl_comments):
+    """一个楼层的有效发言及其楼中楼，转成语料记录（帖子级字段在保存时补上）"""
+    records = []
+    if is_valid_speech(post.text):
+        records.append({"pid": post.pid, "floor": post.floor, "parent_pid": None, "text": post.text})
+    records.extend({"pid": None, "floor": post.floor, "parent_pid": post.pid, "text": c} for c in lzl_comments)
+    return records
+
+def get_thread_content_selenium(thread_url, driver, max_floors=100, bar_name="", thread_title="",
+                                start_pn=1, after_floor=0):
+    """
+    从第start_pn页开始采集帖子，只保留楼层号大于after_floor的发言（增量续采）。
+    返回 (记录列表, 进度{last_page, last_floor})
+    """
+    records = []
+    pn = start_pn
     total_floors = 0
-    tid = thread_url.split('/p/')[1].split('?')[0]
+    progress = {"last_page": start_pn, "last_floor": after_floor}
+    tid = tid_from_url(thread_url)
+    http = lzl_side_channel(driver)
     while True:
         url = thread_url + f'?pn={pn}'
-        driver.get(url)
-        time.sleep(random.uniform(*SLEEP_THREAD))
-        if is_cookie_expired(driver):
-            raise Exception("CookieExpired")
-        if is_need_captcha(driver):
-            raise Exception(f"NeedCaptcha::{url}")
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        posts = soup.find_all('div', attrs={'class': 'l_post l_post_bright j_l_post clearfix'})
-        if not posts:
-            log(f"[{bar_name}] 帖子[{thread_title}]第{pn}页未发现发言内容，打印源码片段：")
-            log(driver.page_source[:1500])
+        throttle(driver, SLEEP_THREAD)
+        with timed("fetch", driver, bar_name):
+            driver.get(url)
+        with timed("page_source", driver, bar_name):
+            page_source = driver.page_source
+        check_page_reported(driver, page_source, url)
+        with timed("parse", driver, bar_name):
+            thread_page = parse_thread_page(page_source)
+        if not thread_page.posts:
+            report(driver, OUTCOME_EMPTY)
+            log_bad_page(f"[{bar_name}] 帖子[{thread_title}]第{pn}页未发现发言内容", url, page_source)
             break
+        report(driver, OUTCOME_OK)
+        posts = new_posts(thread_page.posts, after_floor)[:max_floors - total_floors]
+        progress["last_page"] = pn
+        METRICS.inc("tieba_floors_total", len(posts), bar=bar_name)
+        lzl = None
+        if http is not None:
+            lzl = get_lzl_comments_batch(driver, http, tid, thread_page.fid, pn, [p.pid for p in posts if p.pid and p.has_lzl])
         for post in posts:
-            main_content_div = post.find('div', attrs={'class': 'd_post_content'})
-            if not main_content_div:
-                continue
-            text = main_content_div.get_text(strip=True)
-            try:
-                data_field = json.loads(post.get('data-field', '{}'))
-                floor_num = data_field.get("content", {}).get("post_no", "")
-                pid = data_field.get("content", {}).get("post_id", "")
-            except Exception:
-                floor_num = ""
-                pid = ""
-            if is_valid_speech(text):
-                content.append(text)
-            if pid:
-                comments = get_lzl_comments_if_exist(driver, tid, pid, post)
-                content.extend(comments)
+            lzl_comments = []
+            if post.pid:
+                if lzl is not None:
+                    lzl_comments = lzl.get(post.pid, [])
+                else:
+                    lzl_comments = get_lzl_comments_if_exist(driver, tid, post.pid, post)
+            records.extend(post_records(post, lzl_comments))
+            if post.floor is not None:
+                progress["last_floor"] = max(progress["last_floor"], int(post.floor))
             total_floors += 1
             if total_floors >= max_floors:
                 log(f"[{bar_name}] 帖子[{thread_title}]已到达楼层上限 {max_floors}")
-                return '\n'.join(content)
-        if has_next_page(soup) and total_floors < max_floors:
+                return records, progress
+        if thread_page.has_next and total_floors < max_floors:
             pn += 1
-            time.sleep(random.uniform(*SLEEP_THREAD))
         else:
             break
-    return '\n'.join(content)
+    return records, progress
 
 def get_thread_list_selenium(bar_name, page=1, driver=None):
-    url = f'https://tieba.baidu.com/f?kw={bar_name}&pn={(page-1)*50}'
-    driver.get(url)
-    time.sleep(random.uniform(*SLEEP_PAGE))
-    if is_cookie_expired(driver):
-        raise Exception("CookieExpired")
-    if is_need_captcha(driver):
-        raise Exception(f"NeedCaptcha::{url}")
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-    threads = []
-    for item in soup.select('a[href^="/p/"]'):
-        title = item.get('title') or item.text.strip()
-        href = item.get('href')
-        if title and href and href.startswith('/p/'):
-            threads.append({'title': title, 'url': 'https://tieba.baidu.com' + href})
+    url = f'{TIEBA_BASE_URL}/f?kw={bar_name}&pn={(page-1)*50}'
+    throttle(driver, SLEEP_PAGE)
+    with timed("fetch", driver, bar_name):
+        driver.get(url)
+    with timed("page_source", driver, bar_name):
+        page_source = driver.page_source
+    check_page_reported(driver, page_source, url)
+    with timed("parse", driver, bar_name):
+        threads = parse_thread_list(page_source, TIEBA_BASE_URL)
+    report(driver, OUTCOME_OK if threads else OUTCOME_EMPTY)
     log(f"[{bar_name}] 第{page}页解析到 {len(threads)} 个帖子")
     if not threads:
-        log(f"[{bar_name}] 第{page}页未解析到帖子，打印页面部分源码供调试：")
-        log(driver.page_source[:1500])
+        log_bad_page(f"[{bar_name}] 第{page}页未解析到帖子", url, page_source)
     return threads
 
 # ============== Redis分布式任务池 ==============
@@ -255,199 +589,860 @@ def get_thread_list_selenium(bar_name, page=1, driver=None):
 def get_redis_conn():
     return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
 
-def get_one_task():
+def get_task_queue():
+    return TaskQueue(get_redis_conn(), TASKS_REDIS_KEY, lease_ttl=TASK_LEASE_TTL, max_attempts=TASK_MAX_ATTEMPTS)
+
+def get_thread_queue():
+    # 帖子任务数以百万计：完成的只计数不保存，在途tid单独登记，已见集合在帖子保存后才登记
+    return TaskQueue(get_redis_conn(), THREADS_REDIS_KEY, lease_ttl=TASK_LEASE_TTL, max_attempts=TASK_MAX_ATTEMPTS,
+                     keep_done=False, track_tids=True)
+
+def get_seen_set():
+    if SEEN_BACKEND == "bloom":
+        return RedisBloomSeenSet(get_redis_conn(), SEEN_REDIS_KEY, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE)
+    return RedisSeenSet(get_redis_conn(), SEEN_REDIS_KEY)
+
+def get_thread_state_store():
+    return ThreadStateStore(get_redis_conn(), THREAD_STATE_REDIS_KEY)
+
+# 全体worker共享的代理池：健康度、冷却和领用数都在Redis里
+PROXY_POOL = ProxyPool(get_redis_conn(), PROXY_POOL_REDIS_KEY, lease_ttl=TASK_LEASE_TTL, max_leases=PROXY_MAX_LEASES,
+                       cooldown=PROXY_COOLDOWN_TIME, latency_ref=PROXY_LATENCY_REF)
+
+def is_proxy_cooling_error(e):
+    return str(e).startswith("ProxyCooling::")
+
+# 爬虫 -> 清洗/去重的流式通道，CORPUS_STREAM 关闭时为None
+CORPUS_STREAM_PUB = CorpusStream(get_redis_conn(), CORPUS_STREAM_KEY, max_backlog=STREAM_MAX_BACKLOG,
+                                 max_wait=STREAM_MAX_WAIT) if CORPUS_STREAM else None
+
+# 全体worker共享的Cookie池：每个Cookie同一时刻只租给一个worker，失效/验证码记录都在Redis里
+COOKIE_POOL = CookiePool(get_redis_conn(), COOKIES_REDIS_KEY, lease_ttl=TASK_LEASE_TTL, cooldown=COOKIE_COOLDOWN_TIME)
+_cookie_file_mtime = None
+
+def sync_cookie_file():
+    """cookies.txt 的修改时间变了才重新读取，把新增的Cookie登记到共享池"""
+    global _cookie_file_mtime
+    try:
+        mtime = os.path.getmtime(COOKIES_TXT)
+    except OSError:
+        return 0
+    if mtime == _cookie_file_mtime:
+        return 0
+    _cookie_file_mtime = mtime
+    added = COOKIE_POOL.add(load_cookie_list())
+    if added:
+        log(f"检测到新Cookie条目{added}条，已登记到共享Cookie池")
+    return added
+
+def lease_cookie(timeout=ALL_COOKIE_TIMEOUT):
+    """
+    从共享Cookie池领取一个Cookie，没有可用的（都已失效、冷却中或被其他worker占用）时
+    阻塞到有Cookie归还或新增，超时返回None
+    """
+    deadline = time.time() + timeout
+    warned = False
+    while True:
+        sync_cookie_file()
+        lease, wait_time = COOKIE_POOL.acquire(WORKER_ID)
+        if lease is not None:
+            return lease
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        if not warned:
+            log(f"没有可领用的Cookie，请在 cookies.txt 中补充新的 Cookie！Cookie池：{COOKIE_POOL.stats()}", level=logging.ERROR)
+            warned = True
+        log(f"等待Cookie归还或补充...剩余{int(remaining//60)}分")
+        # 最多等一分钟就回来检查一次 cookies.txt 是否有改动
+        COOKIE_POOL.wait(min(remaining, wait_time or 60, 60))
+
+def lease_cookies(n):
+    """并发模式：至少等到一个Cookie，再把当前空闲的Cookie领到n个为止"""
+    first = lease_cookie()
+    if first is None:
+        return []
+    leases = [first]
+    while len(leases) < n:
+        lease, _ = COOKIE_POOL.acquire(WORKER_ID)
+        if lease is None:
+            break
+        leases.append(lease)
+    return leases
+
+def get_one_task(queue, worker_id):
     """
-    从Redis队列里原子领取一个任务（所有进程自然不会重复）
-    返回dict或None
+    从Redis队列里原子领取一个任务并登记租约（所有进程自然不会重复）
+    返回TaskLease或None；worker崩溃后租约过期，任务会被其他worker回收重做
     """
-    r = get_redis_conn()
-    task_line = r.lpop(TASKS_REDIS_KEY)
-    if not task_line:
+    lease = queue.claim(worker_id)
+    if lease and lease.reclaimed:
+        log(f"回收了 {lease.reclaimed} 个租约过期的任务")
+    return lease
+
+def finish_lease(lease):
+    """任务完整采完后记为完成；租约已被回收时不记，由重新领到它的worker完成"""
+    if not lease.done():
+        log(f"任务租约已被回收，不记为完成: {lease.task}", level=logging.WARNING)
+
+def is_abort_error(e):
+    """没有可用Cookie/代理导致的中止，与任务本身无关：任务放回队列，不计入失败次数"""
+    return any(s in str(e) for s in ("NoCookieAvailable", "ProxyOrCookieCooldown", "AllCookiesExpired"))
+
+def plan_thread_crawl(thread, bar, save_dir, seen=None, thread_state=None, check_seen=True):
+    """
+    决定一个帖子怎么采，返回 (跳过原因, 续采参数)：
+    跳过原因不为None时跳过；续采参数为空dict表示从第1页全量采集，
+    增量重爬模式下有新回复的老帖子返回 {start_pn, after_floor}，采到的内容追加写入
+    """
+    exists = thread_saved(save_dir, bar, thread)
+    if RECRAWL_MODE and exists and thread_state is not None:
+        state = thread_state.get(thread.tid)
+        if state is not None:
+            if ThreadStateStore.is_unchanged(thread, state):
+                return f"(tid={thread.tid})没有新回复", None
+            return None, {"start_pn": state.get("last_page") or 1, "after_floor": state.get("last_floor") or 0}
+    if check_seen and seen is not None and seen.contains(thread.tid):
+        return f"(tid={thread.tid})已被采集过", None
+    if exists:
+        if seen is not None:
+            seen.add(thread.tid)  # 已保存但未登记（如其他worker保存后未及登记），补登记免得再次入队
+        return "已存在", None
+    return None, {}
+
+def publish_thread(bar, thread, records):
+    """发布到清洗流水线；发布失败只记日志，语料库中的数据不受影响"""
+    try:
+        with timed("publish", bar=bar):
+            msg_id, timed_out = CORPUS_STREAM_PUB.publish(bar, thread.tid, thread.title, records)
+    except Exception as e:
+        log(f"[{bar}] 帖子[{thread.title}]发布到清洗流水线失败: {e}", level=logging.WARNING, bar=bar, tid=thread.tid)
         return None
-    with open(TASKS_INPROGRESS, "a", encoding="utf-8") as f:
-        f.write(task_line + "\n")
-    return json.loads(task_line)
-
-def mark_task_done(task):
-    task_line = json.dumps(task, ensure_ascii=False)
-    with open(TASKS_DONE, "a", encoding="utf-8") as f:
-        f.write(task_line + "\n")
-
-def batch_crawl_tieba_selenium(bar_list, max_pages=1, start_page=1, save_dir='output', max_floors_per_thread=100):
-    log(f"==== 本次批量爬取任务开始 ====")
-    resume_info = load_resume_info() or {"bar_idx": 0, "page": start_page, "thread_idx": 0}
+    if timed_out:
+        METRICS.inc("tieba_stream_backpressure_timeouts_total", bar=bar)
+        log(f"清洗流水线积压超过{STREAM_MAX_BACKLOG}条，等待{STREAM_MAX_WAIT}秒仍未消化，消费者可能没有运行；"
+            f"积压降下来之前不再等待", level=logging.WARNING, bar=bar)
+    METRICS.inc("tieba_stream_published_total", bar=bar)
+    return msg_id
+
+def save_thread_result(bar, thread, save_dir, records, progress, resume, seen=None, thread_state=None):
+    with timed("write", bar=bar):
+        where = save_thread_records(save_dir, bar, thread, records, append=bool(resume))
+    METRICS.inc("tieba_threads_total", bar=bar)
+    if CORPUS_STREAM_PUB is not None and records:
+        publish_thread(bar, thread, records)
+    if seen is not None:
+        seen.add(thread.tid)
+    if thread_state is not None:
+        thread_state.update(thread.tid, reply_num=thread.reply_num,
+                            last_floor=progress["last_floor"], last_page=progress["last_page"])
+    if resume:
+        log(f"[{bar}] 帖子[{thread.title}]从第{resume['start_pn']}页续采，新内容已追加：{where}",
+            bar=bar, tid=thread.tid, records=len(records))
+    else:
+        log(f"[{bar}] 帖子[{thread.title}]已保存：{where}", bar=bar, tid=thread.tid, records=len(records))
+
+def push_to_frontier(frontier, bar, threads, thread_state=None):
+    """
+    新帖子按tid去重推入共享帖子队列；增量重爬模式下，
+    已采过且列表页回复数变多的帖子绕过去重重新推入
+    """
+    changed = []
+    if RECRAWL_MODE and thread_state is not None and threads:
+        states = thread_state.get_many([t.tid for t in threads])
+        changed = [t for t, state in zip(threads, states)
+                   if state is not None and t.reply_num is not None and not ThreadStateStore.is_unchanged(t, state)]
+    fresh = [t for t in threads if t not in changed]
+    queued = frontier.push_threads(bar, fresh)
+    if changed:
+        queued += frontier.push_threads(bar, changed, force=True)
+        log(f"[{bar}] {len(changed)} 个已采帖子有新回复，重新推入共享帖子队列")
+    return queued
+
+def thread_from_task(task):
+    return ThreadLink(title=task['title'], url=task['url'], tid=task['tid'], reply_num=task.get('reply_num'))
+
+def batch_crawl_tieba_selenium(bar_list, max_pages=1, start_page=1, save_dir='output', max_floors_per_thread=100,
+                               frontier=None, seen=None, preset_threads=None, thread_state=None, splitter=None):
+    """
+    frontier: 给定时列表页只把新帖子推入共享帖子队列，不在本任务内采集
+    seen: 按tid全局去重的已见集合
+    preset_threads: 帖子级任务直接给出要采集的帖子，跳过列表页
+    thread_state: 每个帖子的采集进度，增量重爬据此跳过或续采
+    splitter: TaskSplitter，每翻一页前询问，耗时超出目标时剩余页码拆回任务队列
+    """
+    log("==== 本次批量爬取任务开始 ====")
+    task_key = resume_task_key(bar_list, start_page, max_pages, preset_threads)
+    resume_info = load_resume_info(task_key) or {"bar_idx": 0, "page": start_page, "thread_idx": 0}
     bar_idx = resume_info.get("bar_idx", 0)
     page = resume_info.get("page", start_page)
     thread_idx = resume_info.get("thread_idx", 0)
-    cookie_list = load_cookie_list()
     proxy_list = load_proxy_list()
-    proxy_cooldown_dict = {}
-    cookie_idx = 0
-    proxy_idx = 0
-    all_cookie_fail_time = None
+    cookie_lease = None
+    error = None  # 中止任务的异常，清理完后抛给调用方，任务不会被记为完成
 
     while True:
-        cookie_list = load_cookie_list()
         proxy_list = load_proxy_list()
-        proxy_tried = 0
-        while proxy_tried < len(proxy_list):
-            now = time.time()
-            curr_proxy = proxy_list[proxy_idx % len(proxy_list)]
-            cooldown_end = proxy_cooldown_dict.get(curr_proxy, 0)
-            if now < cooldown_end:
-                proxy_idx += 1
-                proxy_tried += 1
-            else:
+        # Cookie从共享池租用，同一时刻只有本worker在用；失效或验证码换号时才归还换新的
+        if cookie_lease is None:
+            cookie_lease = lease_cookie()
+            if cookie_lease is None:
+                log(f"没有可用Cookie超时{ALL_COOKIE_TIMEOUT//60}分钟，程序自动退出。", level=logging.ERROR)
+                error = Exception("NoCookieAvailable")
                 break
-        else:
-            if proxy_cooldown_dict:
-                soonest_ready = min(proxy_cooldown_dict.values())
-                wait_time = int(soonest_ready - time.time()) + 1
-                log(f"所有代理IP都在冷却中，等待{wait_time}秒后重试...")
+
+        # 从共享代理池领用健康分最高、领用数最少的代理，任务结束或换代理时归还
+        proxy_lease = None
+        if proxy_list:
+            PROXY_POOL.register(proxy_list)
+            proxy_lease, wait_time = PROXY_POOL.acquire(WORKER_ID, proxy_list)
+            if proxy_lease is None:
+                log(f"所有代理IP都在冷却中或已被其他worker占满，等待{wait_time}秒后重试...")
+                cookie_lease.release()  # 等代理期间把Cookie让给其他worker
+                cookie_lease = None
                 time.sleep(wait_time)
                 continue
-
-        if cookie_idx >= len(cookie_list):
-            if all_cookie_fail_time is None:
-                all_cookie_fail_time = time.time()
-            elapsed = time.time() - all_cookie_fail_time
-            if elapsed >= ALL_COOKIE_TIMEOUT:
-                log("所有Cookie失效超时20分钟，程序自动退出。")
-                return
-            log("所有Cookie已失效，请在 cookies.txt 中补充新的 Cookie！")
-            log(f"等待人工补充Cookie...剩余{int((ALL_COOKIE_TIMEOUT - elapsed)//60)}分")
-            for _ in range(60):
-                time.sleep(1)
-                cookie_list = load_cookie_list()
-                if len(cookie_list) > 0:
-                    log(f"检测到新Cookie条目{len(cookie_list)}条，尝试继续爬虫...")
-                    cookie_idx = 0
-                    all_cookie_fail_time = None
-                    break
-            continue
-
-        current_cookie = cookie_list[cookie_idx]
-        curr_proxy = proxy_list[proxy_idx % len(proxy_list)] if proxy_list else None
-        log(f"当前使用代理IP: {curr_proxy if curr_proxy else '无'}，Cookie索引: {cookie_idx}")
-        driver = setup_driver(proxy=curr_proxy)
-        add_cookies(driver, current_cookie)
-        time.sleep(2)
+        current_cookie = cookie_lease.cookie
+        curr_proxy = proxy_lease.proxy if proxy_lease else None
+        log(f"当前使用代理IP: {curr_proxy if curr_proxy else '无'}，Cookie: {cookie_lease.id}")
+        driver = setup_fetcher(proxy=curr_proxy, cookie_str=current_cookie)
         try:
             for i in range(bar_idx, len(bar_list)):
                 bar = bar_list[i]
                 threads_per_page = None
                 for p in range(page, max_pages + 1):
+                    if splitter is not None and not splitter.keep(p):
+                        break
                     try:
-                        threads = get_thread_list_selenium(bar, p, driver)
+                        if preset_threads is not None:
+                            threads = preset_threads
+                        else:
+                            threads = get_thread_list_selenium(bar, p, driver)
                         threads_per_page = threads
                     except Exception as e:
                         if str(e).startswith("NeedCaptcha::"):
                             url = str(e).split("::", 1)[1]
-                            driver, solved = wait_for_manual_captcha_with_timeout(driver, url, f"吧[{bar}]第{p}页")
+                            driver, solved = wait_for_manual_captcha_with_timeout(
+                                driver, url, f"吧[{bar}]第{p}页", proxy=curr_proxy, cookie_str=current_cookie
+                            )
                             if solved:
                                 threads = get_thread_list_selenium(bar, p, driver)
                                 threads_per_page = threads
                             else:
                                 driver.quit()
                                 if curr_proxy:
-                                    proxy_cooldown_dict[curr_proxy] = time.time() + PROXY_COOLDOWN_TIME
-                                    log(f"代理{curr_proxy}遇到风控，加入冷却{PROXY_COOLDOWN_TIME//60}分钟。切换下一个代理和cookie。")
-                                    proxy_idx += 1
+                                    PROXY_POOL.cool_down(curr_proxy)
+                                    log(f"代理{curr_proxy}遇到风控，加入冷却{PROXY_COOLDOWN_TIME//60}分钟。切换下一个代理和cookie。", level=logging.WARNING)
                                 else:
-                                    log("遇到风控，但未使用代理，仅切换cookie。")
-                                cookie_idx += 1
-                                save_resume_info({"bar_idx": i, "page": p, "thread_idx": thread_idx})
+                                    log("遇到风控，但未使用代理，仅切换cookie。", level=logging.WARNING)
+                                cookie_lease.cool_down()
+                                cookie_lease = None
+                                save_resume_info(task_key, {"bar_idx": i, "page": p, "thread_idx": thread_idx})
                                 raise Exception("ProxyOrCookieCooldown")
                         elif "CookieExpired" in str(e):
                             raise
                         else:
                             raise
+                    if frontier is not None:
+                        queued = push_to_frontier(frontier, bar, threads_per_page, thread_state)
+                        log(f"[{bar}] 第{p}页新发现 {queued} 个帖子，已推入共享帖子队列")
+                        save_resume_info(task_key, {"bar_idx": i, "page": p + 1, "thread_idx": 0})
+                        continue
                     t_start = thread_idx if (i == bar_idx and p == page) else 0
                     for t_idx in range(t_start, len(threads_per_page)):
                         thread = threads_per_page[t_idx]
-                        filename = safe_filename(thread['title']) + '.txt'
-                        bar_dir = os.path.join(save_dir, safe_filename(bar))
-                        filepath = os.path.join(bar_dir, filename)
-                        if os.path.exists(filepath):
-                            log(f"[{bar}] 帖子[{thread['title']}]已存在，跳过")
-                            save_resume_info({"bar_idx": i, "page": p, "thread_idx": t_idx + 1})
+                        skip, resume = plan_thread_crawl(thread, bar, save_dir, seen, thread_state,
+                                                         check_seen=preset_threads is None)
+                        if skip:
+                            log(f"[{bar}] 帖子[{thread.title}]{skip}，跳过")
+                            save_resume_info(task_key, {"bar_idx": i, "page": p, "thread_idx": t_idx + 1})
                             continue
                         try:
-                            content = get_thread_content_selenium(
-                                thread['url'], driver, max_floors=max_floors_per_thread,
-                                bar_name=bar, thread_title=thread['title']
+                            records, progress = get_thread_content_selenium(
+                                thread.url, driver, max_floors=max_floors_per_thread,
+                                bar_name=bar, thread_title=thread.title, **resume
                             )
-                            os.makedirs(bar_dir, exist_ok=True)
-                            with open(filepath, 'w', encoding='utf-8') as f:
-                                f.write(content)
-                            log(f"[{bar}] 帖子[{thread['title']}]已保存：{filepath}")
+                            save_thread_result(bar, thread, save_dir, records, progress, resume, seen, thread_state)
                         except Exception as e:
                             if str(e).startswith("NeedCaptcha::"):
                                 url = str(e).split("::", 1)[1]
-                                driver, solved = wait_for_manual_captcha_with_timeout(driver, url, f"吧[{bar}]帖子[{thread['title']}]")
+                                driver, solved = wait_for_manual_captcha_with_timeout(
+                                    driver, url, f"吧[{bar}]帖子[{thread.title}]",
+                                    proxy=curr_proxy, cookie_str=current_cookie
+                                )
                                 if solved:
-                                    content = get_thread_content_selenium(
-                                        thread['url'], driver, max_floors=max_floors_per_thread,
-                                        bar_name=bar, thread_title=thread['title']
+                                    records, progress = get_thread_content_selenium(
+                                        thread.url, driver, max_floors=max_floors_per_thread,
+                                        bar_name=bar, thread_title=thread.title, **resume
                                     )
-                                    os.makedirs(bar_dir, exist_ok=True)
-                                    with open(filepath, 'w', encoding='utf-8') as f:
-                                        f.write(content)
-                                    log(f"[{bar}] 帖子[{thread['title']}]已保存：{filepath}")
+                                    save_thread_result(bar, thread, save_dir, records, progress, resume, seen, thread_state)
                                 else:
                                     driver.quit()
                                     if curr_proxy:
-                                        proxy_cooldown_dict[curr_proxy] = time.time() + PROXY_COOLDOWN_TIME
-                                        log(f"代理{curr_proxy}遇到风控，加入冷却{PROXY_COOLDOWN_TIME//60}分钟。切换下一个代理和cookie。")
-                                        proxy_idx += 1
+                                        PROXY_POOL.cool_down(curr_proxy)
+                                        log(f"代理{curr_proxy}遇到风控，加入冷却{PROXY_COOLDOWN_TIME//60}分钟。切换下一个代理和cookie。", level=logging.WARNING)
                                     else:
-                                        log("遇到风控，但未使用代理，仅切换cookie。")
-                                    cookie_idx += 1
-                                    save_resume_info({"bar_idx": i, "page": p, "thread_idx": t_idx})
+                                        log("遇到风控，但未使用代理，仅切换cookie。", level=logging.WARNING)
+                                    cookie_lease.cool_down()
+                                    cookie_lease = None
+                                    save_resume_info(task_key, {"bar_idx": i, "page": p, "thread_idx": t_idx})
                                     raise Exception("ProxyOrCookieCooldown")
-                            elif "CookieExpired" in str(e):
-                                save_resume_info({"bar_idx": i, "page": p, "thread_idx": t_idx})
+                            elif "CookieExpired" in str(e) or is_proxy_cooling_error(e):
+                                save_resume_info(task_key, {"bar_idx": i, "page": p, "thread_idx": t_idx})
                                 raise
                             else:
-                                log(f"[{bar}] 帖子[{thread['title']}]保存失败: {e}")
-                        save_resume_info({"bar_idx": i, "page": p, "thread_idx": t_idx + 1})
-                        time.sleep(random.uniform(*SLEEP_THREAD))
+                                log(f"[{bar}] 帖子[{thread.title}]保存失败: {e}", level=logging.ERROR)
+                                if preset_threads is not None:
+                                    raise  # 帖子任务只有这一个帖子，失败即任务失败，交给队列重试
+                        save_resume_info(task_key, {"bar_idx": i, "page": p, "thread_idx": t_idx + 1})
                     thread_idx = 0
                 page = 1
             driver.quit()
-            if os.path.exists(RECOVER_FILE):
-                os.remove(RECOVER_FILE)
+            clear_resume_info(task_key)
             break
         except Exception as e:
             driver.quit()
             if "ProxyOrCookieCooldown" in str(e):
                 continue
+            if is_proxy_cooling_error(e):
+                log(f"代理{curr_proxy}已被其他worker标记冷却，换用其他代理。", level=logging.WARNING)
+                continue
             if "CookieExpired" in str(e):
-                log(f"Cookie已失效，自动切换到下一个Cookie：{cookie_idx+1}")
-                cookie_idx += 1
+                log(f"Cookie {cookie_lease.id} 已失效，移出Cookie池并换用下一个Cookie", level=logging.WARNING)
+                cookie_lease.expire()
+                cookie_lease = None
                 continue
             else:
-                log(f"遇到其他异常：{e}")
+                log(f"遇到其他异常：{e}", level=logging.ERROR)
+                error = e
                 break
-    log(f"==== 本次批量爬取任务结束 ====")
+        finally:
+            if proxy_lease is not None:
+                proxy_lease.release()
+    if cookie_lease is not None:
+        cookie_lease.release()
+    RATE_CONTROLLER.save()
+    log(f"当前请求速率：{RATE_CONTROLLER.summary()}")
+    if proxy_list:
+        log(f"代理健康度：{PROXY_POOL.summary(proxy_list)}")
+    log("==== 本次批量爬取任务结束 ====")
+    if error is not None:
+        raise error
+
+# ============== asyncio并发采集模式 ==============
+
+def is_identity_error(e):
+    return str(e).startswith("NeedCaptcha::") or "CookieExpired" in str(e) or is_proxy_cooling_error(e)
+
+class CrawlIdentity:
+    """
+    一个 (代理, Cookie) 采集身份：独立HTTP会话，请求间隔由RATE_CONTROLLER决定，
+    在途请求数受所属代理和Cookie的信号量约束
+    """
+    def __init__(self, proxy, cookie_lease, proxy_sem):
+        self.proxy = proxy
+        self.cookie_lease = cookie_lease
+        self.rate_keys = identity_rate_keys(proxy, cookie_lease.cookie)
+        self.fetcher = HttpFetcher(MY_UA, cookie_str=cookie_lease.cookie, proxy=proxy,
+                                   pool_size=max(ASYNC_PER_PROXY, ASYNC_PER_COOKIE))
+        self.proxy_sem = proxy_sem
+        self.cookie_sem = asyncio.Semaphore(ASYNC_PER_COOKIE)
+        self.alive = True
+        self.active = 0
+
+    def __str__(self):
+        return f"代理{self.proxy or '无'}/Cookie{self.cookie_lease.id}"
+
+    async def fetch(self, url, global_sem, executor, report_ok=True, stage="fetch", bar=""):
+        # 代理冷却检查、结果反馈都要访问Redis，放到线程池里做，不卡住事件循环
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(executor, check_proxy_cooling, self.proxy)
+        wait = RATE_CONTROLLER.reserve(self.rate_keys)
+        if wait > 0:
+            with timed("sleep", self):
+                await asyncio.sleep(wait)
+        async with global_sem, self.proxy_sem, self.cookie_sem:
+            with timed(stage, self, bar):
+                _, _, page_source = await loop.run_in_executor(executor, self.fetcher.fetch, url)
+        await loop.run_in_executor(executor, check_page_reported, self, page_source, url)
+        if report_ok:
+            await loop.run_in_executor(executor, report, self, OUTCOME_OK)
+        return page_source
+
+class AsyncCrawler:
+    def __init__(self, cookie_leases, proxy_list):
+        # 在途HTTP请求最多占一半线程，另一半留给Redis读写和写盘，不排在慢请求后面
+        self.executor = ThreadPoolExecutor(max_workers=ASYNC_CONCURRENCY * 2)
+        # 断点写SQLite时可能要等其他worker的锁：单独一个线程按提交顺序写，旧断点不会覆盖新断点
+        self.checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+        self.global_sem = asyncio.Semaphore(ASYNC_CONCURRENCY)
+        self.proxy_list = proxy_list
+        self.proxy_health = {}
+        self.proxy_health_at = 0
+        PROXY_POOL.register(proxy_list)
+        # Cookie比代理少时，健康分高的代理优先分到Cookie
+        health = self.refresh_proxy_health()
+        proxies = sorted(proxy_list, key=lambda p: -health.get(p, 1)) or [None]
+        proxy_sems = {p: asyncio.Semaphore(ASYNC_PER_PROXY) for p in proxies}
+        self.identities = []
+        for idx, lease in enumerate(cookie_leases):
+            proxy = proxies[idx % len(proxies)]
+            self.identities.append(CrawlIdentity(proxy, lease, proxy_sems[proxy]))
+
+    async def run_blocking(self, func, *args):
+        """在线程池里执行会阻塞的调用（Redis读写、写盘、背压等待等），不卡住事件循环里的其他协程"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def save_checkpoint(self, task_key, resume_info):
+        await asyncio.get_event_loop().run_in_executor(self.checkpoint_executor, save_resume_info, task_key, resume_info)
+
+    def close(self):
+        for ident in self.identities:
+            ident.fetcher.quit()
+            ident.cookie_lease.release()
+        self.executor.shutdown(wait=False)
+        self.checkpoint_executor.shutdown(wait=True)
+
+    def refresh_proxy_health(self):
+        now = time.time()
+        if self.proxy_list and now - self.proxy_health_at >= PROXY_STATS_REFRESH:
+            self.proxy_health = {p: s["health"] for p, s in PROXY_POOL.stats(self.proxy_list).items()}
+            self.proxy_health_at = now
+        return self.proxy_health
+
+    async def pick_identity(self):
+        while True:
+            alive = [i for i in self.identities if i.alive]
+            if not alive:
+                raise Exception("AllCookiesExpired")
+            now = time.time()
+            cooling = await self.run_blocking(PROXY_POOL.cooldowns) if self.proxy_list else {}
+            ready = [i for i in alive if i.proxy not in cooling]
+            if ready:
+                health = await self.run_blocking(self.refresh_proxy_health)
+                return min(ready, key=lambda i: (i.active, -health.get(i.proxy, 1)))
+            wait_time = int(min(cooling[i.proxy] for i in alive) - now) + 1
+            log(f"所有可用身份的代理都在冷却中，等待{wait_time}秒后重试...")
+            await asyncio.sleep(wait_time)
+
+    async def retire(self, ident, e):
+        if is_proxy_cooling_error(e):
+            log(f"{ident}的代理已被标记冷却，换用其他身份。", level=logging.WARNING)
+            return
+        if not ident.alive:
+            return  # 同一身份上并发的请求已经处理过
+        ident.alive = False
+        lease = await self.run_blocking(self.replace_cookie, ident, e)
+        if lease is not None:
+            replacement = CrawlIdentity(ident.proxy, lease, ident.proxy_sem)
+            self.identities.append(replacement)
+            log(f"补充新身份{replacement}")
+
+    def replace_cookie(self, ident, e):
+        """停用身份的Cookie（风控时连同代理一起冷却），再从共享池领一个空闲Cookie，在线程池中执行"""
+        if str(e).startswith("NeedCaptcha::"):
+            if ident.proxy:
+                PROXY_POOL.cool_down(ident.proxy)
+                log(f"{ident}遇到风控，代理加入冷却{PROXY_COOLDOWN_TIME//60}分钟，停用该Cookie。", level=logging.WARNING)
+            else:
+                log(f"{ident}遇到风控，但未使用代理，仅停用该Cookie。", level=logging.WARNING)
+            ident.cookie_lease.cool_down()
+        else:
+            log(f"{ident} Cookie已失效，停用该身份。", level=logging.WARNING)
+            ident.cookie_lease.expire()
+        # 从共享池补一个空闲Cookie，沿用原身份的代理
+        sync_cookie_file()
+        lease, _ = COOKIE_POOL.acquire(WORKER_ID)
+        return lease
+
+    async def run_with_identity(self, job):
+        """用当前最空闲的身份执行job(ident)，遇风控/Cookie失效时换身份重试"""
+        for _ in range(ASYNC_RETRY):
+            ident = await self.pick_identity()
+            ident.active += 1
+            try:
+                return await job(ident)
+            except Exception as e:
+                if not is_identity_error(e):
+                    raise
+                await self.retire(ident, e)
+            finally:
+                ident.active -= 1
+        raise Exception("ProxyOrCookieCooldown")
+
+    async def fetch(self, ident, url, report_ok=True, stage="fetch", bar=""):
+        return await ident.fetch(url, self.global_sem, self.executor, report_ok=report_ok, stage=stage, bar=bar)
+
+    async def get_thread_list(self, bar_name, page):
+        url = f'{TIEBA_BASE_URL}/f?kw={bar_name}&pn={(page-1)*50}'
+
+        async def job(ident):
+            page_source = await self.fetch(ident, url, report_ok=False, bar=bar_name)
+            with timed("parse", ident, bar_name):
+                threads = parse_thread_list(page_source, TIEBA_BASE_URL)
+            await self.run_blocking(report, ident, OUTCOME_OK if threads else OUTCOME_EMPTY)
+            return page_source, threads
+
+        page_source, threads = await self.run_with_identity(job)
+        log(f"[{bar_name}] 第{page}页解析到 {len(threads)} 个帖子")
+        if not threads:
+            log_bad_page(f"[{bar_name}] 第{page}页未解析到帖子", url, page_source)
+        return threads
+
+    async def get_lzl_comments(self, ident, tid, pid, start_pn=1):
+        lzl_comments = []
+        lzl_pn = start_pn
+        while True:
+            page_source = await self.fetch(ident, lzl_comment_url(tid, pid, lzl_pn), stage="lzl")
+            with timed("parse", ident):
+                lzl_page = parse_lzl_page(page_source)
+            if not lzl_page.comments:
+                break
+            lzl_comments.extend(lzl_page.comments)
+            if not lzl_page.has_next:
+                break
+            lzl_pn += 1
+        return lzl_comments
+
+    async def get_lzl_comments_batch(self, ident, tid, fid, pn, pids):
+        if not pids:
+            return {}
+        total = None
+        if fid:
+            page_source = await self.fetch(ident, total_comment_url(tid, fid, pn), stage="lzl")
+            try:
+                with timed("parse", ident):
+                    total = parse_total_comment(page_source)
+            except ValueError as e:
+                log(f"totalComment解析失败，改为逐楼抓取楼中楼：{e}", level=logging.WARNING)
+        got, pending = plan_lzl_fetch(total, pids)
+        pending_pids = list(pending)
+        results = await asyncio.gather(*(self.get_lzl_comments(ident, tid, pid, pending[pid]) for pid in pending_pids))
+        for pid, comments in zip(pending_pids, results):
+            got[pid] = got.get(pid, []) + comments
+        return {pid: [c for c in comments if is_valid_speech(c)] for pid, comments in got.items()}
+
+    async def get_thread_content(self, ident, thread_url, max_floors=100, bar_name="", thread_title="",
+                                 start_pn=1, after_floor=0):
+        records = []
+        pn = start_pn
+        total_floors = 0
+        progress = {"last_page": start_pn, "last_floor": after_floor}
+        tid = tid_from_url(thread_url)
+        while True:
+            url = thread_url + f'?pn={pn}'
+            page_source = await self.fetch(ident, url, report_ok=False, bar=bar_name)
+            with timed("parse", ident, bar_name):
+                thread_page = parse_thread_page(page_source)
+            await self.run_blocking(report, ident, OUTCOME_OK if thread_page.posts else OUTCOME_EMPTY)
+            if not thread_page.posts:
+                log_bad_page(f"[{bar_name}] 帖子[{thread_title}]第{pn}页未发现发言内容", url, page_source)
+                break
+            posts = new_posts(thread_page.posts, after_floor)[:max_floors - total_floors]
+            progress["last_page"] = pn
+            METRICS.inc("tieba_floors_total", len(posts), bar=bar_name)
+            lzl = await self.get_lzl_comments_batch(
+                ident, tid, thread_page.fid, pn, [p.pid for p in posts if p.pid and p.has_lzl]
+            )
+            for post in posts:
+                records.extend(post_records(post, lzl.get(post.pid, [])))
+                if post.floor is not None:
+                    progress["last_floor"] = max(progress["last_floor"], int(post.floor))
+                total_floors += 1
+                if total_floors >= max_floors:
+                    log(f"[{bar_name}] 帖子[{thread_title}]已到达楼层上限 {max_floors}")
+                    return records, progress
+            if not thread_page.has_next:
+                break
+            pn += 1
+        return records, progress
+
+async def async_batch_crawl_tieba(bar_list, max_pages=1, start_page=1, save_dir='output', max_floors_per_thread=100,
+                                  frontier=None, seen=None, preset_threads=None, thread_state=None, splitter=None):
+    """
+    asyncio并发版 batch_crawl_tieba_selenium：列表页顺序翻页，帖子分发给多个身份并发采集。
+    断点只记录到“已连续完成”的最后一个帖子，中断后从第一个未完成的帖子续爬。
+    frontier/seen/preset_threads/thread_state/splitter 含义同 batch_crawl_tieba_selenium
+    """
+    log("==== 本次并发爬取任务开始 ====")
+    task_key = resume_task_key(bar_list, start_page, max_pages, preset_threads)
+    resume_info = load_resume_info(task_key) or {"bar_idx": 0, "page": start_page, "thread_idx": 0}
+    bar_idx = resume_info.get("bar_idx", 0)
+    page = resume_info.get("page", start_page)
+    thread_idx = resume_info.get("thread_idx", 0)
+    crawler = AsyncCrawler(lease_cookies(ASYNC_MAX_COOKIES), load_proxy_list())
+    if not crawler.identities:
+        log("共享Cookie池中没有可领用的Cookie，并发采集无法开始。", level=logging.ERROR)
+        raise Exception("NoCookieAvailable")
+    queue = asyncio.Queue(maxsize=ASYNC_CONCURRENCY * 2)
+    order = []
+    done = set()
+    cursor = 0
+    fatal = []
+
+    async def mark_done(key):
+        nonlocal cursor
+        done.add(key)
+        advanced = False
+        while cursor < len(order) and order[cursor] in done:
+            cursor += 1
+            advanced = True
+        if advanced:
+            i, p, t_idx = order[cursor - 1]
+            await crawler.save_checkpoint(task_key, {"bar_idx": i, "page": p, "thread_idx": t_idx + 1})
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            key, bar, thread = item
+            if fatal:
+                continue
+            skip, resume = await crawler.run_blocking(plan_thread_crawl, thread, bar, save_dir, seen, thread_state,
+                                                      preset_threads is None)
+            if skip:
+                log(f"[{bar}] 帖子[{thread.title}]{skip}，跳过")
+                await mark_done(key)
+                continue
+
+            async def job(ident):
+                return await crawler.get_thread_content(
+                    ident, thread.url, max_floors=max_floors_per_thread,
+                    bar_name=bar, thread_title=thread.title, **resume
+                )
+
+            try:
+                records, progress = await crawler.run_with_identity(job)
+                await crawler.run_blocking(save_thread_result, bar, thread, save_dir, records, progress, resume,
+                                           seen, thread_state)
+            except Exception as e:
+                if "ProxyOrCookieCooldown" in str(e) or "AllCookiesExpired" in str(e):
+                    fatal.append(e)
+                    continue
+                log(f"[{bar}] 帖子[{thread.title}]保存失败: {e}", level=logging.ERROR)
+                if preset_threads is not None:
+                    fatal.append(e)  # 帖子任务只有这一个帖子，失败即任务失败
+                    continue
+            await mark_done(key)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(ASYNC_CONCURRENCY)]
+    try:
+        for i in range(bar_idx, len(bar_list)):
+            bar = bar_list[i]
+            for p in range(page, max_pages + 1):
+                if fatal:
+                    break
+                if splitter is not None and not await crawler.run_blocking(splitter.keep, p):
+                    break
+                try:
+                    if preset_threads is not None:
+                        threads = preset_threads
+                    else:
+                        threads = await crawler.get_thread_list(bar, p)
+                except Exception as e:
+                    fatal.append(e)
+                    break
+                if frontier is not None:
+                    queued = await crawler.run_blocking(push_to_frontier, frontier, bar, threads, thread_state)
+                    log(f"[{bar}] 第{p}页新发现 {queued} 个帖子，已推入共享帖子队列")
+                    await crawler.save_checkpoint(task_key, {"bar_idx": i, "page": p + 1, "thread_idx": 0})
+                    continue
+                t_start = thread_idx if (i == bar_idx and p == page) else 0
+                for t_idx in range(t_start, len(threads)):
+                    key = (i, p, t_idx)
+                    order.append(key)
+                    await queue.put((key, bar, threads[t_idx]))
+            page = 1
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        crawler.close()
+    if fatal:
+        log(f"并发采集中止：{fatal[0]}，已记录断点，下次从第一个未完成的帖子续爬。", level=logging.ERROR)
+    else:
+        clear_resume_info(task_key)
+    RATE_CONTROLLER.save()
+    log(f"当前请求速率：{RATE_CONTROLLER.summary()}")
+    if crawler.proxy_list:
+        log(f"代理健康度：{PROXY_POOL.summary(crawler.proxy_list)}")
+    log("==== 本次并发爬取任务结束 ====")
+    if fatal:
+        raise fatal[0]
+
+async def async_crawl_frontier(thread_queue, worker_id, seen=None, save_dir='output', max_floors_per_thread=100,
+                               thread_state=None):
+    """
+    并发模式下直接从共享帖子队列领取帖子：每个协程持有一个帖子租约，采完即确认，
+    失败或中止时租约自动放回队列由其他worker重试
+    """
+    crawler = AsyncCrawler(lease_cookies(ASYNC_MAX_COOKIES), load_proxy_list())
+    if not crawler.identities:
+        log("共享Cookie池中没有可领用的Cookie，并发采集无法开始。", level=logging.ERROR)
+        raise Exception("NoCookieAvailable")
+    fatal = []
+
+    async def worker():
+        while not fatal:
+            lease = await crawler.run_blocking(thread_queue.claim, worker_id)
+            if lease is None:
+                return
+            task = lease.task
+            thread = thread_from_task(task)
+            bar = task['bar']
+            skip, resume = await crawler.run_blocking(plan_thread_crawl, thread, bar, save_dir, seen, thread_state, False)
+            if skip:
+                log(f"[{bar}] 帖子[{thread.title}]{skip}，跳过")
+                await crawler.run_blocking(finish_lease, lease)
+                continue
+
+            async def job(ident):
+                return await crawler.get_thread_content(
+                    ident, thread.url, max_floors=max_floors_per_thread,
+                    bar_name=bar, thread_title=thread.title, **resume
+                )
+
+            # 续租、确认、放回都访问Redis，租约的进出也放到线程池里
+            await crawler.run_blocking(lease.__enter__)
+            try:
+                records, progress = await crawler.run_with_identity(job)
+                await crawler.run_blocking(save_thread_result, bar, thread, save_dir, records, progress, resume,
+                                           seen, thread_state)
+                await crawler.run_blocking(finish_lease, lease)
+            except Exception as e:
+                if is_abort_error(e):
+                    await crawler.run_blocking(lease.requeue)
+                    fatal.append(e)
+                else:
+                    log(f"[{bar}] 帖子[{thread.title}]保存失败: {e}", level=logging.ERROR)
+            finally:
+                await crawler.run_blocking(lease.__exit__, None, None, None)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(ASYNC_CONCURRENCY)))
+    finally:
+        crawler.close()
+    if fatal:
+        log(f"并发采集中止：{fatal[0]}，未完成的帖子已放回共享帖子队列。", level=logging.ERROR)
+    RATE_CONTROLLER.save()
+
+class TaskSplitter:
+    """
+    列表页任务运行中的动态拆分：按已完成页的平均耗时估计剩余耗时，超出 target_seconds 时
+    本任务只保留还来得及的页，其余页码作为新任务追加回任务队列，由空闲的worker领取。
+    租约下的原任务同时改为只剩前半段，租约被回收时别的worker不会重做已拆出去的页
+    """
+
+    def __init__(self, lease, bar, start_page, end_page, target_seconds=TASK_TARGET_SECONDS):
+        self.lease = lease
+        self.queue = lease.queue
+        self.bar = bar
+        self.end = end_page
+        self.target_seconds = target_seconds
+        self.first = None
+        self.started = None
+
+    def keep(self, page):
+        """翻到第 page 页前调用，返回 False 表示该页已拆给别的任务，本任务到此结束"""
+        if page > self.end:
+            return False
+        now = time.time()
+        if self.first is None or page < self.first:
+            self.first, self.started = page, now  # 断点续爬或换身份重试时从这里重新计时
+            return True
+        finished = page - self.first
+        remaining = self.end - page + 1
+        if finished < 1 or remaining < 2:
+            return True
+        elapsed = now - self.started
+        per_page = elapsed / finished
+        if per_page * remaining <= self.target_seconds - elapsed:
+            return True
+        split = page + max(1, int(max(0, self.target_seconds - elapsed) / per_page))
+        if split > self.end:
+            return True
+        rest = {"bar": self.bar, "page_start": split, "page_end": self.end}
+        queued, _ = self.queue.load([task_line(rest)])
+        log(f"[{self.bar}] 每页约{per_page:.0f}秒，剩余{remaining}页超出目标耗时，"
+            f"第{split}~{self.end}页拆为新任务" + ("" if queued else "（已在队列中）"))
+        self.end = split - 1
+        if not self.lease.update({**self.lease.task, "page_end": self.end}):
+            log(f"[{self.bar}] 任务租约已被回收，未能缩小原任务的页码范围", level=logging.WARNING)
+        return True
+
+def crawl_task(task, frontier=None, seen=None, max_floors_per_thread=100, thread_state=None, lease=None):
+    """
+    执行一个列表页任务（吧+页码范围）或帖子任务（type=thread）。
+    给定任务租约 lease 时，跨多页的列表页任务超出目标耗时会把后半段拆回队列
+    """
+    kwargs = dict(max_floors_per_thread=max_floors_per_thread, seen=seen, thread_state=thread_state)
+    if task.get('type') == 'thread':
+        kwargs['preset_threads'] = [thread_from_task(task)]
+        start_page = end_page = 1
+    else:
+        kwargs['frontier'] = frontier
+        start_page = task.get('page_start', 1)
+        end_page = task.get('page_end', start_page)
+        if lease is not None and end_page > start_page:
+            kwargs['splitter'] = TaskSplitter(lease, task['bar'], start_page, end_page)
+    if CRAWL_MODE == "async":
+        asyncio.run(async_batch_crawl_tieba([task['bar']], max_pages=end_page, start_page=start_page, **kwargs))
+    else:
+        batch_crawl_tieba_selenium([task['bar']], max_pages=end_page, start_page=start_page, **kwargs)
 
 if __name__ == '__main__':
     max_floors_per_thread = 200
-    while True:
-        task = get_one_task()
-        if not task:
-            log("没有可领取的任务，爬虫退出。")
-            break
-        try:
-            bar_name = task['bar']
-            start_page = task.get('page_start', 1)
-            end_page = task.get('page_end', start_page)
-            batch_crawl_tieba_selenium(
-                [bar_name],
-                max_pages=end_page,
-                start_page=start_page,
-                max_floors_per_thread=max_floors_per_thread
-            )
-            mark_task_done(task)
-        except Exception as e:
-            log(f"采集任务失败: {task}, 错误: {e}")
\ No newline at end of file
+    task_queue = get_task_queue()
+    worker_id = WORKER_ID
+    seen = get_seen_set()
+    thread_state = get_thread_state_store()
+    thread_queue = get_thread_queue() if USE_THREAD_FRONTIER else None
+    frontier = ThreadFrontier(thread_queue, seen) if USE_THREAD_FRONTIER else None
+    log(f"worker {worker_id} 启动")
+    if METRICS_PORT:
+        start_metrics_server()
+    SummaryReporter(METRICS, METRICS_SUMMARY_INTERVAL, lambda text: log(f"采集统计：{text}")).start()
+    try:
+        while True:
+            if thread_queue is not None and CRAWL_MODE == "async":
+                try:
+                    asyncio.run(async_crawl_frontier(
+                        thread_queue, worker_id, seen=seen, max_floors_per_thread=max_floors_per_thread,
+                        thread_state=thread_state
+                    ))
+                except Exception as e:
+                    if "NoCookieAvailable" not in str(e):
+                        raise
+                    break
+            # 优先领取帖子任务，帖子队列空了再领列表页任务补充
+            lease = None
+            if thread_queue is not None:
+                lease = get_one_task(thread_queue, worker_id)
+            if lease is None:
+                lease = get_one_task(task_queue, worker_id)
+            if not lease:
+                log("没有可领取的任务，爬虫退出。")
+                break
+            task = lease.task
+            with lease:
+                try:
+                    crawl_task(task, frontier=frontier, seen=seen, max_floors_per_thread=max_floors_per_thread,
+                               thread_state=thread_state, lease=lease)
+                except Exception as e:
+                    if not is_abort_error(e):
+                        log(f"采集任务失败: {task}, 错误: {e}", level=logging.ERROR)
+                        continue  # 退出with时release()，超过重试次数记为失败
+                    lease.requeue()
+                    log(f"采集任务中止，已放回队列: {task}, 原因: {e}", level=logging.WARNING)
+                    if "NoCookieAvailable" in str(e):
+                        break
+                else:
+                    finish_lease(lease)
+        log(f"任务队列状态：{task_queue.stats()}")
+        log(f"采集统计：{SummaryReporter(METRICS, 0, None).summary()}")
+        if thread_queue is not None:
+            log(f"帖子队列状态：{thread_queue.stats()}")
+    finally:
+        DRIVER_POOL.close_all()
+        CHECKPOINTS.close()
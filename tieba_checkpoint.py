@@ -0,0 +1,52 @@
+import json
+import time
+import sqlite3
+import threading
+
+
+class CheckpointJournal:
+    """
+    断点日志（SQLite WAL模式），每个任务一行：task -> {bar_idx, page, thread_idx}。
+    每次保存只覆盖本任务的一行，开销与帖子数、worker数无关；
+    WAL + synchronous=NORMAL 下提交只追加WAL不立即fsync，进程崩溃不丢已提交的断点，
+    fsync由SQLite在WAL检查点时批量完成。多个worker共用同一个文件也不会互相覆盖
+    """
+
+    def __init__(self, path, worker=None, busy_timeout=30):
+        self.path = path
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "task TEXT PRIMARY KEY, worker TEXT, info TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def load(self, task):
+        with self.lock:
+            row = self.conn.execute("SELECT info FROM checkpoints WHERE task = ?", (task,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, task, info):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO checkpoints (task, worker, info, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(task) DO UPDATE SET worker = excluded.worker, info = excluded.info, updated = excluded.updated",
+                (task, self.worker, json.dumps(info, ensure_ascii=False), time.time()),
+            )
+
+    def clear(self, task):
+        with self.lock:
+            self.conn.execute("DELETE FROM checkpoints WHERE task = ?", (task,))
+
+    def pending(self):
+        """尚未完成的任务断点，供排查用"""
+        with self.lock:
+            rows = self.conn.execute("SELECT task, worker, info, updated FROM checkpoints ORDER BY updated").fetchall()
+        return [{"task": t, "worker": w, "info": json.loads(i), "updated": u} for t, w, i, u in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
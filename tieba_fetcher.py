@@ -0,0 +1,249 @@
+import re
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# 贴吧吧页把帖子列表放在 <code><!-- ... --></code> 里由JS展开，纯HTTP抓取时需要手动解包
+_PAGELET_RE = re.compile(r'<code[^>]*>\s*<!--(.*?)-->\s*</code>', re.S)
+
+
+def unwrap_pagelets(html):
+    return _PAGELET_RE.sub(lambda m: m.group(1), html)
+
+
+def parse_cookie_string(cookie_str):
+    cookies = {}
+    for pair in (cookie_str or "").split(";"):
+        if '=' in pair:
+            k, v = pair.strip().split("=", 1)
+            cookies[k] = v
+    return cookies
+
+
+class HttpFetcher:
+    """
+    基于requests长连接池的轻量抓取器，提供与WebDriver相同的
+    get()/page_source/current_url/add_cookie()/quit() 接口，可直接替换driver传入各采集函数
+    """
+
+    def __init__(self, user_agent, cookie_str=None, proxy=None, timeout=30, pool_size=10):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "User-Agent": user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "zh-CN,zh;q=0.9",
+            "Connection": "keep-alive",
+        })
+        if proxy and not proxy.endswith(':0'):
+            self.session.proxies.update({
+                "http": f"http://{proxy}",
+                "https": f"http://{proxy}",
+            })
+        for k, v in parse_cookie_string(cookie_str).items():
+            self.session.cookies.set(k, v)
+        self.page_source = ""
+        self.current_url = None
+        self.status_code = None
+
+    def add_cookie(self, cookie_dict):
+        self.session.cookies.set(cookie_dict['name'], cookie_dict['value'])
+
+    def get_cookies(self):
+        return [{'name': c.name, 'value': c.value} for c in self.session.cookies]
+
+    def fetch(self, url):
+        """无状态抓取，返回 (status_code, 最终url, 页面源码)，可被多个线程并发调用"""
+        resp = self.session.get(url, timeout=self.timeout)
+        if not resp.encoding or resp.encoding.lower() == 'iso-8859-1':
+            resp.encoding = 'utf-8'
+        return resp.status_code, resp.url, unwrap_pagelets(resp.text)
+
+    def get(self, url):
+        self.status_code, self.current_url, self.page_source = self.fetch(url)
+
+    def quit(self):
+        self.session.close()
+
+
+class HybridFetcher:
+    """
+    默认走HttpFetcher，needs_browser(page_source) 判定为验证码/JS墙时，
+    才用 driver_factory() 懒启动Selenium重新加载该页，接口同WebDriver
+    """
+
+    def __init__(self, http_fetcher, driver_factory, needs_browser, on_fallback=None):
+        self.http = http_fetcher
+        self.driver_factory = driver_factory
+        self.needs_browser = needs_browser
+        self.on_fallback = on_fallback
+        self.driver = None
+        self.page_source = ""
+        self.current_url = None
+
+    def add_cookie(self, cookie_dict):
+        self.http.add_cookie(cookie_dict)
+        if self.driver:
+            self.driver.add_cookie(cookie_dict)
+
+    def get(self, url):
+        self.http.get(url)
+        self.current_url = self.http.current_url
+        self.page_source = self.http.page_source
+        if not self.needs_browser(self.page_source):
+            return
+        if self.on_fallback:
+            self.on_fallback(url)
+        if self.driver is None:
+            self.driver = self.driver_factory()
+        self.driver.get(url)
+        self.current_url = self.driver.current_url
+        self.page_source = self.driver.page_source
+
+    def adopt_browser(self, driver):
+        """接管人工验证完成后的浏览器，并把其Cookie同步回HTTP会话"""
+        if self.driver is not None and self.driver is not driver:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.driver = driver
+        for c in driver.get_cookies():
+            self.http.add_cookie(c)
+
+    def quit(self):
+        self.http.quit()
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+
+
+class PooledDriver:
+    """
+    DriverPool借出的WebDriver包装：get()计页数，quit()归还到池而不是关闭浏览器，
+    其余属性直接转发给原driver
+    """
+
+    def __init__(self, pool, key, driver):
+        self.pool = pool
+        self.key = key
+        self.driver = driver
+        self.pages = 0
+        self.base_memory = None
+        self.idle_since = None
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def get(self, url):
+        self.pages += 1
+        self.driver.get(url)
+
+    def quit(self):
+        self.pool.release(self)
+
+    def discard(self):
+        self.pool.discard(self)
+
+
+class DriverPool:
+    """
+    按 (代理, Cookie, 是否无头) 缓存已登录的浏览器，跨任务复用。
+    借出前做健康检查，归还时超过 max_pages 页或JS堆增长超过 max_memory_growth_mb 则回收重建
+    """
+
+    def __init__(self, factory, max_pages=300, max_memory_growth_mb=512, idle_ttl=1800, max_idle=4):
+        self.factory = factory  # factory(proxy, cookie_str, headless) -> 已登录的WebDriver
+        self.max_pages = max_pages
+        self.max_memory_growth_mb = max_memory_growth_mb
+        self.idle_ttl = idle_ttl
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _js_heap_mb(driver):
+        try:
+            used = driver.execute_script("return window.performance.memory ? performance.memory.usedJSHeapSize : null")
+        except Exception:
+            return None
+        return used / 1024 / 1024 if used else None
+
+    def _healthy(self, pooled):
+        try:
+            pooled.driver.execute_script("return 1")
+        except Exception:
+            return False
+        if pooled.pages >= self.max_pages:
+            return False
+        mem = self._js_heap_mb(pooled.driver)
+        if mem is not None:
+            if pooled.base_memory is None:
+                pooled.base_memory = mem
+            elif mem - pooled.base_memory > self.max_memory_growth_mb:
+                return False
+        return True
+
+    def _close(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+
+    def _evict_expired(self):
+        now = time.time()
+        with self.lock:
+            expired = [p for p in self.idle if now - p.idle_since > self.idle_ttl]
+            self.idle = [p for p in self.idle if p not in expired]
+        for p in expired:
+            self._close(p)
+
+    def acquire(self, proxy=None, cookie_str=None, headless=True):
+        key = (proxy, cookie_str, headless)
+        self._evict_expired()
+        while True:
+            with self.lock:
+                pooled = next((p for p in self.idle if p.key == key), None)
+                if pooled is None:
+                    break
+                self.idle.remove(pooled)
+            if self._healthy(pooled):
+                return pooled
+            self._close(pooled)
+        pooled = PooledDriver(self, key, self.factory(proxy, cookie_str, headless))
+        pooled.base_memory = self._js_heap_mb(pooled.driver)
+        return pooled
+
+    def release(self, pooled):
+        with self.lock:
+            if pooled in self.idle:  # 重复quit()时忽略
+                return
+        if not self._healthy(pooled):
+            self._close(pooled)
+            return
+        pooled.idle_since = time.time()
+        with self.lock:
+            self.idle.append(pooled)
+            overflow = self.idle[:-self.max_idle] if len(self.idle) > self.max_idle else []
+            self.idle = self.idle[len(overflow):]
+        for p in overflow:
+            self._close(p)
+
+    def discard(self, pooled):
+        with self.lock:
+            if pooled in self.idle:
+                self.idle.remove(pooled)
+        self._close(pooled)
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for p in idle:
+            self._close(p)
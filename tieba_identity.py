@@ -0,0 +1,195 @@
+import time
+import hashlib
+import threading
+
+# 领取：先清掉过期租约，再在未领用、未失效、未冷却的Cookie中选验证码次数最少、最久没用过的一个
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('HDEL', KEYS[3], id)
+end
+local best, best_captcha, best_used, soonest = nil, nil, nil, nil
+for _, id in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if not redis.call('ZSCORE', KEYS[2], id) and redis.call('HEXISTS', KEYS[4], id) == 0 then
+        local cooldown = tonumber(redis.call('HGET', KEYS[5], id) or '0')
+        if cooldown > now then
+            if not soonest or cooldown < soonest then soonest = cooldown end
+        else
+            local captcha = tonumber(redis.call('HGET', KEYS[6], id) or '0')
+            local used = tonumber(redis.call('HGET', KEYS[7], id) or '0')
+            if not best or captcha < best_captcha or (captcha == best_captcha and used < best_used) then
+                best, best_captcha, best_used = id, captcha, used
+            end
+        end
+    end
+end
+if not best then return {'', tostring(soonest or 0)} end
+redis.call('ZADD', KEYS[2], tostring(now + tonumber(ARGV[2])), best)
+redis.call('HSET', KEYS[3], best, ARGV[3])
+redis.call('HSET', KEYS[7], best, ARGV[1])
+return {best, redis.call('HGET', KEYS[1], best)}
+"""
+
+# 续约：只有仍持有租约的worker才能续
+_RENEW_LUA = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[3] then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+return 1
+"""
+
+# 归还：可同时标记失效或冷却；正常归还时通知一个等待中的worker
+_RELEASE_LUA = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+if ARGV[3] == 'expired' then
+    redis.call('HSET', KEYS[3], ARGV[1], ARGV[5])
+elseif ARGV[3] == 'cooldown' then
+    redis.call('HSET', KEYS[4], ARGV[1], tostring(tonumber(ARGV[5]) + tonumber(ARGV[4])))
+else
+    redis.call('RPUSH', KEYS[5], '1')
+    redis.call('LTRIM', KEYS[5], -100, -1)
+end
+return 1
+"""
+
+
+def cookie_id(cookie_str):
+    """Cookie原文的短哈希，与 tieba_ratelimit.cookie_key 一致，日志和Redis里都不出现Cookie原文"""
+    return hashlib.md5((cookie_str or "").encode("utf-8")).hexdigest()[:12]
+
+
+class CookiePool:
+    """
+    全体worker共享的Cookie池（Redis），每个Cookie同一时刻只租给一个worker：
+      <key>            Cookie id -> Cookie原文（hash）
+      <key>:leases     Cookie id -> 租约到期时间（zset）
+      <key>:owners     Cookie id -> 持有租约的worker（hash）
+      <key>:expired    Cookie id -> 判定失效的时间（hash），不再出租
+      <key>:cooldown   Cookie id -> 冷却结束时间（hash）
+      <key>:captcha    Cookie id -> 累计遇到验证码次数（hash）
+      <key>:last_used  Cookie id -> 最近一次出租时间（hash）
+      <key>:notify     有Cookie归还或新增时推入，等待中的worker用BLPOP唤醒（list）
+    """
+
+    def __init__(self, conn, key, lease_ttl=600, cooldown=1800):
+        self.r = conn
+        self.key = key
+        self.lease_ttl = lease_ttl
+        self.cooldown = cooldown
+        self.leases_key = f"{key}:leases"
+        self.owners_key = f"{key}:owners"
+        self.expired_key = f"{key}:expired"
+        self.cooldown_key = f"{key}:cooldown"
+        self.captcha_key = f"{key}:captcha"
+        self.last_used_key = f"{key}:last_used"
+        self.notify_key = f"{key}:notify"
+        self._acquire = conn.register_script(_ACQUIRE_LUA)
+        self._renew = conn.register_script(_RENEW_LUA)
+        self._release = conn.register_script(_RELEASE_LUA)
+
+    def add(self, cookies):
+        """登记Cookie，已登记（包括已失效）的不重复添加，返回新增个数"""
+        cookies = [c for c in cookies if c]
+        if not cookies:
+            return 0
+        pipe = self.r.pipeline(transaction=False)
+        for c in cookies:
+            pipe.hsetnx(self.key, cookie_id(c), c)
+        added = sum(pipe.execute())
+        if added:
+            self.r.rpush(self.notify_key, *["1"] * added)
+            self.r.ltrim(self.notify_key, -100, -1)
+        return added
+
+    def acquire(self, holder):
+        """领取一个Cookie，返回 (CookieLease, 0)；没有可用的返回 (None, 最早解除冷却的剩余秒数或0)"""
+        now = time.time()
+        cid, value = self._acquire(
+            keys=[self.key, self.leases_key, self.owners_key, self.expired_key, self.cooldown_key,
+                  self.captcha_key, self.last_used_key],
+            args=[now, self.lease_ttl, holder],
+        )
+        if not cid:
+            soonest = float(value)
+            return None, int(soonest - now) + 1 if soonest else 0
+        return CookieLease(self, holder, cid, value), 0
+
+    def wait(self, timeout):
+        """阻塞到有Cookie归还/新增或超时，不轮询文件"""
+        self.r.blpop(self.notify_key, timeout=max(1, int(timeout)))
+
+    def renew(self, holder, cid):
+        return bool(self._renew(keys=[self.leases_key, self.owners_key],
+                                args=[cid, time.time() + self.lease_ttl, holder]))
+
+    def release(self, holder, cid, outcome="ok", cooldown=0):
+        return bool(self._release(
+            keys=[self.leases_key, self.owners_key, self.expired_key, self.cooldown_key, self.notify_key],
+            args=[cid, holder, outcome, cooldown, time.time()],
+        ))
+
+    def note_captcha(self, cid):
+        self.r.hincrby(self.captcha_key, cid, 1)
+
+    def stats(self):
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hlen(self.key)
+        pipe.zcard(self.leases_key)
+        pipe.hlen(self.expired_key)
+        pipe.hvals(self.cooldown_key)
+        total, leased, expired, cooldowns = pipe.execute()
+        now = time.time()
+        cooling = sum(1 for t in cooldowns if float(t) > now)
+        return {"total": total, "leased": leased, "expired": expired, "cooling": cooling}
+
+
+class CookieLease:
+    """
+    一个已领取Cookie的租约，后台线程定期续约。用完调用 release()；
+    Cookie失效调用 expire()，遇到验证码换号调用 cool_down()，Cookie随即回到池中供其他worker领取
+    """
+
+    def __init__(self, pool, holder, cid, cookie):
+        self.pool = pool
+        self.holder = holder
+        self.id = cid
+        self.cookie = cookie
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        interval = max(1, self.pool.lease_ttl // 3)
+        while not self._stop.wait(interval):
+            try:
+                if not self.pool.renew(self.holder, self.id):
+                    self.lost = True  # 租约已过期被回收，Cookie可能已租给其他worker
+                    return
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def _finish(self, outcome, cooldown=0):
+        if self._stop.is_set():
+            return False
+        self._stop.set()
+        return self.pool.release(self.holder, self.id, outcome, cooldown)
+
+    def release(self):
+        return self._finish("ok")
+
+    def expire(self):
+        return self._finish("expired")
+
+    def cool_down(self, seconds=None):
+        return self._finish("cooldown", seconds or self.pool.cooldown)
@@ -0,0 +1,130 @@
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+
+
+class JsonLineFormatter(logging.Formatter):
+    """每条日志一行JSON：{ts, level, msg, 其他字段...}，便于机器检索"""
+
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        event.update(getattr(record, "fields", None) or {})
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        ts = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        return f"[{ts}] {record.getMessage()}"
+
+
+def setup_logging(log_file, name="tieba", level=logging.INFO, max_bytes=50 * 1024 * 1024, backup_count=5,
+                  console=True, static_fields=None):
+    """
+    调用方只把日志放进内存队列，后台线程负责写文件（按大小轮转）和打印到控制台，
+    采集线程上不再有每条日志一次的open/close
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonLineFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(ConsoleFormatter())
+        handlers.append(console_handler)
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    if static_fields:
+        queue_handler.addFilter(_StaticFields(static_fields))
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)  # 退出前写完队列里剩余的日志
+    return logger
+
+
+class _StaticFields(logging.Filter):
+    """给每条日志附加固定字段（如worker id）"""
+
+    def __init__(self, fields):
+        super().__init__()
+        self.static = dict(fields)
+
+    def filter(self, record):
+        record.fields = {**self.static, **(getattr(record, "fields", None) or {})}
+        return True
+
+
+class ArtifactStore:
+    """
+    异常页面源码的采样存档：按 sample_rate 抽样、每分钟最多 max_per_minute 份，
+    gzip压缩后由后台线程写入 <root>/<日期>/，队列满时直接丢弃，不阻塞采集
+    """
+
+    def __init__(self, root, sample_rate=0.2, max_per_minute=6, max_pending=100):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.max_per_minute = max_per_minute
+        self.lock = threading.Lock()
+        self.tokens = float(max_per_minute)
+        self.last_refill = time.time()
+        self.pending = queue.Queue(maxsize=max_pending)
+        self._thread = None
+
+    def _take_token(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.max_per_minute, self.tokens + (now - self.last_refill) * self.max_per_minute / 60.0)
+            self.last_refill = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def save(self, url, page_source):
+        """抽中时返回将要写入的路径，否则返回None"""
+        if not page_source or random.random() >= self.sample_rate or not self._take_token():
+            return None
+        now = datetime.now()
+        name = f"{now.strftime('%H%M%S%f')}-{hashlib.md5((url or '').encode('utf-8')).hexdigest()[:8]}.html.gz"
+        path = os.path.join(self.root, now.strftime("%Y%m%d"), name)
+        try:
+            self.pending.put_nowait((path, url, page_source))
+        except queue.Full:
+            return None
+        self._ensure_writer()
+        return path
+
+    def _ensure_writer(self):
+        with self.lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, daemon=True)
+                self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            path, url, page_source = self.pending.get()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with gzip.open(path, "wt", encoding="utf-8") as f:
+                    f.write(f"<!-- {url} -->\n")
+                    f.write(page_source)
+            except OSError:
+                pass
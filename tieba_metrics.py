@@ -0,0 +1,190 @@
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 阶段耗时直方图的桶上限（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+METRIC_HELP = {
+    "tieba_stage_seconds": ("histogram", "各采集阶段耗时（fetch/page_source/parse/lzl/sleep/captcha_wait/write/publish）"),
+    "tieba_pages_total": ("counter", "已处理页面数，按结果（ok/empty/captcha/expired）区分"),
+    "tieba_floors_total": ("counter", "已采集楼层数"),
+    "tieba_threads_total": ("counter", "已保存帖子数"),
+    "tieba_stream_published_total": ("counter", "发布到清洗流水线的帖子数"),
+    "tieba_stream_backpressure_timeouts_total": ("counter", "清洗流水线背压等待超时次数（消费者可能没有运行）"),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _render_labels(key, extra=None):
+    items = list(key) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+class Metrics:
+    """进程内的计数器和直方图，带标签，线程安全；render() 输出Prometheus文本格式"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, label_key) -> 值
+        self.histograms = {}  # (name, label_key) -> [各桶计数..., 总和, 总数]
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[i] += 1
+                    break
+            hist[-2] += value
+            hist[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_total(self, name, **match):
+        with self.lock:
+            return sum(v for (n, key), v in self.counters.items()
+                       if n == name and all((k, str(val)) in key for k, val in match.items()))
+
+    def quantile(self, name, q, **match):
+        """由直方图桶估算分位数（同Prometheus的histogram_quantile），没有数据时返回None"""
+        with self.lock:
+            merged = [0] * (len(self.buckets) + 2)
+            for (n, key), hist in self.histograms.items():
+                if n == name and all((k, str(val)) in key for k, val in match.items()):
+                    merged = [a + b for a, b in zip(merged, hist)]
+        total = merged[-1]
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            count = merged[i]
+            if seen + count >= rank and count:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+        lines = []
+        names = sorted({n for n, _ in counters} | {n for n, _ in histograms})
+        for name in names:
+            kind, help_text = METRIC_HELP.get(name, ("counter" if any(n == name for n, _ in counters) else "histogram", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (n, key), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_render_labels(key)} {value}")
+            for (n, key), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, hist):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_render_labels(key, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_render_labels(key, [('le', '+Inf')])} {hist[-1]}")
+                lines.append(f"{name}_sum{_render_labels(key)} {hist[-2]:.6f}")
+                lines.append(f"{name}_count{_render_labels(key)} {hist[-1]}")
+        lines.append("# HELP tieba_uptime_seconds 进程运行时长")
+        lines.append("# TYPE tieba_uptime_seconds gauge")
+        lines.append(f"tieba_uptime_seconds {time.time() - self.started:.1f}")
+        return "\n".join(lines) + "\n"
+
+
+def start_http_server(metrics, port, host="127.0.0.1"):
+    """在后台线程提供 http://host:port/metrics ，返回server对象"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SummaryReporter:
+    """每隔 interval 秒把最近一段时间的吞吐、验证码率和延迟分位数交给 emit(文本) 输出"""
+
+    def __init__(self, metrics, interval, emit):
+        self.metrics = metrics
+        self.interval = interval
+        self.emit = emit
+        self.last = (metrics.started, 0, 0)  # 首次统计从进程启动算起
+        self._stop = threading.Event()
+        self._thread = None
+
+    def summary(self):
+        m = self.metrics
+        now = time.time()
+        pages = m.counter_total("tieba_pages_total")
+        floors = m.counter_total("tieba_floors_total")
+        last_time, last_pages, last_floors = self.last
+        self.last = (now, pages, floors)
+        elapsed = max(now - last_time, 1e-9)
+        captcha = m.counter_total("tieba_pages_total", outcome="captcha")
+        p50 = m.quantile("tieba_stage_seconds", 0.5, stage="fetch")
+        p95 = m.quantile("tieba_stage_seconds", 0.95, stage="fetch")
+        fmt = lambda v: f"{v * 1000:.0f}ms" if v is not None else "-"
+        return (f"页面 {(pages - last_pages) / elapsed:.2f}/s，楼层 {(floors - last_floors) / elapsed:.2f}/s，"
+                f"累计页面 {pages}，验证码率 {captcha / pages if pages else 0:.1%}，"
+                f"抓取延迟 p50={fmt(p50)} p95={fmt(p95)}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.emit(self.summary())
+            except Exception:
+                pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,247 @@
+import re
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional
+import lxml.html
+from lxml import etree
+
+CAPTCHA_KEYWORDS = [
+    "安全验证", "人机验证", "请输入验证码", "系统检测到您的请求存在异常"
+]
+LOGIN_KEYWORDS = [
+    "登录百度帐号", "请在手机上确认登录"
+]
+# 纯HTTP拿到的是需要执行JS才能继续的跳转/校验页
+JS_WALL_KEYWORDS = [
+    "wappass.baidu.com", "请开启JavaScript", "请启用JavaScript", "window.location.replace("
+]
+
+RISK_LOGIN = "login"
+RISK_CAPTCHA = "captcha"
+RISK_JS_WALL = "js_wall"
+
+_RISK_CATEGORY = {}
+for _kw in JS_WALL_KEYWORDS:
+    _RISK_CATEGORY[_kw] = RISK_JS_WALL
+for _kw in CAPTCHA_KEYWORDS:
+    _RISK_CATEGORY[_kw] = RISK_CAPTCHA
+for _kw in LOGIN_KEYWORDS:
+    _RISK_CATEGORY[_kw] = RISK_LOGIN
+# 所有风控关键词合成一个正则，整页只扫一遍
+_RISK_RE = re.compile("|".join(re.escape(k) for k in sorted(_RISK_CATEGORY, key=len, reverse=True)))
+
+NEXT_PAGE_TEXTS = ['下一页', '下一页 >', '下一页›']
+
+
+def _has_class(cls):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')"
+
+
+# XPath预编译，解析时不再重复编译表达式
+_NEXT_PAGE_XP = etree.XPath("//a[" + " or ".join(f"normalize-space(.)='{t}'" for t in NEXT_PAGE_TEXTS) + "][1]")
+_TEXT_XP = etree.XPath(".//text()[not(ancestor::script) and not(ancestor::style)]")
+_THREAD_LINK_XP = etree.XPath("//a[starts-with(@href, '/p/')]")
+_THREAD_ITEM_XP = etree.XPath("ancestor::li[@data-field][1]")
+_POST_XP = etree.XPath("//div[@class='l_post l_post_bright j_l_post clearfix']")
+_POST_CONTENT_XP = etree.XPath(f".//div[{_has_class('d_post_content')}][1]")
+_LZL_ENTRY_XP = etree.XPath(f".//a[{_has_class('j_lzl_s_p')}][1]")
+_LZL_CONTENT_XP = etree.XPath(f"//span[{_has_class('lzl_content_main')}]")
+_LAST_PAGE_XP = etree.XPath(f"//a[{_has_class('last')} or normalize-space(.)='尾页'][contains(@href, 'pn=')]/@href")
+
+SPEECH_BLACKLIST = [
+    '吧务提醒', '签到', '本帖最后由', '回复：', '引用', '客户端', '推广', '广告', '[图片]', '[表情]', 'img', '楼主'
+]
+_SPEECH_BLACKLIST_RE = re.compile("|".join(re.escape(k) for k in SPEECH_BLACKLIST) + r"|\[.+?\]")
+_CJK_RE = re.compile('[\u4e00-\u9fff]')
+_TID_RE = re.compile(r'/p/(\d+)')
+_FID_RE = re.compile(r'(?:"forum_id"|\bfid)\s*[:=]\s*"?(\d+)')
+_PN_RE = re.compile(r'[?&]pn=(\d+)')
+_THREAD_COUNT_RE = re.compile(r'共有主题数\s*(?:<[^>]*>\s*)*(\d+)')
+
+
+@dataclass
+class ThreadLink:
+    title: str
+    url: str
+    tid: str
+    reply_num: Optional[int] = None
+
+
+@dataclass
+class Post:
+    text: str
+    floor: Optional[int]
+    pid: Optional[str]
+    has_lzl: bool
+
+
+@dataclass
+class ThreadPage:
+    posts: List[Post] = field(default_factory=list)
+    has_next: bool = False
+    fid: Optional[str] = None
+
+
+@dataclass
+class ForumPage:
+    threads: List[ThreadLink] = field(default_factory=list)
+    page_count: Optional[int] = None    # 列表页总页数，每页 threads_per_page 帖
+    thread_count: Optional[int] = None  # 吧的主题帖总数
+
+
+@dataclass
+class LzlPage:
+    comments: List[str] = field(default_factory=list)
+    has_next: bool = False
+
+
+def scan_risk(page_source):
+    """一次扫描返回页面命中的风控类别集合（login/captcha/js_wall）"""
+    return {_RISK_CATEGORY[m] for m in _RISK_RE.findall(page_source)}
+
+
+def check_page(page_source, url):
+    risks = scan_risk(page_source)
+    if RISK_LOGIN in risks:
+        raise Exception("CookieExpired")
+    if RISK_CAPTCHA in risks:
+        raise Exception(f"NeedCaptcha::{url}")
+    return risks
+
+
+def needs_browser(page_source):
+    risks = scan_risk(page_source)
+    return RISK_CAPTCHA in risks or RISK_JS_WALL in risks
+
+
+def is_valid_speech(text):
+    if len(text) < 8:
+        return False
+    if not _CJK_RE.search(text):
+        return False
+    if _SPEECH_BLACKLIST_RE.search(text):
+        return False
+    return True
+
+
+def _doc(page_source):
+    if not page_source or not page_source.strip():
+        return None
+    try:
+        return lxml.html.fromstring(page_source)
+    except Exception:
+        return None
+
+
+def _strip_text(el):
+    return ''.join(t.strip() for t in _TEXT_XP(el))
+
+
+def has_next_page(doc):
+    return doc is not None and bool(_NEXT_PAGE_XP(doc))
+
+
+def tid_from_url(url):
+    m = _TID_RE.search(url)
+    return m.group(1) if m else url.split('/p/')[1].split('?')[0]
+
+
+def parse_thread_list(page_source, base_url):
+    doc = _doc(page_source)
+    if doc is None:
+        return []
+    threads = []
+    for item in _THREAD_LINK_XP(doc):
+        title = item.get('title') or item.text_content().strip()
+        href = item.get('href')
+        if title:
+            threads.append(ThreadLink(title=title, url=base_url + href, tid=tid_from_url(href),
+                                      reply_num=_thread_reply_num(item)))
+    return threads
+
+
+def parse_forum_page(page_source, base_url, threads_per_page=50):
+    """
+    吧列表页：帖子列表，以及由“尾页”链接（pn=最后一页的偏移）或“共有主题数”推算的总页数，
+    生成任务时用来估计吧的规模。两者都没有时 page_count 为 None
+    """
+    page = ForumPage(threads=parse_thread_list(page_source, base_url))
+    doc = _doc(page_source)
+    m = _THREAD_COUNT_RE.search(page_source or "")
+    if m:
+        page.thread_count = int(m.group(1))
+    offsets = [int(pn.group(1)) for href in (_LAST_PAGE_XP(doc) if doc is not None else [])
+               for pn in [_PN_RE.search(href)] if pn]
+    if offsets:
+        page.page_count = max(offsets) // threads_per_page + 1
+    elif page.thread_count is not None:
+        page.page_count = max(1, -(-page.thread_count // threads_per_page))
+    return page
+
+
+def _thread_reply_num(link):
+    """列表页每个帖子的 <li data-field> 里带有回复数"""
+    li = _THREAD_ITEM_XP(link)
+    if not li:
+        return None
+    try:
+        reply_num = json.loads(li[0].get('data-field')).get('reply_num')
+    except Exception:
+        return None
+    return int(reply_num) if reply_num is not None else None
+
+
+def parse_thread_page(page_source):
+    doc = _doc(page_source)
+    page = ThreadPage()
+    if doc is None:
+        return page
+    for post in _POST_XP(doc):
+        main_content = _POST_CONTENT_XP(post)
+        if not main_content:
+            continue
+        try:
+            content = json.loads(post.get('data-field', '{}')).get("content", {})
+            floor_num = content.get("post_no")
+            pid = content.get("post_id")
+        except Exception:
+            floor_num = None
+            pid = None
+        page.posts.append(Post(
+            text=_strip_text(main_content[0]),
+            floor=floor_num,
+            pid=str(pid) if pid else None,
+            has_lzl=bool(_LZL_ENTRY_XP(post)),
+        ))
+    page.has_next = has_next_page(doc)
+    m = _FID_RE.search(page_source)
+    page.fid = m.group(1) if m else None
+    return page
+
+
+def parse_lzl_page(page_source):
+    doc = _doc(page_source)
+    if doc is None:
+        return LzlPage()
+    comments = [_strip_text(c) for c in _LZL_CONTENT_XP(doc)]
+    return LzlPage(comments=comments, has_next=has_next_page(doc))
+
+
+def parse_total_comment(page_source):
+    """
+    解析 /p/totalComment 的JSON，返回 {pid: (楼中楼文本列表, 楼中楼总数)}。
+    只包含有楼中楼的楼层；返回内容不是合法JSON时抛 ValueError
+    """
+    data = json.loads(page_source)
+    if data.get("errno", 0) != 0:
+        raise ValueError(f"totalComment errno={data.get('errno')}")
+    comment_list = (data.get("data") or {}).get("comment_list") or {}
+    result = {}
+    for pid, item in comment_list.items():
+        comments = []
+        for info in item.get("comment_info") or []:
+            html = info.get("content") or ""
+            if html.strip():
+                comments.append(_strip_text(lxml.html.fragment_fromstring(html, create_parent='span')))
+        result[str(pid)] = (comments, int(item.get("comment_num") or len(comments)))
+    return result
@@ -0,0 +1,249 @@
+import time
+import uuid
+import threading
+
+OUTCOME_ERROR = "error"  # 连接失败/超时，与 tieba_ratelimit 中的页面结果并列，只计入代理健康度
+
+# 领取：先回收过期租约，再在候选代理中选 健康分/(1+在用数) 最高、未冷却且未满载的一个
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local max_leases = tonumber(ARGV[2])
+local latency_ref = tonumber(ARGV[3])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[6], '-inf', now)
+for _, lease in ipairs(expired) do
+    redis.call('ZREM', KEYS[6], lease)
+    redis.call('HINCRBY', KEYS[5], string.match(lease, '^(.*)|'), -1)
+end
+local best, best_score, soonest = nil, -1, nil
+for i = 6, #ARGV do
+    local proxy = ARGV[i]
+    local cooldown = tonumber(redis.call('HGET', KEYS[4], proxy) or '0')
+    if cooldown > now then
+        if not soonest or cooldown < soonest then soonest = cooldown end
+    else
+        local active = tonumber(redis.call('HGET', KEYS[5], proxy) or '0')
+        if active < max_leases then
+            local success = tonumber(redis.call('HGET', KEYS[1], proxy) or '1')
+            local captcha = tonumber(redis.call('HGET', KEYS[2], proxy) or '0')
+            local latency = tonumber(redis.call('HGET', KEYS[3], proxy) or '0')
+            local score = success * (1 - captcha) / (1 + latency / latency_ref) / (1 + active)
+            if score > best_score then best, best_score = proxy, score end
+        end
+    end
+end
+if not best then return {'', tostring(soonest or 0)} end
+local lease = best .. '|' .. ARGV[4]
+redis.call('ZADD', KEYS[6], tostring(now + tonumber(ARGV[5])), lease)
+redis.call('HINCRBY', KEYS[5], best, 1)
+return {best, lease}
+"""
+
+# 归还：租约还在才减在用数，避免与过期回收重复扣减
+_RELEASE_LUA = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[2], -1)
+    return 1
+end
+return 0
+"""
+
+# 反馈：成功率/验证码率/延迟按指数滑动平均更新，老问题会随新结果逐渐淡出
+_REPORT_LUA = """
+local proxy = ARGV[1]
+local alpha = tonumber(ARGV[5])
+local function ewma(key, x, init)
+    local v = tonumber(redis.call('HGET', key, proxy) or init)
+    redis.call('HSET', key, proxy, tostring(v + alpha * (x - v)))
+end
+if ARGV[2] ~= '' then
+    ewma(KEYS[1], tonumber(ARGV[2]), '1')
+    ewma(KEYS[2], tonumber(ARGV[3]), '0')
+end
+if ARGV[4] ~= '' then
+    if redis.call('HEXISTS', KEYS[3], proxy) == 1 then
+        ewma(KEYS[3], tonumber(ARGV[4]), '0')
+    else
+        redis.call('HSET', KEYS[3], proxy, ARGV[4])
+    end
+end
+redis.call('HINCRBY', KEYS[4], proxy, 1)
+return 1
+"""
+
+# 各页面结果对 (成功, 验证码) 的取值；Cookie失效不是代理的问题，只记延迟
+_OUTCOME_SAMPLES = {
+    "ok": (1, 0),
+    "empty": (0, 0),
+    "captcha": (0, 1),
+    OUTCOME_ERROR: (0, 0),
+}
+
+
+class ProxyPool:
+    """
+    全体worker共享的代理池（Redis）：
+      <key>            已登记的代理（set）
+      <key>:success    代理 -> 成功率（EWMA）
+      <key>:captcha    代理 -> 验证码率（EWMA）
+      <key>:latency    代理 -> 抓取延迟秒数（EWMA）
+      <key>:requests   代理 -> 累计请求数
+      <key>:cooldown   代理 -> 冷却结束时间
+      <key>:active     代理 -> 当前租约数
+      <key>:leases     "代理|租约id" -> 租约到期时间（zset）
+    健康分 = 成功率 × (1 - 验证码率) / (1 + 延迟/latency_ref)；新代理按满分对待，会先被试用。
+    冷却写入Redis后所有worker立即可见，本地只缓存 cache_ttl 秒
+    """
+
+    def __init__(self, conn, key, lease_ttl=600, max_leases=2, cooldown=600, alpha=0.2, latency_ref=2.0,
+                 retry_wait=10, cache_ttl=2.0):
+        self.r = conn
+        self.key = key
+        self.lease_ttl = lease_ttl
+        self.max_leases = max_leases
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.latency_ref = latency_ref
+        self.retry_wait = retry_wait
+        self.cache_ttl = cache_ttl
+        self.success_key = f"{key}:success"
+        self.captcha_key = f"{key}:captcha"
+        self.latency_key = f"{key}:latency"
+        self.requests_key = f"{key}:requests"
+        self.cooldown_key = f"{key}:cooldown"
+        self.active_key = f"{key}:active"
+        self.leases_key = f"{key}:leases"
+        self._acquire = conn.register_script(_ACQUIRE_LUA)
+        self._release = conn.register_script(_RELEASE_LUA)
+        self._report = conn.register_script(_REPORT_LUA)
+        self._lock = threading.Lock()
+        self._cooldowns = {}
+        self._cooldowns_at = 0.0
+
+    def register(self, proxies):
+        if proxies:
+            self.r.sadd(self.key, *proxies)
+
+    def acquire(self, holder, proxies):
+        """
+        从 proxies 中领取一个代理，返回 (ProxyLease, 0)；
+        全部冷却或满载时返回 (None, 建议等待秒数)
+        """
+        if not proxies:
+            return None, 0
+        now = time.time()
+        proxy, lease = self._acquire(
+            keys=[self.success_key, self.captcha_key, self.latency_key, self.cooldown_key,
+                  self.active_key, self.leases_key],
+            args=[now, self.max_leases, self.latency_ref, f"{holder}/{uuid.uuid4().hex[:6]}", self.lease_ttl,
+                  *proxies],
+        )
+        if not proxy:
+            soonest = float(lease)
+            return None, int(soonest - now) + 1 if soonest else self.retry_wait
+        return ProxyLease(self, proxy, lease), 0
+
+    def renew(self, lease):
+        return bool(self.r.zadd(self.leases_key, {lease: time.time() + self.lease_ttl}, xx=True, ch=True))
+
+    def release(self, proxy, lease):
+        return bool(self._release(keys=[self.leases_key, self.active_key], args=[lease, proxy]))
+
+    def report(self, proxy, outcome, latency=None):
+        success, captcha = _OUTCOME_SAMPLES.get(outcome, ("", ""))
+        self._report(
+            keys=[self.success_key, self.captcha_key, self.latency_key, self.requests_key],
+            args=[proxy, success, captcha, "" if latency is None else f"{latency:.3f}", self.alpha],
+        )
+
+    def cool_down(self, proxy, seconds=None):
+        until = time.time() + (seconds or self.cooldown)
+        self.r.hset(self.cooldown_key, proxy, until)
+        with self._lock:
+            self._cooldowns[proxy] = until
+        return until
+
+    def cooldowns(self):
+        """冷却中的代理 -> 冷却结束时间"""
+        now = time.time()
+        with self._lock:
+            if now - self._cooldowns_at < self.cache_ttl:
+                return {p: t for p, t in self._cooldowns.items() if t > now}
+        cooldowns = {p: float(t) for p, t in self.r.hgetall(self.cooldown_key).items() if float(t) > now}
+        with self._lock:
+            self._cooldowns = cooldowns
+            self._cooldowns_at = now
+        return dict(cooldowns)
+
+    def is_cooling(self, proxy):
+        return proxy in self.cooldowns()
+
+    def health(self, stats):
+        return stats["success"] * (1 - stats["captcha"]) / (1 + stats["latency"] / self.latency_ref)
+
+    def stats(self, proxies=None):
+        """各代理的健康度快照：{代理: {success, captcha, latency, requests, active, cooldown, health}}"""
+        proxies = list(proxies) if proxies is not None else sorted(self.r.smembers(self.key))
+        if not proxies:
+            return {}
+        pipe = self.r.pipeline(transaction=False)
+        for key in (self.success_key, self.captcha_key, self.latency_key, self.requests_key,
+                    self.active_key, self.cooldown_key):
+            pipe.hmget(key, proxies)
+        success, captcha, latency, requests, active, cooldown = pipe.execute()
+        now = time.time()
+        result = {}
+        for i, proxy in enumerate(proxies):
+            stats = {
+                "success": float(success[i] or 1),
+                "captcha": float(captcha[i] or 0),
+                "latency": float(latency[i] or 0),
+                "requests": int(requests[i] or 0),
+                "active": int(active[i] or 0),
+                "cooldown": max(0, int(float(cooldown[i] or 0) - now)),
+            }
+            stats["health"] = self.health(stats)
+            result[proxy] = stats
+        return result
+
+    def summary(self, proxies=None):
+        return "，".join(
+            f"{p}[健康{s['health']:.2f} 成功{s['success']:.0%} 验证码{s['captcha']:.0%} "
+            f"延迟{s['latency']:.1f}s 在用{s['active']}" + (f" 冷却{s['cooldown']}s" if s['cooldown'] else "") + "]"
+            for p, s in sorted(self.stats(proxies).items(), key=lambda item: -item[1]["health"])
+        )
+
+
+class ProxyLease:
+    """一个已领取代理的租约，后台线程定期续约；用完调用 release()（或用with块）"""
+
+    def __init__(self, pool, proxy, lease):
+        self.pool = pool
+        self.proxy = proxy
+        self.lease = lease
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        interval = max(1, self.pool.lease_ttl // 3)
+        while not self._stop.wait(interval):
+            try:
+                if not self.pool.renew(self.lease):
+                    self.lost = True  # 租约已过期被回收，在用数不再计入本worker
+                    return
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def release(self):
+        if self._stop.is_set():
+            return False
+        self._stop.set()
+        return self.pool.release(self.proxy, self.lease)
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from contextlib import contextmanager
+
+OUTCOME_OK = "ok"
+OUTCOME_EMPTY = "empty"
+OUTCOME_CAPTCHA = "captcha"
+OUTCOME_EXPIRED = "expired"
+
+# 各类异常页面对速率的乘性回退系数
+BACKOFF_FACTORS = {
+    OUTCOME_EMPTY: 0.7,
+    OUTCOME_EXPIRED: 0.5,
+    OUTCOME_CAPTCHA: 0.3,
+}
+
+
+def proxy_key(proxy):
+    return f"proxy:{proxy or 'direct'}"
+
+
+def cookie_key(cookie_str):
+    # 不把Cookie原文写进状态文件
+    return "cookie:" + hashlib.md5((cookie_str or "").encode("utf-8")).hexdigest()[:12]
+
+
+class RateController:
+    """
+    按代理/Cookie分别维护请求速率（次/分钟）的AIMD控制器：
+    页面正常时每次加 increase_per_page，遇到空页/Cookie失效/验证码按 BACKOFF_FACTORS 乘性回退。
+    一个请求同时受它所属的所有key约束，取其中最慢的间隔。状态定期落盘，重启后沿用；
+    多个worker共用一个状态文件，落盘时在文件锁内读出、按key取更新时间较新的一份合并后再写回
+    """
+
+    def __init__(self, state_file, start_rate, min_rate=2.0, max_rate=60.0, increase_per_page=0.5,
+                 jitter=0.2, save_interval=30):
+        self.state_file = state_file
+        self.start_rate = start_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_per_page = increase_per_page
+        self.jitter = jitter
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.state = {}
+        self.next_time = {}
+        self.last_save = time.time()
+        self.load()
+
+    def load(self):
+        self.state = self._read_file()
+
+    @contextmanager
+    def _file_lock(self, timeout=5.0, stale=30.0):
+        """跨进程互斥：独占创建 .lock 文件；持有者崩溃留下的锁超过 stale 秒视为失效。拿不到锁时返回False"""
+        lock_path = self.state_file + ".lock"
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > stale:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.time() >= deadline:
+                    yield False
+                    return
+                time.sleep(0.05)
+        try:
+            yield True
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def _read_file(self):
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """与文件中其他worker写入的状态合并后落盘：同一key取 updated 较新的一份，较新的也同步到本进程"""
+        with self._file_lock() as locked:
+            if not locked:
+                return False  # 其他worker正在写，下次再存
+            disk = self._read_file()
+            with self.lock:
+                for key, entry in disk.items():
+                    mine = self.state.get(key)
+                    if mine is None or entry.get("updated", 0) > mine.get("updated", 0):
+                        self.state[key] = entry
+                data = json.dumps(self.state, ensure_ascii=False)
+                self.last_save = time.time()
+            tmp = f"{self.state_file}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp, self.state_file)
+        return True
+
+    def _entry(self, key):
+        entry = self.state.get(key)
+        if entry is None:
+            # updated=0：没有反馈过的key落盘合并时不覆盖其他worker学到的速率
+            entry = self.state[key] = {"rate": self.start_rate, "ok": 0, "backoff": 0, "updated": 0}
+        return entry
+
+    def reserve(self, keys):
+        """为一次请求预约发送时间，返回还需等待的秒数（不阻塞，async模式用）"""
+        now = time.time()
+        with self.lock:
+            start = max([now] + [self.next_time.get(k, 0) for k in keys])
+            for k in keys:
+                interval = 60.0 / self._entry(k)["rate"]
+                self.next_time[k] = start + interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return start - now
+
+    def wait(self, keys):
+        delay = self.reserve(keys)
+        if delay > 0:
+            time.sleep(delay)
+
+    def feedback(self, keys, outcome):
+        with self.lock:
+            for k in keys:
+                entry = self._entry(k)
+                if outcome == OUTCOME_OK:
+                    entry["rate"] = min(self.max_rate, entry["rate"] + self.increase_per_page)
+                    entry["ok"] += 1
+                else:
+                    entry["rate"] = max(self.min_rate, entry["rate"] * BACKOFF_FACTORS.get(outcome, 0.5))
+                    entry["backoff"] += 1
+                    # 回退立刻生效，不等已预约的下一次请求
+                    self.next_time[k] = max(self.next_time.get(k, 0), time.time() + 60.0 / entry["rate"])
+                entry["updated"] = time.time()
+            due = time.time() - self.last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def snapshot(self):
+        """当前各key的速率，供日志和监控查看"""
+        with self.lock:
+            return {k: dict(v) for k, v in self.state.items()}
+
+    def summary(self):
+        return "，".join(f"{k}={v['rate']:.1f}次/分" for k, v in sorted(self.snapshot().items()))
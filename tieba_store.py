@@ -0,0 +1,204 @@
+import os
+import gzip
+import json
+import zlib
+import time
+import socket
+import threading
+
+SEGMENT_EXT = ".jsonl.gz"
+INDEX_EXT = ".idx"
+
+
+class CorpusStore:
+    """
+    只追加写入的分段语料库，替代每帖一个txt：
+      <root>/seg-<写入者>-<序号>.jsonl.gz  每次保存一个帖子（或一次增量续采）写成一个独立的gzip成员，
+                                           成员内每行一条记录 {bar, tid, title, pid, floor, parent_pid, text, crawled_at}
+      <root>/seg-<写入者>-<序号>.idx       段内索引，每行 {"tid", "off", "len", "n"}，按tid随机读取时直接seek解压
+    段文件超过 segment_max_bytes 后换新段。每个写入进程只写自己的段文件，多进程共用一个目录无需加锁。
+    内存中的tid索引记下每个 .idx 读到的位置，查不到某个tid时只补读各索引新增的行，能看到其他进程后来保存的帖子；
+    查不到时的补读最多每 refresh_interval 秒一次（每次要列目录、逐段看文件大小），本进程写入的帖子立即可见
+    """
+
+    def __init__(self, root, segment_max_bytes=64 * 1024 * 1024, writer=None, refresh_interval=5.0):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        self.writer = writer or f"{time.strftime('%Y%m%d')}-{socket.gethostname()}-{os.getpid()}"
+        self.lock = threading.Lock()
+        self._seq = 0
+        self._segment = None
+        self._index = None
+        self._index_pos = {}
+        self.refresh_interval = refresh_interval
+        self._refreshed_at = 0
+
+    def _path(self, segment, ext):
+        return os.path.join(self.root, segment + ext)
+
+    def _current_segment(self, incoming):
+        if self._segment is not None:
+            path = self._path(self._segment, SEGMENT_EXT)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size == 0 or size + incoming <= self.segment_max_bytes:
+                return self._segment
+        self._seq += 1
+        self._segment = f"seg-{self.writer}-{self._seq:04d}"
+        return self._segment
+
+    def append_thread(self, tid, records):
+        """
+        把一个帖子的记录追加为一个gzip成员，返回写入条数。
+        没有有效发言的帖子只写一行 len=0 的索引，记为已保存，下次不会再采
+        """
+        tid = str(tid)
+        if not records and self.contains(tid):
+            return 0
+        data = gzip.compress(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8')) \
+            if records else b''
+        with self.lock:
+            os.makedirs(self.root, exist_ok=True)
+            segment = self._current_segment(len(data))
+            with open(self._path(segment, SEGMENT_EXT), "ab") as f:
+                f.seek(0, os.SEEK_END)
+                off = f.tell()
+                f.write(data)
+            # 先写数据再写索引，崩溃时索引不会指向不存在的数据
+            line = (json.dumps({"tid": tid, "off": off, "len": len(data), "n": len(records)}) + "\n").encode("utf-8")
+            with open(self._path(segment, INDEX_EXT), "ab") as f:
+                f.seek(0, os.SEEK_END)
+                idx_off = f.tell()
+                f.write(line)
+            # 本段索引之前的内容都已读入时直接登记，否则留给下次补读，避免重复登记
+            if self._index is not None and self._index_pos.get(segment, 0) == idx_off:
+                self._index.setdefault(tid, []).append((segment, off, len(data)))
+                self._index_pos[segment] = idx_off + len(line)
+        return len(records)
+
+    def segments(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(f[:-len(SEGMENT_EXT)] for f in os.listdir(self.root) if f.endswith(SEGMENT_EXT))
+
+    def load_index(self):
+        """读入所有段的索引：tid -> [(段名, 偏移, 长度)]，同一tid多次续采按写入顺序排列"""
+        with self.lock:
+            self._index = {}
+            self._index_pos = {}
+            self._read_new_index()
+            self._refreshed_at = time.time()
+            return self._index
+
+    def refresh_index(self):
+        """补读各段索引自上次读到的位置之后新增的行（包括其他进程新建的段）"""
+        if self._index is None:
+            return self.load_index()
+        with self.lock:
+            self._read_new_index()
+            self._refreshed_at = time.time()
+            return self._index
+
+    def _read_new_index(self):
+        for segment in self.segments():
+            path = self._path(segment, INDEX_EXT)
+            pos = self._index_pos.get(segment, 0)
+            try:
+                if os.path.getsize(path) <= pos:
+                    continue
+            except OSError:
+                continue
+            with open(path, "rb") as f:
+                f.seek(pos)
+                data = f.read()
+            end = data.rfind(b"\n") + 1  # 末尾写到一半的行留到下次再读
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 写入进程崩溃时留下的半行
+                self._index.setdefault(entry["tid"], []).append((segment, entry["off"], entry["len"]))
+            self._index_pos[segment] = pos + end
+
+    def _entries(self, tid):
+        tid = str(tid)
+        if self._index is None:
+            self.load_index()
+        entries = self._index.get(tid)
+        if not entries and time.time() - self._refreshed_at >= self.refresh_interval:
+            entries = self.refresh_index().get(tid)
+        return entries or []
+
+    def contains(self, tid):
+        return bool(self._entries(tid))
+
+    def tids(self):
+        return list(self.refresh_index())
+
+    def read_thread(self, tid):
+        """按索引随机读取一个帖子的全部记录（包括其他进程后来续采追加的部分）"""
+        self.refresh_index()
+        return self._read_entries(self._entries(tid))
+
+    def _read_entries(self, entries):
+        records = []
+        for segment, off, length in entries:
+            if not length:
+                continue  # 没有有效发言的帖子
+            with open(self._path(segment, SEGMENT_EXT), "rb") as f:
+                f.seek(off)
+                data = gzip.decompress(f.read(length))
+            records.extend(json.loads(line) for line in data.decode('utf-8').splitlines() if line)
+        return records
+
+    def iter_members(self, segment, start=0):
+        """
+        按段内索引依次返回偏移 >= start 的gzip成员：(成员结束偏移, 记录列表)。
+        下游记下最后一个结束偏移，下次从这里继续，只读新写入的帖子
+        """
+        path = self._path(segment, INDEX_EXT)
+        if not os.path.exists(path):
+            return
+        entries = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 写到一半的索引行
+                if entry["off"] >= start and entry["len"]:
+                    entries.append((entry["off"], entry["len"]))
+        if not entries:
+            return
+        with open(self._path(segment, SEGMENT_EXT), "rb") as f:
+            for off, length in entries:
+                f.seek(off)
+                data = gzip.decompress(f.read(length))
+                yield off + length, [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+
+    def iter_records(self, bar=None):
+        """顺序流式读取所有段的记录，不占用整库内存；bar 给定时只返回该吧"""
+        for segment in self.segments():
+            with gzip.open(self._path(segment, SEGMENT_EXT), "rt", encoding="utf-8") as f:
+                try:
+                    for line in f:
+                        record = json.loads(line)
+                        if bar is None or record.get("bar") == bar:
+                            yield record
+                except (EOFError, gzip.BadGzipFile):
+                    continue  # 段尾是写入进程崩溃时留下的半个成员，跳过
+
+    def iter_threads(self, on_error=None):
+        """
+        按帖子逐个返回 (tid, 记录列表)，供按帖分析的下游脚本使用。
+        给定 on_error(tid, e) 时，读不出来的帖子（段文件损坏、截断等）交给它处理后跳过，否则直接抛出
+        """
+        for tid in self.tids():
+            try:
+                records = self._read_entries(self._entries(tid))
+            except (OSError, EOFError, ValueError, zlib.error) as e:
+                if on_error is None:
+                    raise
+                on_error(tid, e)
+                continue
+            if records:
+                yield tid, records
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import deque, defaultdict
+
+import redis
+
+
+def line_fingerprint(line):
+    return hashlib.md5(line.encode("utf-8")).hexdigest()[:16]
+
+
+def char_jaccard(set1, set2):
+    """与 markov_generate 的分桶去重相同：按字符集合计算Jaccard相似度"""
+    if not set1 or not set2:
+        return 0.0
+    return len(set1 & set2) / len(set1 | set2)
+
+
+class CorpusStream:
+    """
+    爬虫 -> 清洗/去重/统计 的流式通道（Redis Stream）：
+      <key>              每保存一个帖子（或一次增量续采）发布一条消息 {bar, tid, title, records}
+      <key>:dead         多次处理失败的消息原文（list），不再重试
+    消费者组内每条消息只投递给一个消费者，处理完才ACK并删除，所以流的长度就是积压量；
+    消费者崩溃留下的未ACK消息闲置超过 claim_idle 秒后由其他消费者接管（至少一次）。
+    生产端积压达到 max_backlog 条时等待消费者追上（背压），最多等 max_wait 秒后照常写入，不丢数据；
+    等待超时后视为消费者没在运行，之后不再等待，直到积压降回 max_backlog 以下才恢复背压
+    """
+
+    def __init__(self, conn, key, max_backlog=5000, max_wait=60, poll=1.0, claim_idle=300, max_deliveries=5):
+        self.r = conn
+        self.key = key
+        self.dead_key = f"{key}:dead"
+        self.max_backlog = max_backlog
+        self.max_wait = max_wait
+        self.poll = poll
+        self.claim_idle = claim_idle
+        self.max_deliveries = max_deliveries
+        self._autoclaim = True  # Redis 6.2 以下没有 XAUTOCLAIM，第一次报错后改用 XPENDING + XCLAIM
+        self._stalled = False   # 背压等待已超时一次：消费者没在运行，积压降下来之前不再等待
+
+    # ---------- 生产端 ----------
+
+    def publish(self, bar, tid, title, records):
+        """
+        发布一个帖子的新记录，返回 (消息id, 本次背压等待是否超时)。
+        积压过多时先阻塞等待；超时一次后不再等待，直到积压降回 max_backlog 以下
+        """
+        pipe = self.r.pipeline(transaction=False)
+        pipe.xadd(self.key, {
+            "bar": bar, "tid": str(tid), "title": title or "",
+            "records": json.dumps(records, ensure_ascii=False),
+        })
+        pipe.xlen(self.key)
+        msg_id, backlog = pipe.execute()
+        if backlog < self.max_backlog:
+            self._stalled = False
+            return msg_id, False
+        if self._stalled:
+            return msg_id, False
+        if self.wait_backlog():
+            return msg_id, False
+        self._stalled = True
+        return msg_id, True
+
+    def backlog(self):
+        return self.r.xlen(self.key)
+
+    def wait_backlog(self):
+        """等到积压低于 max_backlog，返回是否等到（超时也返回，由调用方记录日志）"""
+        deadline = time.time() + self.max_wait
+        while time.time() < deadline:
+            if self.r.xlen(self.key) < self.max_backlog:
+                return True
+            time.sleep(self.poll)
+        return False
+
+    # ---------- 消费端 ----------
+
+    def ensure_group(self, group):
+        try:
+            self.r.xgroup_create(self.key, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _take_idle(self, group, consumer, count):
+        """接管闲置超过 claim_idle 秒的未ACK消息，返回 [(消息id, 字段)]"""
+        min_idle = self.claim_idle * 1000
+        if self._autoclaim:
+            try:
+                _, messages, *_ = self.r.xautoclaim(self.key, group, consumer, min_idle_time=min_idle,
+                                                   start_id="0-0", count=count)
+                return messages
+            except redis.ResponseError as e:
+                if "unknown command" not in str(e).lower():
+                    raise
+                self._autoclaim = False
+        pending = self.r.xpending_range(self.key, group, min="-", max="+", count=count)
+        idle = [p["message_id"] for p in pending if p["time_since_delivered"] >= min_idle]
+        if not idle:
+            return []
+        return self.r.xclaim(self.key, group, consumer, min_idle_time=min_idle, message_ids=idle)
+
+    def _claim(self, group, consumer, count):
+        """接管闲置超时的未ACK消息；投递次数过多的移入死信，不再重试"""
+        messages = self._take_idle(group, consumer, count)
+        messages = [(msg_id, fields) for msg_id, fields in messages if fields]
+        if not messages:
+            return []
+        pending = self.r.xpending_range(self.key, group, min=messages[0][0], max=messages[-1][0], count=len(messages))
+        deliveries = {p["message_id"]: p["times_delivered"] for p in pending}
+        alive = []
+        for msg_id, fields in messages:
+            if deliveries.get(msg_id, 0) > self.max_deliveries:
+                pipe = self.r.pipeline(transaction=False)
+                pipe.rpush(self.dead_key, json.dumps({"id": msg_id, **fields}, ensure_ascii=False))
+                pipe.xack(self.key, group, msg_id)
+                pipe.xdel(self.key, msg_id)
+                pipe.execute()
+            else:
+                alive.append((msg_id, fields))
+        return alive
+
+    def read(self, group, consumer, count=100, block_ms=5000):
+        """先接管别人遗留的消息，没有再读新消息；返回 [(消息id, 字段)]"""
+        messages = self._claim(group, consumer, count)
+        if messages:
+            return messages
+        result = self.r.xreadgroup(group, consumer, {self.key: ">"}, count=count, block=block_ms)
+        return result[0][1] if result else []
+
+    def ack(self, group, msg_ids):
+        if not msg_ids:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        pipe.xack(self.key, group, *msg_ids)
+        pipe.xdel(self.key, *msg_ids)
+        pipe.execute()
+
+    def consume(self, group, consumer, handler, count=100, block_ms=5000, idle_exit=None, on_error=None):
+        """
+        持续消费：handler(批量消息) 正常返回后才ACK，抛异常时调用 on_error(异常, 批量消息)（缺省记日志）
+        后继续消费，这批消息留在待处理列表，闲置 claim_idle 秒后重新投递。
+        idle_exit 给定时连续这么多秒没有消息就返回
+        """
+        self.ensure_group(group)
+        idle_since = time.time()
+        while True:
+            messages = self.read(group, consumer, count=count, block_ms=block_ms)
+            if not messages:
+                if idle_exit is not None and time.time() - idle_since >= idle_exit:
+                    return
+                continue
+            idle_since = time.time()
+            try:
+                handler(messages)
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e, messages)
+                else:
+                    logging.getLogger(__name__).exception("处理 %d 条消息失败，等待重新投递", len(messages))
+                time.sleep(self.poll)
+                continue
+            self.ack(group, [msg_id for msg_id, _ in messages])
+
+
+class CorpusIngestor:
+    """
+    消费端的处理逻辑：逐条清洗 -> 精确去重 -> 近似去重 -> 追加写入清洗后语料 -> 更新各吧统计。
+      <key>:seen          已输出句子的指纹（set），所有消费者共享的精确去重
+      <key>:stats:<bar>   各吧累计计数（hash）：posts 收到发言数 / kept 输出数 / empty 清洗后为空 /
+                          dup 精确重复 / near_dup 近似重复 / chars 输出字数
+      <key>:words:<bar>   各吧词频（zset），给定 tokenize 时统计
+    近似去重只在本进程内进行：按长度分桶，每桶保留最近 window 句，与 sim_threshold 以上的句子视为重复。
+    每批先写文件（flush+fsync），再登记指纹、更新统计；崩溃时最多重复输出一批，不会丢数据
+    """
+
+    def __init__(self, conn, key, out_file, clean, tokenize=None, sim_threshold=0.88, bucket_size=10, window=1000,
+                 min_word_len=2):
+        self.r = conn
+        self.key = key
+        self.seen_key = f"{key}:seen"
+        self.out_file = out_file
+        self.clean = clean
+        self.tokenize = tokenize
+        self.sim_threshold = sim_threshold
+        self.bucket_size = bucket_size
+        self.window = window
+        self.min_word_len = min_word_len
+        self.recent = defaultdict(lambda: deque(maxlen=window))
+        self.totals = defaultdict(int)
+
+    def stats_key(self, bar):
+        return f"{self.key}:stats:{bar}"
+
+    def words_key(self, bar):
+        return f"{self.key}:words:{bar}"
+
+    def _near_duplicate(self, line):
+        chars = set(line)
+        bucket = self.recent[len(line) // self.bucket_size]
+        for other in bucket:
+            if char_jaccard(chars, other) >= self.sim_threshold:
+                return True
+        bucket.append(chars)
+        return False
+
+    def __call__(self, messages):
+        candidates = []  # (吧, 句子, 指纹)
+        counts = defaultdict(lambda: defaultdict(int))
+        for _, fields in messages:
+            bar = fields.get("bar", "")
+            for record in json.loads(fields.get("records") or "[]"):
+                counts[bar]["posts"] += 1
+                line = self.clean((record.get("text") or "").strip())
+                if not line:
+                    counts[bar]["empty"] += 1
+                    continue
+                candidates.append((bar, line, line_fingerprint(line)))
+
+        pipe = self.r.pipeline(transaction=False)
+        for _, _, fp in candidates:
+            pipe.sismember(self.seen_key, fp)
+        known = pipe.execute() if candidates else []
+
+        kept = []
+        batch_seen = set()
+        for (bar, line, fp), is_known in zip(candidates, known):
+            if is_known or fp in batch_seen:
+                counts[bar]["dup"] += 1
+                continue
+            batch_seen.add(fp)
+            if self._near_duplicate(line):
+                counts[bar]["near_dup"] += 1
+                continue
+            kept.append((bar, line, fp))
+            counts[bar]["kept"] += 1
+            counts[bar]["chars"] += len(line)
+
+        if kept:
+            os.makedirs(os.path.dirname(self.out_file) or ".", exist_ok=True)
+            with open(self.out_file, "a", encoding="utf-8") as f:
+                f.write("".join(line + "\n" for _, line, _ in kept))
+                f.flush()
+                os.fsync(f.fileno())
+
+        pipe = self.r.pipeline(transaction=False)
+        if kept:
+            pipe.sadd(self.seen_key, *[fp for _, _, fp in kept])
+        for bar, fields in counts.items():
+            for field, n in fields.items():
+                pipe.hincrby(self.stats_key(bar), field, n)
+                self.totals[field] += n
+        if self.tokenize is not None:
+            words = defaultdict(lambda: defaultdict(int))
+            for bar, line, _ in kept:
+                for w in self.tokenize(line):
+                    w = w.strip()
+                    if len(w) >= self.min_word_len:
+                        words[bar][w] += 1
+            for bar, freq in words.items():
+                for w, n in freq.items():
+                    pipe.zincrby(self.words_key(bar), n, w)
+        pipe.execute()
+        return len(kept)
+
+    def bar_stats(self, bar, top_words=20):
+        stats = {k: int(v) for k, v in self.r.hgetall(self.stats_key(bar)).items()}
+        stats["top_words"] = self.r.zrevrange(self.words_key(bar), 0, top_words - 1, withscores=True)
+        return stats
+
+    def bars(self):
+        prefix = f"{self.key}:stats:"
+        return sorted(k[len(prefix):] for k in self.r.scan_iter(f"{prefix}*"))
+
+    def summary(self):
+        t = self.totals
+        return (f"收到{t['posts']}条，输出{t['kept']}条，精确重复{t['dup']}条，"
+                f"近似重复{t['near_dup']}条，清洗后为空{t['empty']}条")
@@ -0,0 +1,474 @@
+import os
+import math
+import hashlib
+import json
+import time
+import uuid
+import socket
+import threading
+
+# 领取：从待办队列左侧弹出，放入处理中列表并登记租约到期时间
+_CLAIM_LUA = """
+local task = redis.call('LPOP', KEYS[1])
+if not task then return nil end
+redis.call('RPUSH', KEYS[2], task)
+redis.call('ZADD', KEYS[3], ARGV[1], task)
+redis.call('HSET', KEYS[4], task, ARGV[2])
+redis.call('HINCRBY', KEYS[5], task, 1)
+return task
+"""
+
+# 续约：只有仍持有租约的worker才能续
+_RENEW_LUA = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[3] then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+return 1
+"""
+
+# 结束租约：移出处理中，写入完成集合或放回队列/失败列表；requeue 放回队列且不计这次领取。
+# ARGV[4]=='0' 时完成的任务只计数不保存；ARGV[5] 为tid时，完成或失败后移出在途集合
+_FINISH_LUA = """
+if redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+if ARGV[3] == 'done' then
+    if ARGV[4] == '1' then
+        redis.call('SADD', KEYS[4], ARGV[1])
+    else
+        redis.call('INCR', KEYS[8])
+    end
+    redis.call('HDEL', KEYS[5], ARGV[1])
+elseif ARGV[3] == 'retry' then
+    redis.call('LPUSH', KEYS[6], ARGV[1])
+elseif ARGV[3] == 'requeue' then
+    redis.call('HINCRBY', KEYS[5], ARGV[1], -1)
+    redis.call('LPUSH', KEYS[6], ARGV[1])
+else
+    redis.call('RPUSH', KEYS[7], ARGV[1])
+    redis.call('HDEL', KEYS[5], ARGV[1])
+end
+if ARGV[5] ~= '' and (ARGV[3] == 'done' or ARGV[3] == 'failed') then
+    redis.call('SREM', KEYS[9], ARGV[5])
+end
+return 1
+"""
+
+# 替换：持有租约的worker把处理中的任务行换成新行（拆分后原任务只剩前半段页码），租约和领取次数随之转移
+_REPLACE_LUA = """
+if redis.call('HGET', KEYS[3], ARGV[1]) ~= ARGV[3] then return 0 end
+local expire = redis.call('ZSCORE', KEYS[2], ARGV[1])
+redis.call('LREM', KEYS[1], 1, ARGV[1])
+redis.call('RPUSH', KEYS[1], ARGV[2])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZADD', KEYS[2], expire, ARGV[2])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[3])
+local attempts = redis.call('HGET', KEYS[4], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+if attempts then redis.call('HSET', KEYS[4], ARGV[2], attempts) end
+redis.call('SADD', KEYS[5], ARGV[2])
+return 1
+"""
+
+# 回收：租约过期（worker崩溃/断网）的任务放回待办队列头部；
+# 已领取 max_attempts 次的任务（每次都把worker拖垮）与 release() 一样移入失败列表
+_RECLAIM_LUA = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local max_attempts = tonumber(ARGV[2])
+for _, task in ipairs(expired) do
+    redis.call('LREM', KEYS[1], 1, task)
+    redis.call('ZREM', KEYS[2], task)
+    redis.call('HDEL', KEYS[3], task)
+    if tonumber(redis.call('HGET', KEYS[5], task) or '0') >= max_attempts then
+        redis.call('RPUSH', KEYS[6], task)
+        redis.call('HDEL', KEYS[5], task)
+        if ARGV[3] == '1' then
+            local tid = cjson.decode(task)['tid']
+            if type(tid) == 'number' then tid = string.format('%d', tid) end
+            if tid then redis.call('SREM', KEYS[7], tid) end
+        end
+    else
+        redis.call('LPUSH', KEYS[4], task)
+    end
+end
+return #expired
+"""
+
+# 批量导入：登记过的任务不重复入队；requeue_done=1 时已完成的任务重新入队，处理中的不受影响
+_LOAD_LUA = """
+local queued, requeued = 0, 0
+for i = 2, #ARGV do
+    local task = ARGV[i]
+    if redis.call('SADD', KEYS[2], task) == 1 then
+        redis.call('RPUSH', KEYS[1], task)
+        queued = queued + 1
+    elseif ARGV[1] == '1' and redis.call('SREM', KEYS[3], task) == 1 then
+        redis.call('RPUSH', KEYS[1], task)
+        requeued = requeued + 1
+    end
+end
+return {queued, requeued}
+"""
+
+
+def make_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def task_line(task):
+    return json.dumps(task, ensure_ascii=False, sort_keys=True)
+
+
+class TaskQueue:
+    """
+    基于Redis的租约式任务队列：
+      <key>             待办任务（list）
+      <key>:processing  处理中任务（list）
+      <key>:leases      任务租约到期时间（zset）
+      <key>:owners      任务 -> 持有租约的worker（hash）
+      <key>:attempts    任务已领取次数（hash）
+      <key>:done        已完成任务（set）；keep_done=False 时不保存，只在 <key>:done_count 计数
+      <key>:failed      多次失败后放弃的任务（list）
+      <key>:workers     worker -> 最近心跳时间（hash）
+      <key>:known       导入过的全部任务（set），重复导入时据此跳过
+      <key>:inflight    track_tids=True 时，在队列中、处理中的帖子tid（set），完成或失败后移出
+    """
+
+    def __init__(self, conn, key, lease_ttl=600, max_attempts=3, keep_done=True, track_tids=False):
+        self.r = conn
+        self.key = key
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.keep_done = keep_done
+        self.track_tids = track_tids
+        self.processing_key = f"{key}:processing"
+        self.leases_key = f"{key}:leases"
+        self.owners_key = f"{key}:owners"
+        self.attempts_key = f"{key}:attempts"
+        self.done_key = f"{key}:done"
+        self.failed_key = f"{key}:failed"
+        self.workers_key = f"{key}:workers"
+        self.known_key = f"{key}:known"
+        self.done_count_key = f"{key}:done_count"
+        self.inflight_key = f"{key}:inflight"
+        self._load = conn.register_script(_LOAD_LUA)
+        self._claim = conn.register_script(_CLAIM_LUA)
+        self._renew = conn.register_script(_RENEW_LUA)
+        self._finish = conn.register_script(_FINISH_LUA)
+        self._replace = conn.register_script(_REPLACE_LUA)
+        self._reclaim = conn.register_script(_RECLAIM_LUA)
+
+    def load(self, lines, requeue_done=False, batch_size=500):
+        """
+        追加导入任务行，返回 (新入队数, 重新入队数)。不清空队列，可在worker运行中导入；
+        同一批任务重复导入是幂等的。每 batch_size 行一次脚本调用，全部调用走同一个pipeline
+        """
+        lines = list(dict.fromkeys(lines))
+        if not lines:
+            return 0, 0
+        if not self.r.exists(self.known_key):
+            self._seed_known()
+        pipe = self.r.pipeline(transaction=False)
+        for i in range(0, len(lines), batch_size):
+            self._load(keys=[self.key, self.known_key, self.done_key],
+                       args=["1" if requeue_done else "0", *lines[i:i + batch_size]], client=pipe)
+        results = pipe.execute()
+        return sum(r[0] for r in results), sum(r[1] for r in results)
+
+    def _seed_known(self):
+        """旧队列没有登记集合时，先把待办/处理中/已完成/失败的任务都登记进去"""
+        pipe = self.r.pipeline(transaction=False)
+        pipe.lrange(self.key, 0, -1)
+        pipe.lrange(self.processing_key, 0, -1)
+        pipe.smembers(self.done_key)
+        pipe.lrange(self.failed_key, 0, -1)
+        existing = set()
+        for items in pipe.execute():
+            existing.update(items)
+        if existing:
+            self.r.sadd(self.known_key, *existing)
+
+    def reclaim_expired(self):
+        return self._reclaim(
+            keys=[self.processing_key, self.leases_key, self.owners_key, self.key,
+                  self.attempts_key, self.failed_key, self.inflight_key],
+            args=[time.time(), self.max_attempts, "1" if self.track_tids else "0"],
+        )
+
+    def claim(self, worker_id):
+        """领取一个任务，返回 TaskLease 或 None"""
+        reclaimed = self.reclaim_expired()
+        line = self._claim(
+            keys=[self.key, self.processing_key, self.leases_key, self.owners_key, self.attempts_key],
+            args=[time.time() + self.lease_ttl, worker_id],
+        )
+        if not line:
+            return None
+        return TaskLease(self, worker_id, line, reclaimed=reclaimed)
+
+    def renew(self, worker_id, line):
+        self.r.hset(self.workers_key, worker_id, time.time())
+        return bool(self._renew(
+            keys=[self.leases_key, self.owners_key],
+            args=[line, time.time() + self.lease_ttl, worker_id],
+        ))
+
+    def replace(self, worker_id, line, new_line):
+        return bool(self._replace(
+            keys=[self.processing_key, self.leases_key, self.owners_key, self.attempts_key, self.known_key],
+            args=[line, new_line, worker_id],
+        ))
+
+    def finish(self, worker_id, line, outcome, tid=None):
+        return bool(self._finish(
+            keys=[self.processing_key, self.leases_key, self.owners_key, self.done_key,
+                  self.attempts_key, self.key, self.failed_key, self.done_count_key, self.inflight_key],
+            args=[line, worker_id, outcome, "1" if self.keep_done else "0",
+                  str(tid) if self.track_tids and tid is not None else ""],
+        ))
+
+    def attempts(self, line):
+        return int(self.r.hget(self.attempts_key, line) or 0)
+
+    def stats(self):
+        pipe = self.r.pipeline(transaction=False)
+        pipe.llen(self.key)
+        pipe.llen(self.processing_key)
+        pipe.scard(self.done_key)
+        pipe.get(self.done_count_key)
+        pipe.llen(self.failed_key)
+        pending, processing, done, done_count, failed = pipe.execute()
+        return {"pending": pending, "processing": processing, "done": done + int(done_count or 0), "failed": failed}
+
+
+class TaskLease:
+    """
+    一个已领取任务的租约。with块内后台线程定期续约，
+    完整采完才调用 done()，异常时 release() 放回队列（超过 max_attempts 次记为失败）；
+    没有可用Cookie/代理等与任务本身无关的中止用 requeue()，不计入失败次数
+    """
+
+    def __init__(self, queue, worker_id, line, reclaimed=0):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.line = line
+        self.task = json.loads(line)
+        self.reclaimed = reclaimed
+        self.finished = False
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _heartbeat(self):
+        interval = max(1, self.queue.lease_ttl // 3)
+        while not self._stop.wait(interval):
+            try:
+                line = self.line
+                if not self.queue.renew(self.worker_id, line) and line == self.line:
+                    self.lost = True  # 租约已被回收，任务可能已交给其他worker
+                    return
+            except Exception:
+                pass
+
+    def __enter__(self):
+        self.queue.renew(self.worker_id, self.line)
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if not self.finished:
+            self.release()
+        return False
+
+    def done(self):
+        """记为完成，返回是否成功；租约已被回收时不记，由重新领到它的worker完成"""
+        self.finished = True
+        if self.lost:
+            return False
+        return self._finish("done")
+
+    def release(self):
+        self.finished = True
+        if self.queue.attempts(self.line) >= self.queue.max_attempts:
+            return self._finish("failed")
+        return self._finish("retry")
+
+    def requeue(self):
+        self.finished = True
+        return self._finish("requeue")
+
+    def update(self, task):
+        """把租约下的任务改成 task（如拆分后缩小页码范围），租约被回收后再次领取的worker只做改后的部分"""
+        line = task_line(task)
+        if line == self.line or not self.queue.replace(self.worker_id, self.line, line):
+            return False
+        self.line, self.task = line, task
+        return True
+
+    def _finish(self, outcome):
+        return self.queue.finish(self.worker_id, self.line, outcome, tid=self.task.get("tid"))
+
+
+# 去重并入队：tid没采过（不在已见集合）且不在队列中（加入在途集合成功）时才推入帖子队列。
+# 已见集合只在帖子保存后登记，最终失败的帖子下次被列表页发现时还会重新入队。
+# ARGV[1]=='0' 时不查已见集合（增量重爬有新回复的老帖子），之后每个帖子依次为 tid, 任务行
+_PUSH_NEW_SET_LUA = """
+local queued = 0
+for i = 2, #ARGV, 2 do
+    if (ARGV[1] == '0' or redis.call('SISMEMBER', KEYS[1], ARGV[i]) == 0)
+            and redis.call('SADD', KEYS[3], ARGV[i]) == 1 then
+        redis.call('RPUSH', KEYS[2], ARGV[i + 1])
+        queued = queued + 1
+    end
+end
+return queued
+"""
+
+# Bloom过滤器版：ARGV[2]为哈希个数k，之后每个帖子依次为 tid, 任务行, k个位偏移；k位全为1视为已见
+_PUSH_NEW_BLOOM_LUA = """
+local k = tonumber(ARGV[2])
+local queued = 0
+local i = 3
+while i <= #ARGV do
+    local seen = ARGV[1] ~= '0'
+    if seen then
+        for j = 1, k do
+            if redis.call('GETBIT', KEYS[1], ARGV[i + 1 + j]) == 0 then
+                seen = false
+                break
+            end
+        end
+    end
+    if not seen and redis.call('SADD', KEYS[3], ARGV[i]) == 1 then
+        redis.call('RPUSH', KEYS[2], ARGV[i + 1])
+        queued = queued + 1
+    end
+    i = i + k + 2
+end
+return queued
+"""
+
+
+class RedisSeenSet:
+    """按tid全局去重的已见集合（Redis set，精确）"""
+
+    def __init__(self, conn, key):
+        self.r = conn
+        self.key = key
+        self._push_new = conn.register_script(_PUSH_NEW_SET_LUA)
+
+    def contains(self, tid):
+        return bool(self.r.sismember(self.key, tid))
+
+    def add(self, tid):
+        return bool(self.r.sadd(self.key, tid))
+
+    def push_new(self, queue_key, inflight_key, items, check_seen=True):
+        args = ["1" if check_seen else "0"]
+        for tid, line in items:
+            args += [tid, line]
+        return self._push_new(keys=[self.key, queue_key, inflight_key], args=args) if len(args) > 1 else 0
+
+
+class RedisBloomSeenSet:
+    """
+    基于Redis位图的Bloom过滤器，百万到千万级tid只占十几MB内存，
+    有 error_rate 的概率把新帖误判为已见
+    """
+
+    def __init__(self, conn, key, capacity=10_000_000, error_rate=0.001):
+        self.r = conn
+        self.key = key
+        self.bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._push_new = conn.register_script(_PUSH_NEW_BLOOM_LUA)
+
+    def _offsets(self, tid):
+        digest = hashlib.md5(str(tid).encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def contains(self, tid):
+        pipe = self.r.pipeline(transaction=False)
+        for off in self._offsets(tid):
+            pipe.getbit(self.key, off)
+        return all(pipe.execute())
+
+    def add(self, tid):
+        pipe = self.r.pipeline(transaction=False)
+        for off in self._offsets(tid):
+            pipe.setbit(self.key, off, 1)
+        return not all(pipe.execute())
+
+    def push_new(self, queue_key, inflight_key, items, check_seen=True):
+        args = ["1" if check_seen else "0", self.hashes]
+        for tid, line in items:
+            args += [tid, line] + self._offsets(tid)
+        return self._push_new(keys=[self.key, queue_key, inflight_key], args=args) if len(args) > 2 else 0
+
+
+class ThreadFrontier:
+    """
+    两级任务中的帖子级共享队列：列表页任务把新发现的帖子按tid去重后推入，
+    任何worker都可以像领取列表页任务一样租约领取单个帖子。
+    queue 需以 keep_done=False, track_tids=True 创建：完成的帖子任务不再逐条保存，
+    同一tid在队列中时不会重复入队
+    """
+
+    def __init__(self, queue, seen):
+        self.queue = queue
+        self.seen = seen
+
+    @staticmethod
+    def thread_task(bar, thread):
+        return task_line({"type": "thread", "bar": bar, "tid": thread.tid, "title": thread.title,
+                          "url": thread.url, "reply_num": thread.reply_num})
+
+    def push_threads(self, bar, threads, force=False):
+        """
+        把帖子推入队列，返回实际入队数。默认只推tid未见过的帖子；
+        force=True 时不查已见集合（增量重爬有新回复的老帖子），仍不会与队列中的同一帖子重复
+        """
+        return self.seen.push_new(self.queue.key, self.queue.inflight_key,
+                                  [(t.tid, self.thread_task(bar, t)) for t in threads], check_seen=not force)
+
+
+class ThreadStateStore:
+    """
+    每个帖子的采集进度（Redis hash，tid -> JSON）：
+    reply_num 上次看到的回复数，last_floor 已采到的最大楼层，last_page 最后一页页码，crawled_at 采集时间
+    """
+
+    def __init__(self, conn, key):
+        self.r = conn
+        self.key = key
+
+    def get(self, tid):
+        raw = self.r.hget(self.key, tid)
+        return json.loads(raw) if raw else None
+
+    def get_many(self, tids):
+        if not tids:
+            return []
+        return [json.loads(raw) if raw else None for raw in self.r.hmget(self.key, tids)]
+
+    def update(self, tid, reply_num=None, last_floor=None, last_page=None):
+        state = self.get(tid) or {}
+        if reply_num is not None:
+            state["reply_num"] = reply_num
+        if last_floor is not None:
+            state["last_floor"] = max(last_floor, state.get("last_floor") or 0)
+        if last_page is not None:
+            state["last_page"] = last_page
+        state["crawled_at"] = time.time()
+        self.r.hset(self.key, tid, json.dumps(state))
+        return state
+
+    @staticmethod
+    def is_unchanged(thread, state):
+        return (state is not None and thread.reply_num is not None
+                and state.get("reply_num") is not None and thread.reply_num <= state["reply_num"])